@@ -0,0 +1,237 @@
+import os
+import argparse
+import glob
+import importlib.util
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from common_utils import (
+    CWD,
+    FORMAT_TIMINGS_FILE,
+    arrow_dataset,
+    dataset_format,
+    table_path as dataset_table_path,
+)
+from schema import arrow_columns
+
+# Times how long each engine takes to load the tables of datasets written with
+# generate_data_pq.py --format, cold (page cache evicted) and warm. The pandas,
+# modin and dask times are those of the read_table of their query runners,
+# which also convert the dates and money columns for the queries.
+
+tables = list(arrow_columns)
+
+
+def table_files(path, table_name, file_format):
+    table_path = dataset_table_path(path, table_name, file_format)
+    if os.path.isfile(table_path):
+        return table_path, [table_path]
+    files = sorted(
+        f
+        for f in glob.glob(os.path.join(table_path, "**", "*"), recursive=True)
+        if os.path.isfile(f) and not os.path.basename(f).startswith("_")
+        and "/_" not in f[len(table_path) :]
+    )
+    return table_path, files
+
+
+def evict_page_cache(files):
+    # drop the cached pages of the files, so the next read goes to disk
+    for f in files:
+        fd = os.open(f, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def read_pages(table):
+    # sum every byte of the column buffers. Uncompressed IPC files are memory
+    # mapped and not copied, so their reads would otherwise only map the
+    # files and fault in almost no page, while other formats decode all data.
+    for column in table.columns:
+        for chunk in column.chunks:
+            for buffer in chunk.buffers():
+                if buffer is not None:
+                    np.frombuffer(buffer, dtype=np.uint8).sum()
+    return table
+
+
+def read_pyarrow(table_name, table_path, files, file_format):
+    return read_pages(arrow_dataset(table_path, table_name, file_format).to_table())
+
+
+def query_runner(module):
+    # a query runner next to this script, imported by path as the engine
+    # folders shadow the engines' packages
+    spec = importlib.util.spec_from_file_location(
+        module.rsplit("/", 1)[1], os.path.join(CWD, f"{module}.py")
+    )
+    runner = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(runner)
+    return runner
+
+
+runners = {}
+
+
+def runner_engine(engine, module, compute=False):
+    # reader and version of an engine timed with the read_table of its query
+    # runner. The runner is imported with the version, outside the timings.
+    def version():
+        engine_version = importlib.import_module(engine).__version__
+        runners[module] = query_runner(module)
+        return engine_version
+
+    def read(table_name, table_path, files, file_format):
+        df = runners[module].read_table(table_path, table_name, file_format)
+        return df.compute() if compute else df
+
+    return read, version
+
+
+def read_polars(table_name, table_path, files, file_format):
+    import polars as pl
+
+    if file_format == "parquet":
+        return pl.concat([pl.read_parquet(f) for f in files], how="diagonal")
+    if file_format in ("feather", "ipc-uncompressed"):
+        df = pl.concat(
+            [pl.read_ipc(f, memory_map=True) for f in files], how="diagonal"
+        )
+        read_pages(df.to_arrow())
+        return df
+    return pl.concat(
+        [pl.read_csv(f, try_parse_dates=True) for f in files], how="diagonal"
+    )
+
+
+def polars_version():
+    import polars as pl
+
+    return pl.__version__
+
+
+# formats an engine has no reader for, skipped by the benchmark
+unsupported_formats = {
+    "polars": {"orc"},
+}
+
+engine_readers = {
+    "pyarrow": (read_pyarrow, lambda: pa.__version__),
+    "pandas": runner_engine("pandas", "pandas/pandas_query"),
+    "modin": runner_engine("modin", "modin/modin_ray_query"),
+    "dask": runner_engine("dask", "dask/dask_query", compute=True),
+    "polars": (read_polars, polars_version),
+}
+
+
+def append_timing(engine, version, file_format, table_name, cache, secs, rows):
+    with open(FORMAT_TIMINGS_FILE, "a") as f:
+        if f.tell() == 0:
+            f.write("engine,version,format,table,cache,duration[s],rows\n")
+        f.write(
+            f"{engine},{version},{file_format},{table_name},{cache},{secs},{rows}\n"
+        )
+
+
+def run_benchmark(paths, engines, table_names, repeat, log_timing):
+    results = []
+    for path in paths:
+        file_format = dataset_format(path)
+        for engine in engines:
+            read, version = engine_readers[engine]
+            try:
+                version = version()
+            except (ImportError, AttributeError):
+                # the engine folders next to this script shadow packages
+                # that are not installed
+                print(f"{engine} is not installed, skipping")
+                continue
+            if file_format in unsupported_formats.get(engine, ()):
+                print(f"{engine} cannot read {file_format}, skipping")
+                continue
+            for table_name in table_names:
+                table_path, files = table_files(path, table_name, file_format)
+                if not files:
+                    continue
+                # the first read after evicting the page cache is cold, the
+                # following reads find the files in memory
+                evict_page_cache(files)
+                for i in range(repeat + 1):
+                    cache = "cold" if i == 0 else "warm"
+                    t1 = time.time()
+                    rows = len(read(table_name, table_path, files, file_format))
+                    dur = time.time() - t1
+                    results.append(
+                        (engine, file_format, table_name, cache, dur, rows)
+                    )
+                    if log_timing:
+                        append_timing(
+                            engine, version, file_format, table_name, cache, dur, rows
+                        )
+                    print(f"{engine},{file_format},{table_name},{cache},{dur}")
+    df = pd.DataFrame(
+        results,
+        columns=["engine", "format", "table", "cache", "duration[s]", "rows"],
+    )
+    # total load time of all tables, warm reads averaged
+    summary = (
+        df.groupby(["engine", "format", "cache", "table"])["duration[s]"]
+        .mean()
+        .groupby(["engine", "format", "cache"])
+        .sum()
+        .unstack("cache")
+    )
+    print(summary)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare table load times across dataset formats."
+    )
+    parser.add_argument(
+        "--paths",
+        type=str,
+        nargs="+",
+        required=True,
+        help="datasets generated with different --format values.",
+    )
+    parser.add_argument(
+        "--engines",
+        type=str,
+        nargs="+",
+        choices=list(engine_readers),
+        default=list(engine_readers),
+        help="engines whose readers to time.",
+    )
+    parser.add_argument(
+        "--tables",
+        type=str,
+        nargs="+",
+        choices=tables,
+        default=tables,
+        help="tables to load.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="number of warm reads after the cold one.",
+    )
+    parser.add_argument(
+        "--log_timing",
+        action="store_true",
+        help="log time metrics or not.",
+    )
+    args = parser.parse_args()
+    run_benchmark(args.paths, args.engines, args.tables, args.repeat, args.log_timing)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import random
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
+
+from benchmark_formats import evict_page_cache, table_files
+from common_utils import INDEX_TIMINGS_FILE
+
+# Measures the I/O and time of point lookups and selective semi-joins on key
+# and date columns, for datasets written with and without
+# generate_data_pq.py --page_index and --bloom_filter. Every lookup is run
+# once with the files evicted from the page cache, counting the bytes read
+# from disk, and then --repeat times warm.
+
+table_prefixes = {
+    "L": "lineitem",
+    "O": "orders",
+    "PS": "partsupp",
+    "P": "part",
+    "C": "customer",
+    "S": "supplier",
+    "N": "nation",
+    "R": "region",
+}
+
+default_columns = [
+    "L_ORDERKEY",
+    "L_PARTKEY",
+    "L_SHIPDATE",
+    "O_ORDERKEY",
+    "O_CUSTKEY",
+    "P_PARTKEY",
+    "C_CUSTKEY",
+]
+
+
+def column_table(column):
+    return table_prefixes[column.split("_")[0]]
+
+
+def lookup_keys(files, column, num_keys, seed):
+    # values of the column drawn from random row groups of the table
+    rng = random.Random(seed)
+    keys = []
+    while len(keys) < num_keys:
+        pf = pq.ParquetFile(rng.choice(files))
+        row_group = rng.randrange(pf.num_row_groups)
+        values = pf.read_row_group(row_group, columns=[column])[column]
+        keys.append(values[rng.randrange(len(values))].as_py())
+    return keys
+
+
+def disk_read_bytes():
+    # bytes this process read from disk, page faults of mmaps included
+    with open("/proc/self/io") as f:
+        for line in f:
+            if line.startswith("read_bytes:"):
+                return int(line.split()[1])
+    return 0
+
+
+def lookup_pyarrow(files, column, keys):
+    # row groups are skipped by their min/max statistics only
+    dataset = pads.dataset(files, format="parquet")
+    keys = pa.array(keys, dataset.schema.field(column).type)
+    return dataset.to_table(filter=pads.field(column).isin(keys))
+
+
+def lookup_pyarrow_bloom(files, column, keys):
+    # pyarrow does not read bloom filters, so parse and probe them here in
+    # pure Python before reading the row groups that may contain a key.
+    # check_bloom_filters.py checks this against files written with them.
+    tables = []
+    for path in files:
+        pf = pq.ParquetFile(path)
+        i = pf.schema_arrow.get_field_index(column)
+        keys_array = pa.array(keys, pf.schema_arrow.field(i).type)
+        physical_type = pf.metadata.schema.column(i).physical_type
+        row_groups = []
+        with open(path, "rb") as f:
+            for row_group in range(pf.num_row_groups):
+                chunk = pf.metadata.row_group(row_group).column(i)
+                if row_group_may_contain(f, chunk, keys, physical_type):
+                    row_groups.append(row_group)
+        if row_groups:
+            table = pf.read_row_groups(row_groups)
+            tables.append(table.filter(pc.is_in(table[column], value_set=keys_array)))
+    return pa.concat_tables(tables) if tables else []
+
+
+def row_group_may_contain(f, chunk, keys, physical_type):
+    stats = chunk.statistics
+    if stats is not None and stats.has_min_max:
+        keys = [k for k in keys if stats.min <= k <= stats.max]
+        if not keys:
+            return False
+    if chunk.bloom_filter_offset is None or not chunk.bloom_filter_length:
+        return True
+    f.seek(chunk.bloom_filter_offset)
+    blocks = bloom_filter_blocks(f.read(chunk.bloom_filter_length))
+    return any(
+        bloom_filter_contains(blocks, plain_bytes(key, physical_type)) for key in keys
+    )
+
+
+def bloom_filter_blocks(data):
+    # the bitset of a split-block bloom filter, as 32-byte blocks of eight
+    # words. The thrift header starts with numBytes (field 1, i32) as a
+    # zigzag varint and the bitset fills the rest.
+    assert data[0] == 0x15, "unexpected bloom filter header"
+    value = shift = 0
+    for pos in range(1, 6):
+        value |= (data[pos] & 0x7F) << shift
+        shift += 7
+        if not data[pos] & 0x80:
+            break
+    num_bytes = (value >> 1) ^ -(value & 1)
+    bitset = np.frombuffer(data[len(data) - num_bytes :], dtype="<u4")
+    return bitset.reshape(-1, 8)
+
+
+bloom_salt = [
+    0x47B6137B,
+    0x44974D91,
+    0x8824AD5B,
+    0xA2B7289D,
+    0x705495C7,
+    0x2DF1424B,
+    0x9EFC4947,
+    0x5C6BFB31,
+]
+
+
+def bloom_filter_contains(blocks, value):
+    h = xxh64(value)
+    block = blocks[((h >> 32) * len(blocks)) >> 32]
+    key = h & 0xFFFFFFFF
+    for word, salt in zip(block, bloom_salt):
+        if not int(word) >> (((key * salt) & 0xFFFFFFFF) >> 27) & 1:
+            return False
+    return True
+
+
+def plain_bytes(value, physical_type):
+    # PLAIN encoding of a value, which is what bloom filters hash
+    if physical_type == "INT32":
+        if hasattr(value, "toordinal"):
+            value = value.toordinal() - 719163  # days since 1970-01-01
+        return struct.pack("<i", value)
+    if physical_type == "INT64":
+        return struct.pack("<q", value)
+    if physical_type == "DOUBLE":
+        return struct.pack("<d", value)
+    return value.encode() if isinstance(value, str) else bytes(value)
+
+
+xxh_primes = [
+    11400714785074694791,
+    14029467366897019727,
+    1609587929392839161,
+    9650029242287828579,
+    2870177450012600261,
+]
+mask64 = (1 << 64) - 1
+
+
+def rotl64(x, r):
+    return ((x << r) | (x >> (64 - r))) & mask64
+
+
+def xxh64_round(acc, lane):
+    acc = (acc + lane * xxh_primes[1]) & mask64
+    return (rotl64(acc, 31) * xxh_primes[0]) & mask64
+
+
+def xxh64(data, seed=0):
+    # XXH64, the hash of parquet bloom filters
+    p1, p2, p3, p4, p5 = xxh_primes
+    n, pos = len(data), 0
+    if n >= 32:
+        acc = [seed + p1 + p2, seed + p2, seed, seed - p1]
+        acc = [a & mask64 for a in acc]
+        while pos + 32 <= n:
+            for i in range(4):
+                lane = int.from_bytes(data[pos + 8 * i : pos + 8 * i + 8], "little")
+                acc[i] = xxh64_round(acc[i], lane)
+            pos += 32
+        h = sum(rotl64(a, r) for a, r in zip(acc, [1, 7, 12, 18])) & mask64
+        for a in acc:
+            h = ((h ^ xxh64_round(0, a)) * p1 + p4) & mask64
+    else:
+        h = (seed + p5) & mask64
+    h = (h + n) & mask64
+    while pos + 8 <= n:
+        lane = int.from_bytes(data[pos : pos + 8], "little")
+        h = (rotl64(h ^ xxh64_round(0, lane), 27) * p1 + p4) & mask64
+        pos += 8
+    if pos + 4 <= n:
+        lane = int.from_bytes(data[pos : pos + 4], "little")
+        h = (rotl64(h ^ (lane * p1 & mask64), 23) * p2 + p3) & mask64
+        pos += 4
+    while pos < n:
+        h = (rotl64(h ^ (data[pos] * p5 & mask64), 11) * p1) & mask64
+        pos += 1
+    h = ((h ^ (h >> 33)) * p2) & mask64
+    h = ((h ^ (h >> 29)) * p3) & mask64
+    return h ^ (h >> 32)
+
+
+def lookup_polars(files, column, keys):
+    import polars as pl
+
+    return pl.scan_parquet(files).filter(pl.col(column).is_in(keys)).collect()
+
+
+def lookup_duckdb(files, column, keys):
+    # duckdb through ibis, like ibis/ibis_duckdb_query.py
+    import ibis
+
+    con = ibis.duckdb.connect()
+    t = con.read_parquet(files)
+    return t.filter(t[column].isin(keys)).execute()
+
+
+def polars_version():
+    import polars as pl
+
+    return pl.__version__
+
+
+def duckdb_version():
+    import duckdb
+    import ibis
+
+    return f"{duckdb.__version__} (ibis {ibis.__version__})"
+
+
+engine_lookups = {
+    "pyarrow": (lookup_pyarrow, lambda: pa.__version__),
+    "pyarrow-bloom": (lookup_pyarrow_bloom, lambda: pa.__version__),
+    "polars": (lookup_polars, polars_version),
+    "duckdb": (lookup_duckdb, duckdb_version),
+}
+
+
+def append_timing(engine, version, path, column, num_keys, cache, secs, mb, rows):
+    with open(INDEX_TIMINGS_FILE, "a") as f:
+        if f.tell() == 0:
+            f.write(
+                "engine,version,dataset,column,keys,cache,duration[s],read_mb,rows\n"
+            )
+        f.write(
+            f"{engine},{version},{path},{column},{num_keys},{cache},{secs},{mb},"
+            f"{rows}\n"
+        )
+
+
+def run_benchmark(paths, engines, columns, num_keys, repeat, seed, log_timing):
+    results = []
+    for column in columns:
+        table_name = column_table(column)
+        # the same keys for every dataset and engine
+        _, files = table_files(paths[0], table_name, "parquet")
+        keys = {n: lookup_keys(files, column, n, seed) for n in num_keys}
+        for path in paths:
+            _, files = table_files(path, table_name, "parquet")
+            for engine in engines:
+                lookup, version = engine_lookups[engine]
+                try:
+                    version = version()
+                except (ImportError, AttributeError):
+                    # the engine folders next to this script shadow packages
+                    # that are not installed
+                    print(f"{engine} is not installed, skipping")
+                    continue
+                for n in num_keys:
+                    evict_page_cache(files)
+                    for i in range(repeat + 1):
+                        cache = "cold" if i == 0 else "warm"
+                        read_bytes = disk_read_bytes()
+                        t1 = time.time()
+                        rows = len(lookup(files, column, keys[n]))
+                        dur = time.time() - t1
+                        mb = (disk_read_bytes() - read_bytes) / 1024 / 1024
+                        results.append((engine, path, column, n, cache, dur, mb, rows))
+                        if log_timing:
+                            append_timing(
+                                engine, version, path, column, n, cache, dur, mb, rows
+                            )
+                        print(f"{engine},{path},{column},{n},{cache},{dur},{mb:.1f}")
+    df = pd.DataFrame(
+        results,
+        columns=[
+            "engine",
+            "dataset",
+            "column",
+            "keys",
+            "cache",
+            "duration[s]",
+            "read_mb",
+            "rows",
+        ],
+    )
+    # MB read from disk by the cold lookups, and the warm lookup time
+    cold = df[df["cache"] == "cold"].set_index(["engine", "column", "keys", "dataset"])
+    warm = df[df["cache"] == "warm"].groupby(["engine", "column", "keys", "dataset"])
+    summary = pd.concat(
+        [
+            cold["read_mb"].unstack("dataset"),
+            warm["duration[s]"].mean().unstack("dataset"),
+        ],
+        axis=1,
+        keys=["cold read MB", "warm s"],
+    )
+    with pd.option_context(
+        "display.width", 200, "display.max_rows", None, "display.max_columns", None
+    ):
+        print(summary.round(3))
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the I/O of selective lookups with and without "
+        "parquet page indexes and bloom filters."
+    )
+    parser.add_argument(
+        "--paths",
+        type=str,
+        nargs="+",
+        required=True,
+        help="datasets of the same SF, generated with different --page_index "
+        "and --bloom_filter values.",
+    )
+    parser.add_argument(
+        "--engines",
+        type=str,
+        nargs="+",
+        choices=list(engine_lookups),
+        default=list(engine_lookups),
+        help="engines whose lookups to measure.",
+    )
+    parser.add_argument(
+        "--columns",
+        type=str,
+        nargs="+",
+        default=default_columns,
+        help="columns to look up keys in.",
+    )
+    parser.add_argument(
+        "--keys",
+        type=int,
+        nargs="+",
+        default=[1, 10],
+        help="numbers of keys per lookup: 1 is a point lookup, more a semi-join.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="number of warm lookups after the cold one.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="seed of the random choice of the keys.",
+    )
+    parser.add_argument(
+        "--log_timing",
+        action="store_true",
+        help="log time metrics or not.",
+    )
+    args = parser.parse_args()
+    for column in args.columns:
+        if column.split("_")[0] not in table_prefixes:
+            parser.error(f"--columns: {column} is not a TPC-H column")
+    run_benchmark(
+        args.paths,
+        args.engines,
+        args.columns,
+        args.keys,
+        args.repeat,
+        args.seed,
+        args.log_timing,
+    )
+
+
+if __name__ == "__main__":
+    main()
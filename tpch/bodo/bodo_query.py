@@ -1,3 +1,5 @@
+import os
+import sys
 import argparse
 import json
 import time
@@ -7,6 +9,11 @@ import bodo
 
 from utils import append_row
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+from common_utils import dataset_info
+
 dataset_dict = {}
 
 @bodo.jit
@@ -1257,6 +1264,11 @@ def main():
     # path to TPC-H data in parquet.
     path = args.path
     print(f"Path: {path}")
+    # the jitted loaders cannot call common_utils.decode_money, so the money
+    # columns must already be float64
+    money = dataset_info(path).get("money", "float")
+    if money != "float":
+        parser.error(f"bodo cannot read --money {money} datasets")
 
     # credentials to access the datasource.
     storage_options = {}
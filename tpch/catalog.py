@@ -0,0 +1,143 @@
+import base64
+import datetime
+import decimal
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# per-column statistics of a generated dataset, kept in <folder>/_catalog.json.
+# Distinct counts are estimated with HyperLogLog sketches that every worker
+# builds for its piece, so they can be merged without rescanning the data.
+
+catalog_file = "_catalog.json"
+
+# 2**10 registers per column, about 3% standard error
+hll_precision = 10
+hll_registers = 1 << hll_precision
+
+
+def column_hashes(column):
+    # 64 bit hashes of the values of an arrow column, nulls excluded
+    column = column.drop_null()
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    if pa.types.is_decimal(column.type):
+        column = column.cast(pa.float64())
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        # hash each distinct string once
+        encoded = pc.dictionary_encode(column).combine_chunks()
+        hashes = pd.util.hash_array(
+            encoded.dictionary.to_numpy(zero_copy_only=False), categorize=False
+        )
+        return hashes[encoded.indices.to_numpy()]
+    return pd.util.hash_array(column.to_numpy(), categorize=False)
+
+
+def hll_sketch(column):
+    registers = np.zeros(hll_registers, dtype=np.uint8)
+    hashes = column_hashes(column)
+    if len(hashes) == 0:
+        return registers
+    index = hashes >> np.uint64(64 - hll_precision)
+    rest = hashes << np.uint64(hll_precision)
+    # position of the first set bit in the remaining 64 - p bits
+    rank = np.full(len(hashes), 64 - hll_precision + 1, dtype=np.uint8)
+    nonzero = rest != 0
+    rank[nonzero] = 64 - np.floor(np.log2(rest[nonzero].astype(np.float64)))
+    np.maximum.at(registers, index, rank)
+    return registers
+
+
+def table_sketches(table):
+    return {name: hll_sketch(table[name]) for name in table.column_names}
+
+
+def merge_sketches(sketches, other):
+    for name, registers in other.items():
+        if name in sketches:
+            sketches[name] = np.maximum(sketches[name], registers)
+        else:
+            sketches[name] = registers
+    return sketches
+
+
+def hll_estimate(registers):
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros:
+        # small range correction
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def encode_sketches(sketches):
+    return {
+        name: base64.b64encode(registers.tobytes()).decode()
+        for name, registers in sketches.items()
+    }
+
+
+def decode_sketches(encoded):
+    return {
+        name: np.frombuffer(base64.b64decode(data), dtype=np.uint8).copy()
+        for name, data in encoded.items()
+    }
+
+
+def to_json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode(errors="replace")
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def table_statistics(metadata, sketches=None):
+    # row counts and per-column min/max/null counts from the row group
+    # statistics of a (combined) parquet footer
+    schema = metadata.schema.to_arrow_schema()
+    columns = {}
+    for i, field in enumerate(schema):
+        stats = {"type": str(field.type), "min": None, "max": None, "null_count": 0}
+        for rg in range(metadata.num_row_groups):
+            chunk = metadata.row_group(rg).column(i).statistics
+            if chunk is None:
+                stats["null_count"] = None
+                continue
+            if stats["null_count"] is not None and chunk.has_null_count:
+                stats["null_count"] += chunk.null_count
+            if chunk.has_min_max:
+                lo, hi = to_json_value(chunk.min), to_json_value(chunk.max)
+                if stats["min"] is None or lo < stats["min"]:
+                    stats["min"] = lo
+                if stats["max"] is None or hi > stats["max"]:
+                    stats["max"] = hi
+        if sketches and field.name in sketches:
+            stats["distinct_count"] = hll_estimate(sketches[field.name])
+        else:
+            stats["distinct_count"] = None
+        columns[field.name] = stats
+    return {
+        "rows": metadata.num_rows,
+        "row_groups": metadata.num_row_groups,
+        "columns": columns,
+    }
+
+
+def load_catalog(root):
+    # the catalog written next to a local dataset, or None
+    path = os.path.join(root, catalog_file)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,152 @@
+import os
+import argparse
+import sys
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import numpy_dbgen
+from benchmark_indexes import (
+    bloom_filter_blocks,
+    bloom_filter_contains,
+    plain_bytes,
+    xxh64,
+)
+from generate_data_pq import write_file
+
+# Checks the bloom filter reading of benchmark_indexes.py, which pyarrow does
+# not do: its XXH64 against the test vectors of the reference implementation,
+# and the filters of files written like generate_data_pq.py --bloom_filter.
+# Every key of a row group must hit the filter of the row group, and keys
+# that are not in the table must miss it about as often as the false
+# positive rate allows.
+
+# (data, seed, XXH64) from the xxHash sanity checks. The inputs of 32 bytes
+# and more take the four lane loop.
+xxh64_vectors = [
+    (b"", 0, 0xEF46DB3751D8E999),
+    (b"a", 0, 0xD24EC4F1A98C6E5B),
+    (b"abc", 0, 0x44BC2CF5AD770999),
+    (b"Nobody inspects the spammish repetition", 0, 0xFBCEA83C8A378BF1),
+]
+
+# int32 dates, int64 keys, doubles and strings
+columns = {
+    "lineitem": ["L_ORDERKEY", "L_PARTKEY", "L_SHIPDATE", "L_EXTENDEDPRICE"],
+    "customer": ["C_CUSTKEY", "C_NAME", "C_PHONE"],
+}
+
+# the filters are written for 1% false positives
+max_false_positive_rate = 0.03
+
+
+def check_xxh64():
+    return [
+        f"xxh64({data!r}, {seed}) is {xxh64(data, seed):#x}, expected {expected:#x}"
+        for data, seed, expected in xxh64_vectors
+        if xxh64(data, seed) != expected
+    ]
+
+
+def row_group_filters(path, column):
+    # (physical type, values, bloom filter blocks) of every row group of a
+    # column
+    pf = pq.ParquetFile(path)
+    i = pf.schema_arrow.get_field_index(column)
+    physical_type = pf.metadata.schema.column(i).physical_type
+    with open(path, "rb") as f:
+        for row_group in range(pf.num_row_groups):
+            chunk = pf.metadata.row_group(row_group).column(i)
+            if chunk.bloom_filter_offset is None:
+                yield physical_type, None, None
+                continue
+            f.seek(chunk.bloom_filter_offset)
+            blocks = bloom_filter_blocks(f.read(chunk.bloom_filter_length))
+            values = pf.read_row_group(row_group, columns=[column])[column]
+            yield physical_type, values.unique().to_pylist(), blocks
+
+
+def check_filters(path, column, absent):
+    failures = []
+    misses = checked = 0
+    filters = row_group_filters(path, column)
+    for row_group, (physical_type, values, blocks) in enumerate(filters):
+        if blocks is None:
+            failures.append(f"{column}: row group {row_group} has no bloom filter")
+            continue
+        missing = [
+            v
+            for v in values
+            if not bloom_filter_contains(blocks, plain_bytes(v, physical_type))
+        ]
+        if missing:
+            failures.append(
+                f"{column}: {len(missing)} keys of row group {row_group} miss its "
+                f"bloom filter, the first is {missing[0]!r}"
+            )
+        values = set(values)
+        for v in absent:
+            if v not in values:
+                checked += 1
+                misses += not bloom_filter_contains(
+                    blocks, plain_bytes(v, physical_type)
+                )
+    rate = 1 - misses / checked
+    if rate > max_false_positive_rate:
+        failures.append(f"{column}: {rate:.1%} of the absent keys hit the filters")
+    return failures
+
+
+def absent_values(values, num_values, seed):
+    # values of the type of the column that are not in it: dates, as days
+    # since 1970-01-01, and numbers moved past its maximum, and strings with
+    # a suffix
+    if pa.types.is_date32(values.type):
+        values = values.cast(pa.int32())
+    rng = np.random.default_rng(seed)
+    sample = values.take(rng.integers(0, len(values), num_values)).to_pylist()
+    if isinstance(sample[0], str):
+        return [f"{v}#{i}" for i, v in enumerate(sample)]
+    top = max(values.to_pylist())
+    return [top + (v - min(sample)) + 1 for v in sample]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the bloom filter reading of benchmark_indexes.py."
+    )
+    parser.add_argument("--SF", type=float, default=0.05, help="Scale factor")
+    parser.add_argument(
+        "--absent_keys",
+        type=int,
+        default=200,
+        help="Number of keys not in the table to test against every filter",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the keys")
+    args = parser.parse_args()
+
+    failures = check_xxh64()
+    indexes = {
+        "page_index": False,
+        "bloom_filter": [c for names in columns.values() for c in names],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for table_name, names in columns.items():
+            table = numpy_dbgen.generate_table(table_name, args.SF)
+            path = os.path.join(tmp, f"{table_name}.parquet")
+            write_file(table, path, "selective", "parquet", indexes=indexes)
+            for column in names:
+                absent = absent_values(table[column], args.absent_keys, args.seed)
+                failures += check_filters(path, column, absent)
+    if failures:
+        sys.exit("\n".join(failures))
+    print(
+        f"SF{args.SF}: XXH64 matches its test vectors and the keys of every row "
+        "group hit its bloom filter"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import argparse
+import glob
+import json
+import shutil
+import sys
+import tempfile
+
+import pyarrow.dataset as pads
+
+from common_utils import CWD, generate_data
+from schema import arrow_columns
+
+# Checks that different ways of generating a dataset with generate_data_pq.py
+# give the same tables: the NumPy port against the dbgen binary, when it is
+# built, and --shard runs followed by --finalize, and a --resume run after
+# pieces were lost or corrupted, against a plain run.
+
+tables = list(arrow_columns)
+dbgen_binary = os.path.join(CWD, "tpch-dbgen", "dbgen")
+
+
+def generate(folder, args, generator, extra=()):
+    return generate_data(
+        folder,
+        args.SF,
+        "--generator",
+        generator,
+        "--num_processes",
+        args.num_processes,
+        "--target_piece_mb",
+        args.target_piece_mb,
+        *extra,
+    )
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_table(folder, table_name):
+    dataset = pads.dataset(
+        f"{folder}/{table_name}.parquet",
+        format="parquet",
+        partitioning="hive",
+        exclude_invalid_files=True,
+    )
+    return dataset.to_table()
+
+
+def manifest_entries(folder):
+    manifest = read_json(f"{folder}/_manifest.json")
+    return {
+        (entry["table"], entry["piece"]): entry
+        for entries in manifest["tables"].values()
+        for entry in entries
+    }
+
+
+def compare_tables(expected, actual, label):
+    return [
+        f"{label}: {table_name} differs"
+        for table_name in tables
+        if not read_table(expected, table_name).equals(read_table(actual, table_name))
+    ]
+
+
+def compare(expected, actual, label):
+    # tables, manifest entries and catalog of two runs of one generator
+    failures = compare_tables(expected, actual, label)
+    expected_entries = manifest_entries(expected)
+    actual_entries = manifest_entries(actual)
+    if expected_entries.keys() != actual_entries.keys():
+        failures.append(f"{label}: the manifests list different pieces")
+    for key in sorted(expected_entries.keys() & actual_entries.keys()):
+        if expected_entries[key] != actual_entries[key]:
+            failures.append(f"{label}: {key[0]} piece {key[1]} manifest entry differs")
+    for name in ["_catalog.json", "_dataset.json"]:
+        if read_json(f"{expected}/{name}") != read_json(f"{actual}/{name}"):
+            failures.append(f"{label}: {name} differs")
+    return failures
+
+
+def check_dbgen(tmp, plain, args):
+    # the NumPy port writes the rows of the dbgen binary
+    if not os.path.isfile(dbgen_binary):
+        print(f"{dbgen_binary} is not built, skipping the dbgen comparison")
+        return []
+    folder = os.path.join(tmp, "dbgen")
+    generate(folder, args, "dbgen")
+    return compare_tables(folder, plain, "--generator numpy")
+
+
+def check_shards(tmp, plain, args):
+    folder = os.path.join(tmp, "shards")
+    for i in range(1, args.shards + 1):
+        generate(folder, args, "numpy", ["--shard", f"{i}/{args.shards}"])
+    generate(folder, args, "numpy", ["--finalize"])
+    return compare(plain, folder, f"--shard 1..{args.shards}/{args.shards}")
+
+
+def check_resume(tmp, plain, args):
+    # lose the first lineitem file and corrupt the last one, keeping its size.
+    # --resume --verify_checksums must regenerate both pieces and no other.
+    folder = os.path.join(tmp, "resume")
+    shutil.copytree(plain, folder)
+    files = sorted(glob.glob(f"{folder}/lineitem.parquet/*.parquet"))
+    if len(files) < 2:
+        sys.exit("lineitem has one piece, lower --target_piece_mb")
+    os.remove(files[0])
+    with open(files[-1], "r+b") as f:
+        f.seek(os.path.getsize(files[-1]) // 2)
+        f.write(b"\0" * 16)
+    output = generate(folder, args, "numpy", ["--resume", "--verify_checksums"])
+    failures = compare(plain, folder, "--resume")
+    regenerated = [line for line in output.splitlines() if ": generating" in line]
+    if regenerated != [f"lineitem: generating 2 of {len(files)} pieces"]:
+        failures.append(f"--resume regenerated other pieces:\n{output}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check generation paths agree.")
+    parser.add_argument("--SF", type=float, default=0.05, help="Scale factor")
+    parser.add_argument(
+        "--num_processes", type=int, default=2, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--target_piece_mb",
+        type=float,
+        default=1,
+        help="Target piece size, small so that tables are split into pieces",
+    )
+    parser.add_argument(
+        "--shards", type=int, default=3, help="Number of --shard runs"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, "numpy")
+        generate(plain, args, "numpy")
+        failures = check_dbgen(tmp, plain, args)
+        failures += check_shards(tmp, plain, args)
+        failures += check_resume(tmp, plain, args)
+    if failures:
+        sys.exit("\n".join(failures))
+    print(
+        f"SF{args.SF}: the NumPy generator, --shard and --resume runs match "
+        "the plain run"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import os
+import argparse
+import json
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pyarrow.dataset as pads
+import pyarrow.fs as pafs
+
+from common_utils import generate_data
+from schema import arrow_columns
+
+# Checks the S3 output of generate_data_pq.py against a local moto server:
+# generates a small dataset to s3:// and to a local folder, compares the
+# tables and manifests, then resumes the S3 run with --verify_checksums,
+# which has to find every piece complete.
+
+bucket = "tpch-check"
+tables = list(arrow_columns)
+
+
+def start_moto(port):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-p", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.time() > deadline:
+                server.kill()
+                sys.exit(f"moto server did not start on port {port}")
+            time.sleep(0.2)
+
+
+def generate(folder, args, extra=()):
+    return generate_data(
+        folder,
+        args.SF,
+        "--generator",
+        args.generator,
+        "--num_processes",
+        args.num_processes,
+        "--target_piece_mb",
+        args.target_piece_mb,
+        "--upload_budget_mb",
+        args.upload_budget_mb,
+        *extra,
+    )
+
+
+def read_json(path):
+    fs, fpath = pafs.FileSystem.from_uri(path)
+    with fs.open_input_stream(fpath) as f:
+        return json.loads(f.read())
+
+
+def read_table(folder, table_name):
+    fs, fpath = pafs.FileSystem.from_uri(folder)
+    dataset = pads.dataset(
+        f"{fpath}/{table_name}.parquet",
+        format="parquet",
+        filesystem=fs,
+        partitioning="hive",
+        exclude_invalid_files=True,
+    )
+    return dataset.to_table()
+
+
+def manifest_entries(folder):
+    # the manifest entries by table and piece: files with their rows, bytes
+    # and checksums, and the sketches of the piece
+    manifest = read_json(f"{folder}/_manifest.json")
+    return {
+        (entry["table"], entry["piece"]): entry
+        for entries in manifest["tables"].values()
+        for entry in entries
+    }
+
+
+def compare(local, remote):
+    failures = []
+    for table_name in tables:
+        if not read_table(local, table_name).equals(read_table(remote, table_name)):
+            failures.append(f"{table_name}: the tables differ")
+    local_entries = manifest_entries(local)
+    remote_entries = manifest_entries(remote)
+    if local_entries.keys() != remote_entries.keys():
+        failures.append("the manifests list different pieces")
+    for key in sorted(local_entries.keys() & remote_entries.keys()):
+        if local_entries[key] != remote_entries[key]:
+            failures.append(f"{key[0]} piece {key[1]}: the manifest entries differ")
+    for name in ["_catalog.json", "_dataset.json"]:
+        if read_json(f"{local}/{name}") != read_json(f"{remote}/{name}"):
+            failures.append(f"{name} differs")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check S3 output against moto.")
+    parser.add_argument("--SF", type=float, default=0.01, help="Scale factor")
+    parser.add_argument(
+        "--generator",
+        choices=["dbgen", "numpy"],
+        default="numpy",
+        help="Generator of the dataset",
+    )
+    parser.add_argument(
+        "--num_processes", type=int, default=2, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--target_piece_mb",
+        type=float,
+        default=1,
+        help="Target piece size, small so that tables are split into pieces",
+    )
+    parser.add_argument(
+        "--upload_budget_mb",
+        type=float,
+        default=1,
+        help="Upload budget, small so that writers wait for their uploads",
+    )
+    parser.add_argument("--port", type=int, default=5000, help="Port of moto")
+    args = parser.parse_args()
+
+    os.environ.update(
+        AWS_ENDPOINT_URL=f"http://127.0.0.1:{args.port}",
+        AWS_ACCESS_KEY_ID="test",
+        AWS_SECRET_ACCESS_KEY="test",
+        AWS_DEFAULT_REGION="us-east-1",
+    )
+    server = start_moto(args.port)
+    try:
+        fs, _ = pafs.FileSystem.from_uri(f"s3://{bucket}?allow_bucket_creation=true")
+        fs.create_dir(bucket)
+        remote = f"s3://{bucket}/SF{args.SF}"
+        with tempfile.TemporaryDirectory() as tmp:
+            local = os.path.join(tmp, f"SF{args.SF}")
+            generate(local, args)
+            generate(remote, args)
+            failures = compare(local, remote)
+            output = generate(remote, args, ["--resume", "--verify_checksums"])
+            if ": generating" in output:
+                failures.append(f"--resume regenerated pieces:\n{output}")
+            failures += compare(local, remote)
+    finally:
+        server.terminate()
+        server.wait()
+    if failures:
+        sys.exit("\n".join(failures))
+    print(f"SF{args.SF} on S3 matches the local run, before and after --resume")
+
+
+if __name__ == "__main__":
+    main()
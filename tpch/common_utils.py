@@ -1,4 +1,15 @@
 import os
+import json
+import subprocess
+import sys
+
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.dataset as pads
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from schema import arrow_columns, date_columns, money_columns
 
 SCALE_FACTOR = os.environ.get("SCALE_FACTOR", "1")
 
@@ -7,10 +18,44 @@ DATASET_BASE_DIR = os.path.join(CWD, f"SF_{SCALE_FACTOR}")
 ANSWERS_BASE_DIR = os.path.join(CWD, "tpch-dbgen/answers")
 
 TIMINGS_FILE = os.path.join(CWD, "time.csv")
+FORMAT_TIMINGS_FILE = os.path.join(CWD, "format_time.csv")
+INDEX_TIMINGS_FILE = os.path.join(CWD, "index_time.csv")
+SCAN_TIMINGS_FILE = os.path.join(CWD, "scan_time.csv")
 DEFAULT_PLOTS_DIR = os.path.join(CWD, "plots")
 
 WRITE_PLOT = bool(os.environ.get("WRITE_PLOT", False))
 
+MONEY_SCALE = 100
+
+# output formats selectable with generate_data_pq.py --format and the
+# extension of their files. Every format gets the same directory and piece
+# structure.
+file_extensions = {
+    "parquet": "parquet",
+    "feather": "feather",
+    "ipc-uncompressed": "arrow",
+    "orc": "orc",
+    "csv": "csv",
+}
+
+
+def generate_data(folder: str, scale_factor: float, *options) -> str:
+    # run generate_data_pq.py and return its output. A failed run exits with
+    # the command and its output.
+    cmd = [
+        sys.executable,
+        "generate_data_pq.py",
+        "--SF",
+        str(scale_factor),
+        "--folder",
+        folder,
+        *map(str, options),
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, cwd=CWD)
+    if result.returncode != 0:
+        sys.exit(f"{' '.join(cmd)} failed:\n{result.stdout}{result.stderr}")
+    return result.stdout
+
 
 def append_row(solution: str, q: str, secs: float, version: str, success=True):
     with open(TIMINGS_FILE, "a") as f:
@@ -18,3 +63,206 @@ def append_row(solution: str, q: str, secs: float, version: str, success=True):
             f.write("solution,version,query_no,duration[s],success\n")
         f.write(f"{solution},{version},{q},{secs},{success}\n")
         print(f"{solution},{version},{q},{secs},{success}")
+
+
+def answers_dir(path: str) -> str:
+    # the answers written next to a skewed dataset by generate_data_pq.py
+    # --skew, else the official SF1 answers. Uniform datasets never use
+    # answers of their own, which would only repeat an earlier run.
+    dataset_answers = os.path.join(path, "answers")
+    if dataset_info(path).get("skew") and os.path.isdir(dataset_answers):
+        return dataset_answers
+    return ANSWERS_BASE_DIR
+
+
+def dataset_info(path: str) -> dict:
+    # the parameters generate_data_pq.py recorded in _dataset.json, empty for
+    # datasets written before it
+    info_path = os.path.join(path, "_dataset.json")
+    if not os.path.exists(info_path):
+        return {}
+    with open(info_path) as f:
+        return json.load(f)
+
+
+def dataset_format(path: str) -> str:
+    # format recorded by the generator; older datasets are parquet
+    return dataset_info(path).get("format", "parquet")
+
+
+def table_path(root: str, table_name: str, file_format: str) -> str:
+    return f"{root}/{table_name}.{file_extensions[file_format]}"
+
+
+def arrow_dataset(data_path: str, table_name: str, file_format: str):
+    # pyarrow dataset of a table in any --format. Feather and IPC files are
+    # memory mapped. CSV columns get the types of the schema, except the money
+    # columns whose type depends on --money. Parquet tables split into pieces
+    # are planned from their _metadata file, which holds the footers of all
+    # their files, so no footer is opened before the scan.
+    filesystem = pafs.LocalFileSystem(use_mmap=True)
+    metadata_path = os.path.join(data_path, "_metadata")
+    if file_format == "parquet" and os.path.isfile(metadata_path):
+        return pads.parquet_dataset(
+            metadata_path, partitioning="hive", filesystem=filesystem
+        )
+    if file_format == "csv":
+        column_types = {
+            name: column_type
+            for name, column_type in arrow_columns.get(table_name, [])
+            if name not in money_columns.get(table_name, [])
+        }
+        arrow_format = pads.CsvFileFormat(
+            convert_options=pv.ConvertOptions(column_types=column_types)
+        )
+    else:
+        arrow_formats = {"feather": "ipc", "ipc-uncompressed": "ipc"}
+        arrow_format = arrow_formats.get(file_format, file_format)
+    return pads.dataset(
+        data_path,
+        format=arrow_format,
+        partitioning="hive",
+        filesystem=filesystem,
+    )
+
+
+def arrow_files(data_path: str, table_name: str, file_format: str, filters=None):
+    # the files of a table that a read with these filters cannot skip by
+    # their partition directories
+    dataset = arrow_dataset(data_path, table_name, file_format)
+    expression = pq.filters_to_expression(filters) if filters else None
+    return [fragment.path for fragment in dataset.get_fragments(filter=expression)]
+
+
+def read_arrow(
+    data_path: str, table_name: str, file_format: str, columns=None, filters=None
+):
+    # a table of a dataset in any --format, as a pyarrow table. The partition
+    # predicates of `filters` are dropped when reading single files.
+    dataset = arrow_dataset(data_path, table_name, file_format)
+    expression = None
+    if filters:
+        filters = file_filters(filters, dataset.schema.names)
+        expression = pq.filters_to_expression(filters)
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def decode_money(df, table_name: str):
+    # turn the money columns of a --money decimal or int dataset back into the
+    # float64 the queries expect. Works for pandas-like dataframes. Columns
+    # the loader did not read are skipped.
+    for column in money_columns.get(table_name, []):
+        if column not in df.columns:
+            continue
+        kind = df[column].dtype.kind
+        if kind in "iu":
+            df[column] = df[column] / MONEY_SCALE
+        elif kind != "f":
+            df[column] = df[column].astype("float64")
+    return df
+
+
+def timestamp_dates(table, table_name: str):
+    # the date32 columns of an arrow table as timestamps, which pandas-like
+    # engines turn into datetime64 columns without a python date per value
+    for i, field in enumerate(table.schema):
+        if field.name in date_columns[table_name] and pa.types.is_date32(field.type):
+            table = table.set_column(
+                i, field.name, table.column(i).cast(pa.timestamp("ms"))
+            )
+    return table
+
+
+def decode_dates(df, table_name: str, to_datetime):
+    # turn the date columns that are not timestamps yet into the datetime64
+    # the queries compare with timestamps: the strings of datasets written
+    # before dates were stored as date32, and the python dates that the
+    # read_parquet of modin and xorbits makes of date32 columns. Arrow reads
+    # convert their dates with timestamp_dates first. to_datetime is the
+    # pd.to_datetime of the engine.
+    for column in date_columns[table_name]:
+        if column not in df.columns:
+            continue
+        # columns read from a table cache are timestamps already. Arrow
+        # dates have the datetime kind too.
+        dtype = df[column].dtype
+        if dtype.kind == "M" and not str(dtype).startswith("date32"):
+            continue
+        df[column] = to_datetime(df[column])
+    return df
+
+
+def decode_table(df, table_name: str, to_datetime):
+    # the dataframe of a table as the pandas-like queries expect it
+    return decode_money(decode_dates(df, table_name, to_datetime), table_name)
+
+
+def file_filters(filters, names):
+    # the predicates of `filters` on the columns `names` of the files. The
+    # hive partition columns are not in the files and only select them.
+    if isinstance(filters[0], list):
+        return [[p for p in conjunct if p[0] in names] for conjunct in filters]
+    return [p for p in filters if p[0] in names]
+
+
+def scan_bytes(
+    data_path: str, table_name: str, file_format: str, columns=None, filters=None
+) -> int:
+    # compressed bytes of the columns in the row groups that a read with
+    # these filters cannot skip by their partition directories or their
+    # min/max statistics. Other formats have no statistics, so reads skip
+    # whole files only.
+    if file_format != "parquet":
+        files = arrow_files(data_path, table_name, file_format, filters)
+        return sum(os.path.getsize(f) for f in files)
+    dataset = arrow_dataset(data_path, table_name, file_format)
+    expression = pq.filters_to_expression(filters) if filters else None
+    total = 0
+    for fragment in dataset.get_fragments(filter=expression):
+        row_filter = None
+        if filters:
+            names = fragment.physical_schema.names
+            row_filter = pq.filters_to_expression(file_filters(filters, names))
+        for row_group in fragment.split_by_row_group(filter=row_filter):
+            metadata = row_group.metadata.row_group(row_group.row_groups[0].id)
+            for i in range(metadata.num_columns):
+                chunk = metadata.column(i)
+                if columns is None or chunk.path_in_schema in columns:
+                    total += chunk.total_compressed_size
+    return total
+
+
+def report_scan(
+    solution: str,
+    path: str,
+    q: str,
+    pushdown: bool,
+    load_times: dict,
+    table_columns: dict,
+    filters: dict,
+    log_timing: bool,
+):
+    # load time and scanned bytes of the tables a query read with --include_io.
+    # Engines whose reads are lazy record None as load times, as their reads
+    # only build a graph and the scan runs with the query.
+    secs = None if None in load_times.values() else sum(load_times.values())
+    file_format = dataset_format(path)
+    nbytes = sum(
+        scan_bytes(
+            table_path(path, table_name, file_format),
+            table_name,
+            file_format,
+            table_columns.get(table_name),
+            filters.get(table_name),
+        )
+        for table_name in load_times
+    )
+    scan_mb = nbytes / 1024 / 1024
+    load = "load n/a" if secs is None else f"load {secs:.3f}s"
+    print(f"{solution},{q},pushdown={pushdown},{load},scan {scan_mb:.1f}MB")
+    if log_timing:
+        with open(SCAN_TIMINGS_FILE, "a") as f:
+            if f.tell() == 0:
+                f.write("solution,query_no,pushdown,load[s],scan_mb\n")
+            secs = "" if secs is None else secs
+            f.write(f"{solution},{q},{pushdown},{secs},{scan_mb}\n")
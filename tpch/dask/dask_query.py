@@ -18,105 +18,143 @@ from dask_jobqueue import SLURMCluster
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
-from common_utils import append_row, ANSWERS_BASE_DIR
+import table_memory
+from schema import (
+    query_columns,
+    query_scan_filters,
+    refresh_columns,
+    selected_columns,
+    table_weights,
+)
+from common_utils import (
+    append_row,
+    answers_dir,
+    arrow_files,
+    dataset_format,
+    dataset_info,
+    decode_table,
+    read_arrow,
+    report_scan,
+    table_path,
+    timestamp_dates,
+    ANSWERS_BASE_DIR,
+)
 
 # from dask_mpi import initialize
 # initialize()
 
 
-dataset_dict = {}
+# columns of every table read by the loaders, those of the selected queries.
+# A table without an entry is read whole.
+table_columns = {}
+# --pushdown passes the filters of schema.query_filters to the reads of the
+# tables of each query with --include_io, with the year and month predicates
+# that prune the directories of tables written with --partition_by
+pushdown = False
+scan_filters = {}
+# tables read by the running query. read_parquet is lazy and the scan runs
+# with the query, so they have no load time: report_scan prints n/a.
+load_times = {}
+
+
+def read_file(path: str, table_name: str, file_format: str, columns, filters):
+    # one file of a table not written as parquet, as a pandas dataframe
+    table = read_arrow(path, table_name, file_format, columns, filters)
+    return timestamp_dates(table, table_name).to_pandas()
+
+
+def read_table(data_path: str, table_name: str, file_format: str = "parquet"):
+    columns = table_columns.get(table_name)
+    filters = scan_filters.get(table_name)
+    if file_format == "parquet":
+        df = pd.read_parquet(
+            data_path,
+            columns=columns,
+            filters=filters,
+            arrow_to_pandas={"date_as_object": False},
+        )
+    else:
+        # a partition per file
+        df = pd.from_map(
+            read_file,
+            arrow_files(data_path, table_name, file_format, filters),
+            table_name=table_name,
+            file_format=file_format,
+            columns=columns,
+            filters=filters,
+        )
+    df = decode_table(df, table_name, pd.to_datetime)
+    load_times[table_name] = None
+    return df
+
+
+def table_nbytes(df):
+    # the string columns are arrow strings, which the shallow count includes
+    return df.memory_usage(deep=False).sum().compute()
+
+
+def load_table(root: str, table_name: str, include_io: bool = False):
+    df = table_memory.get_table(table_name)
+    if df is None or include_io:
+        file_format = dataset_format(root)
+        df = read_table(
+            table_path(root, table_name, file_format), table_name, file_format
+        )
+        if table_memory.budget_bytes is not None:
+            # with a budget the tables are held in the memory of the workers,
+            # as the other runners hold them, and counted against it
+            df = df.persist()
+            wait(df)
+        table_memory.put_table(table_name, df, table_nbytes)
+    return df
 
 
 def load_lineitem(root: str, include_io: bool = False):
-    if "lineitem" not in dataset_dict or include_io:
-        data_path = root + "/lineitem.parquet"
-        df = pd.read_parquet(data_path)
-        df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
-        df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
-        df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
-        result = df
-        dataset_dict["lineitem"] = result
-    else:
-        result = dataset_dict["lineitem"]
-    return result
+    return load_table(root, "lineitem", include_io)
 
 
 def load_part(root: str, include_io: bool = False):
-    if "part" not in dataset_dict or include_io:
-        data_path = root + "/part.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["part"] = result
-    else:
-        result = dataset_dict["part"]
-    return result
+    return load_table(root, "part", include_io)
 
 
 def load_orders(root: str, include_io: bool = False):
-    if "orders" not in dataset_dict or include_io:
-        data_path = root + "/orders.parquet"
-        df = pd.read_parquet(data_path)
-        df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
-        result = df
-        dataset_dict["orders"] = result
-    else:
-        result = dataset_dict["orders"]
-    return result
+    return load_table(root, "orders", include_io)
 
 
 def load_customer(root: str, include_io: bool = False):
-    if "customer" not in dataset_dict or include_io:
-        data_path = root + "/customer.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["customer"] = result
-    else:
-        result = dataset_dict["customer"]
-    return result
+    return load_table(root, "customer", include_io)
 
 
 def load_nation(root: str, include_io: bool = False):
-    if "nation" not in dataset_dict or include_io:
-        data_path = root + "/nation.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["nation"] = result
-    else:
-        result = dataset_dict["nation"]
-    return result
+    return load_table(root, "nation", include_io)
 
 
 def load_region(root: str, include_io: bool = False):
-    if "region" not in dataset_dict or include_io:
-        data_path = root + "/region.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["region"] = result
-    else:
-        result = dataset_dict["region"]
-    return result
+    return load_table(root, "region", include_io)
 
 
 def load_supplier(root: str, include_io: bool = False):
-    if "supplier" not in dataset_dict or include_io:
-        data_path = root + "/supplier.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["supplier"] = result
-    else:
-        result = dataset_dict["supplier"]
-    return result
+    return load_table(root, "supplier", include_io)
 
 
 def load_partsupp(root: str, include_io: bool = False):
-    if "partsupp" not in dataset_dict or include_io:
-        data_path = root + "/partsupp.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["partsupp"] = result
-    else:
-        result = dataset_dict["partsupp"]
-    return result
+    return load_table(root, "partsupp", include_io)
+
+
+def load_refresh_set(root: str, refresh_set: int):
+    # rows inserted by RF1 and order keys deleted by RF2 in one refresh set
+    set_path = root + f"/refresh/u{refresh_set}"
+    file_format = dataset_format(root)
+    orders = read_table(
+        table_path(set_path, "orders", file_format), "orders", file_format
+    )
+    lineitem = read_table(
+        table_path(set_path, "lineitem", file_format), "lineitem", file_format
+    )
+    delete = read_arrow(
+        table_path(set_path, "delete", file_format), "delete", file_format
+    ).to_pandas()
+    return orders, lineitem, delete
 
 
 def q01(root: str, include_io: bool = False):
@@ -148,7 +186,7 @@ def q01(root: str, include_io: bool = False):
         * (1 - lineitem_filtered.L_DISCOUNT)
         * (1 + lineitem_filtered.L_TAX)
     )
-    gb = lineitem_filtered.groupby(["L_RETURNFLAG", "L_LINESTATUS"])
+    gb = lineitem_filtered.groupby(["L_RETURNFLAG", "L_LINESTATUS"], observed=True)
 
     total = gb.agg(
         {
@@ -342,7 +380,7 @@ def q04(root: str, include_io: bool = False):
     forders = orders[osel]
     jn = forders[forders["O_ORDERKEY"].isin(flineitem["L_ORDERKEY"])]
     total = (
-        jn.groupby("O_ORDERPRIORITY")["O_ORDERKEY"]
+        jn.groupby("O_ORDERPRIORITY", observed=True)["O_ORDERKEY"]
         .count()
         .reset_index()
         .sort_values(["O_ORDERPRIORITY"])
@@ -375,7 +413,7 @@ def q05(root: str, include_io: bool = False):
         jn4, left_on=["S_SUPPKEY", "S_NATIONKEY"], right_on=["L_SUPPKEY", "N_NATIONKEY"]
     )
     jn5["REVENUE"] = jn5.L_EXTENDEDPRICE * (1.0 - jn5.L_DISCOUNT)
-    gb = jn5.groupby("N_NAME")["REVENUE"].sum()
+    gb = jn5.groupby("N_NAME", observed=True)["REVENUE"].sum()
     total = gb.compute().reset_index().sort_values("REVENUE", ascending=False)
 
     return total
@@ -489,7 +527,9 @@ def q07(root: str, include_io: bool = False):
 
     # concat results
     total = pd.concat([total1, total2])
-    total = total.groupby(["SUPP_NATION", "CUST_NATION", "L_YEAR"]).VOLUME.agg("sum")
+    total = total.groupby(
+        ["SUPP_NATION", "CUST_NATION", "L_YEAR"], observed=True
+    ).VOLUME.agg("sum")
     total.columns = ["SUPP_NATION", "CUST_NATION", "L_YEAR", "REVENUE"]
 
     total = (
@@ -609,7 +649,7 @@ def q09(root: str, include_io: bool = False):
         (1 * jn5.PS_SUPPLYCOST) * jn5.L_QUANTITY
     )
     jn5["O_YEAR"] = jn5.O_ORDERDATE.apply(lambda x: x.year)
-    gb = jn5.groupby(["N_NAME", "O_YEAR"])["TMP"].sum()
+    gb = jn5.groupby(["N_NAME", "O_YEAR"], observed=True)["TMP"].sum()
     total = (
         gb.compute()
         .reset_index()
@@ -644,6 +684,7 @@ def q10(root: str, include_io: bool = False):
             "C_ADDRESS",
             "C_COMMENT",
         ],
+        observed=True,
     )["TMP"].sum()
     total = gb.compute().reset_index().sort_values("TMP", ascending=False)
     total = total.head(20)
@@ -698,7 +739,7 @@ def q12(root: str, include_io: bool = False):
     )
     flineitem = lineitem[sel]
     jn = flineitem.merge(orders, left_on="L_ORDERKEY", right_on="O_ORDERKEY")
-    gb = jn.groupby("L_SHIPMODE")["O_ORDERPRIORITY"]
+    gb = jn.groupby("L_SHIPMODE", observed=True)["O_ORDERPRIORITY"]
 
     def g1(x):
         return x.apply(lambda s: ((s == "1-URGENT") | (s == "2-HIGH")).sum())
@@ -825,7 +866,7 @@ def q16(root: str, include_io: bool = False):
     total = total[total["S_SUPPKEY"].isna()]
     total = total.loc[:, ["P_BRAND", "P_TYPE", "P_SIZE", "PS_SUPPKEY"]]
     total = (
-        total.groupby(["P_BRAND", "P_TYPE", "P_SIZE"])["PS_SUPPKEY"]
+        total.groupby(["P_BRAND", "P_TYPE", "P_SIZE"], observed=True)["PS_SUPPKEY"]
         .nunique()
         .reset_index()
     )
@@ -1147,6 +1188,30 @@ def q22(root: str, include_io: bool = False):
     return total
 
 
+def rf1(root: str, refresh, include_io: bool = False):
+    # insert the new orders and their lineitems
+    new_orders, new_lineitem, _ = refresh
+    orders = load_orders(root, include_io)
+    lineitem = load_lineitem(root, include_io)
+    orders = pd.concat([orders, new_orders]).persist()
+    lineitem = pd.concat([lineitem, new_lineitem]).persist()
+    wait([orders, lineitem])
+    table_memory.put_table("orders", orders, table_nbytes, pin=True)
+    table_memory.put_table("lineitem", lineitem, table_nbytes, pin=True)
+
+
+def rf2(root: str, refresh, include_io: bool = False):
+    # delete the orders of the refresh set and their lineitems
+    _, _, delete = refresh
+    orders = load_orders(root, include_io)
+    lineitem = load_lineitem(root, include_io)
+    orders = orders[~orders.O_ORDERKEY.isin(delete.O_ORDERKEY)].persist()
+    lineitem = lineitem[~lineitem.L_ORDERKEY.isin(delete.O_ORDERKEY)].persist()
+    wait([orders, lineitem])
+    table_memory.put_table("orders", orders, table_nbytes, pin=True)
+    table_memory.put_table("lineitem", lineitem, table_nbytes, pin=True)
+
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1225,13 +1290,12 @@ def get_query_answer(query: int, base_dir: str = ANSWERS_BASE_DIR) -> PandasDF:
         os.path.join(base_dir, f"q{query}.out"),
         sep="|",
         parse_dates=True,
-        infer_datetime_format=True,
     )
     return answer_df.rename(columns=lambda x: x.strip())
 
 
-def test_results(q_num: int, result_df: PandasDF):
-    answer = get_query_answer(q_num)
+def test_results(q_num: int, result_df: PandasDF, base_dir: str = ANSWERS_BASE_DIR):
+    answer = get_query_answer(q_num, base_dir)
 
     for column_index in range(len(answer.columns)):
         column_name = answer.columns[column_index]
@@ -1254,6 +1318,11 @@ def test_results(q_num: int, result_df: PandasDF):
         )
 
 
+def load_query_tables(path, query, include_io=False):
+    for loader in query_to_loaders[query]:
+        loader(path, include_io)
+
+
 def run_queries(
     path,
     queries,
@@ -1262,22 +1331,41 @@ def run_queries(
     test_result=True,
     print_result=False,
 ):
+    # with a memory budget, the tables of each query are loaded before it
+    # runs, and the queries run in the order that shares the most tables
+    # between consecutive ones
+    budget = table_memory.budget_bytes is not None
+    if budget:
+        queries = table_memory.query_order(
+            queries, query_columns, table_weights(table_columns)
+        )
+        print(f"Query order: {queries}")
+    partition_by = dataset_info(path).get("partition_by", {})
     print("Start data loading")
     total_start = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path, include_io)
-    print(f"Data loading time (s): {time.time() - total_start}")
+    if not budget:
+        for query in queries:
+            load_query_tables(path, query, include_io)
+        print(f"Data loading time (s): {time.time() - total_start}")
+    load_time = 0.0
     total_start = time.time()
-    for query in queries:
+    for i, query in enumerate(queries):
+        table_memory.set_upcoming(query_columns[q] for q in queries[i:])
+        if budget and not include_io:
+            # with include_io the query reads its tables itself
+            t1 = time.time()
+            load_query_tables(path, query)
+            load_time += time.time() - t1
+        if pushdown:
+            scan_filters.update(query_scan_filters(query, partition_by))
+        load_times.clear()
         try:
             t1 = time.time()
             result = query_to_runner[query](path, include_io)
             dur = time.time() - t1
             success = True
             if test_result:
-                test_results(query, result)
+                test_results(query, result, answers_dir(path))
             if print_result:
                 print(result)
         except Exception as e:
@@ -1287,7 +1375,53 @@ def run_queries(
         finally:
             if log_timing:
                 append_row("dask", query, dur, dask.__version__, success)
-    print(f"Total query execution time (s): {time.time() - total_start}")
+            if include_io:
+                report_scan(
+                    "dask",
+                    path,
+                    query,
+                    pushdown,
+                    load_times,
+                    table_columns,
+                    scan_filters,
+                    log_timing,
+                )
+            scan_filters.clear()
+    query_time = time.time() - total_start - load_time
+    if budget:
+        print(f"Data loading time (s): {load_time}")
+        peak_mb = table_memory.peak_bytes / 1024 / 1024
+        print(f"Peak memory of the loaded tables (MB): {peak_mb:.0f}")
+    print(f"Total query execution time (s): {query_time}")
+
+
+def run_refresh(path, refresh_sets, log_timing=True, include_io=False):
+    # RF1 and RF2 of every refresh set, after the queries since they change
+    # orders and lineitem
+    total_start = time.time()
+    table_memory.set_upcoming([refresh_columns])
+    # the refresh sets change the in-memory tables in turn, so RF1 and RF2
+    # never read the base tables. With include_io they are read once
+    # here, as the queries may have kept filtered reads of them.
+    if include_io:
+        load_orders(path, include_io)
+        load_lineitem(path, include_io)
+    for refresh_set in range(1, refresh_sets + 1):
+        refresh = load_refresh_set(path, refresh_set)
+        for name, refresh_function in [("RF1", rf1), ("RF2", rf2)]:
+            try:
+                t1 = time.time()
+                refresh_function(path, refresh)
+                dur = time.time() - t1
+                success = True
+            except Exception as e:
+                print("".join(traceback.TracebackException.from_exception(e).format()))
+                dur = 0.0
+                success = False
+            finally:
+                if log_timing:
+                    append_row("dask", name, dur, dask.__version__, success)
+    print(f"Total refresh time (s): {time.time() - total_start}")
 
 
 def main():
@@ -1328,8 +1462,33 @@ def main():
         action="store_true",
         help="print result.",
     )
+    parser.add_argument(
+        "--refresh_sets",
+        type=int,
+        default=0,
+        help="number of refresh sets to apply with RF1 and RF2 after the queries.",
+    )
+    parser.add_argument(
+        "--pushdown",
+        action="store_true",
+        help="filter the reads of --include_io with the date predicates of the "
+        "queries.",
+    )
+    parser.add_argument(
+        "--memory_budget_gb",
+        type=float,
+        help="hold the loaded tables in memory within this many GB, evicting "
+        "those the next queries need last. By default the tables are read "
+        "lazily by every query.",
+    )
 
     args = parser.parse_args()
+    if args.pushdown and not args.include_io:
+        parser.error("--pushdown filters the reads of --include_io")
+    global pushdown
+    pushdown = args.pushdown
+    if args.memory_budget_gb is not None:
+        table_memory.set_budget(args.memory_budget_gb * 1024 * 1024 * 1024)
     log_timing = args.log_timing
     include_io = args.include_io
     test_answer = args.test_answer
@@ -1350,6 +1509,8 @@ def main():
     if args.queries is not None:
         queries = args.queries
     print(f"Queries to run: {queries}")
+    # read only the columns the queries use
+    table_columns.update(selected_columns(queries, args.refresh_sets > 0))
 
     # cluster = LocalCluster()
     cluster = SLURMCluster(queue="cpu32c", cores=32, memory="160GB")
@@ -1358,6 +1519,8 @@ def main():
     client = Client(cluster)
 
     run_queries(path, queries, log_timing, include_io, test_answer, print_result)
+    if args.refresh_sets:
+        run_refresh(path, args.refresh_sets, log_timing, include_io)
 
 
 if __name__ == "__main__":
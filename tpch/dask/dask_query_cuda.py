@@ -1,3 +1,5 @@
+import os
+import sys
 import argparse
 import json
 import time
@@ -19,13 +21,16 @@ import socket
 
 from utils import append_row
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+from common_utils import decode_dates
+
 
 def load_lineitem(root: str):
     data_path = root + "/lineitem.parquet"
     df = pd.read_parquet(data_path)
-    df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
-    df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
-    df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
+    df = decode_dates(df, "lineitem", pd.to_datetime)
     return df
 
 
@@ -38,7 +43,7 @@ def load_part(root: str):
 def load_orders(root: str):
     data_path = root + "/orders.parquet"
     df = pd.read_parquet(data_path)
-    df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+    df = decode_dates(df, "orders", pd.to_datetime)
     return df
 
 
@@ -1,163 +1,252 @@
 import os
+import json
+import math
+import queue
+import collections
+import contextlib
+import hashlib
+import heapq
+import io
+import itertools
+import errno
+import time
 import argparse
 import shutil
 import subprocess
+import sys
+import threading
+import uuid
+from functools import partial
 from multiprocessing import Pool, set_start_method
 
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as pads
+import pyarrow.fs as pafs
+import pyarrow.orc as orc
 import pyarrow.parquet as pq
 import numpy as np
 import pandas as pd
 
-def load_lineitem(fpath):
-    cols_names = ['L_ORDERKEY' , 'L_PARTKEY', 'L_SUPPKEY', 'L_LINENUMBER', 'L_QUANTITY',
-            'L_EXTENDEDPRICE', 'L_DISCOUNT', 'L_TAX', 'L_RETURNFLAG', 'L_LINESTATUS', 'L_SHIPDATE',
-            'L_COMMITDATE', 'L_RECEIPTDATE', 'L_SHIPINSTRUCT', 'L_SHIPMODE', 'L_COMMENT']
-    cols = {'L_ORDERKEY' : np.int64, 'L_PARTKEY' : np.int64, 'L_SUPPKEY' : np.int64, 'L_LINENUMBER' : np.int64, 'L_QUANTITY' : np.float64,
-            'L_EXTENDEDPRICE' : np.float64, 'L_DISCOUNT' : np.float64, 'L_TAX' : np.float64, 'L_RETURNFLAG' : str, 'L_LINESTATUS' : str, 'L_SHIPDATE' : str,
-            'L_COMMITDATE' : str, 'L_RECEIPTDATE' : str, 'L_SHIPINSTRUCT' : str, 'L_SHIPMODE' : str, 'L_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols,
-        parse_dates=[10, 11, 12]
-        )
-    return rel
-
-def load_lineitem_with_date(fpath):
-    cols_names = ['L_ORDERKEY' , 'L_PARTKEY', 'L_SUPPKEY', 'L_LINENUMBER', 'L_QUANTITY',
-            'L_EXTENDEDPRICE', 'L_DISCOUNT', 'L_TAX', 'L_RETURNFLAG', 'L_LINESTATUS', 'L_SHIPDATE',
-            'L_COMMITDATE', 'L_RECEIPTDATE', 'L_SHIPINSTRUCT', 'L_SHIPMODE', 'L_COMMENT']
-    cols = {'L_ORDERKEY' : np.int64, 'L_PARTKEY' : np.int64, 'L_SUPPKEY' : np.int64, 'L_LINENUMBER' : np.int64, 'L_QUANTITY' : np.float64,
-            'L_EXTENDEDPRICE' : np.float64, 'L_DISCOUNT' : np.float64, 'L_TAX' : np.float64, 'L_RETURNFLAG' : str, 'L_LINESTATUS' : str, 'L_SHIPDATE' : str,
-            'L_COMMITDATE' : str, 'L_RECEIPTDATE' : str, 'L_SHIPINSTRUCT' : str, 'L_SHIPMODE' : str, 'L_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols,
-        parse_dates=[10, 11, 12]
-        )
-    rel['L_SHIPDATE'] = [time.date() for time in rel['L_SHIPDATE']]
-    rel['L_COMMITDATE'] = [time.date() for time in rel['L_COMMITDATE']]
-    rel['L_RECEIPTDATE'] = [time.date() for time in rel['L_RECEIPTDATE']]
-    return rel
-
-def load_part(fpath):
-    cols_names = ['P_PARTKEY', 'P_NAME', 'P_MFGR', 'P_BRAND',
-            'P_TYPE', 'P_SIZE', 'P_CONTAINER',
-            'P_RETAILPRICE', 'P_COMMENT']
-    cols = {'P_PARTKEY' : np.int64, 'P_NAME' : str, 'P_MFGR' : str, 'P_BRAND' : str,
-            'P_TYPE' : str, 'P_SIZE' : np.int64, 'P_CONTAINER' : str,
-            'P_RETAILPRICE' : np.float64, 'P_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols
-        )
-    return rel
-
-def load_orders(fpath):
-    cols_names = ['O_ORDERKEY', 'O_CUSTKEY', 'O_ORDERSTATUS',
-            'O_TOTALPRICE', 'O_ORDERDATE', 'O_ORDERPRIORITY',
-            'O_CLERK', 'O_SHIPPRIORITY', 'O_COMMENT']
-    cols = {'O_ORDERKEY' : np.int64, 'O_CUSTKEY' : np.int64, 'O_ORDERSTATUS' : str,
-            'O_TOTALPRICE' : np.float64, 'O_ORDERDATE' : np.int64, 'O_ORDERPRIORITY' : str,
-            'O_CLERK' : str, 'O_SHIPPRIORITY' : np.int64, 'O_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols,
-        parse_dates=[4]
-        )
-    return rel
-
-def load_orders_with_date(fpath):
-    cols_names = ['O_ORDERKEY', 'O_CUSTKEY', 'O_ORDERSTATUS',
-            'O_TOTALPRICE', 'O_ORDERDATE', 'O_ORDERPRIORITY',
-            'O_CLERK', 'O_SHIPPRIORITY', 'O_COMMENT']
-    cols = {'O_ORDERKEY' : np.int64, 'O_CUSTKEY' : np.int64, 'O_ORDERSTATUS' : str,
-            'O_TOTALPRICE' : np.float64, 'O_ORDERDATE' : np.int64, 'O_ORDERPRIORITY' : str,
-            'O_CLERK' : str, 'O_SHIPPRIORITY' : np.int64, 'O_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols,
-        parse_dates=[4]
-        )
-    rel['O_ORDERDATE'] = [time.date() for time in rel['O_ORDERDATE']]
-    return rel
-
-def load_customer(fpath):
-    cols_names = ['C_CUSTKEY', 'C_NAME',
-            'C_ADDRESS', 'C_NATIONKEY',
-            'C_PHONE', 'C_ACCTBAL',
-            'C_MKTSEGMENT', 'C_COMMENT']
-    cols = {'C_CUSTKEY' : np.int64, 'C_NAME' : str,
-            'C_ADDRESS' : str, 'C_NATIONKEY' : np.int64,
-            'C_PHONE' : str, 'C_ACCTBAL' : np.float64,
-            'C_MKTSEGMENT' : str, 'C_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols
-        )
-    return rel
-
-def load_nation(fpath):
-    cols_names = ['N_NATIONKEY', 'N_NAME',
-            'N_REGIONKEY', 'N_COMMENT']
-    cols = {'N_NATIONKEY' : np.int64, 'N_NAME' : str,
-            'N_REGIONKEY' : np.int64, 'N_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols
-        )
-    return rel
-
-def load_region(fpath):
-    cols_names = ['R_REGIONKEY', 'R_NAME', 'R_COMMENT']
-    cols = {'R_REGIONKEY' : np.int64, 'R_NAME' : str, 'R_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols
-        )
-    return rel
-
-def load_supplier(fpath):
-    cols_names = ['S_SUPPKEY', 'S_NAME', 'S_ADDRESS',
-            'S_NATIONKEY', 'S_PHONE', 'S_ACCTBAL',
-            'S_COMMENT']
-    cols = {'S_SUPPKEY' : np.int64, 'S_NAME' : str, 'S_ADDRESS' : str,
-            'S_NATIONKEY' : np.int64, 'S_PHONE' : str, 'S_ACCTBAL' : np.float64,
-            'S_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols
-        )
-    return rel
-
-def load_partsupp(fpath):
-    cols_names = ['PS_PARTKEY', 'PS_SUPPKEY', 'PS_AVAILQTY',
-            'PS_SUPPLYCOST', 'PS_COMMENT']
-    cols = {'PS_PARTKEY' : np.int64, 'PS_SUPPKEY' : np.int64, 'PS_AVAILQTY' : np.int64,
-            'PS_SUPPLYCOST' : np.float64, 'PS_COMMENT' : str}
-    rel = pd.read_csv(fpath, sep='|', header=None,
-        names=cols_names,
-        dtype=cols
-        )
-    return rel
+import catalog
+import numpy_dbgen
+import uploads
+import profiling
+from common_utils import file_extensions, table_path
+from profiling import add_bytes, stage
+from skew import parse_skew, skew_batches, skew_columns, skew_table
+from schema import (
+    arrow_columns,
+    date_columns,
+    dictionary_columns,
+    money_columns,
+    table_rows_sf1,
+    table_schema,
+)
+
+# numpy types of the arrow types of the dbgen columns. Dates are parsed.
+csv_types = {pa.int64(): np.int64, pa.float64(): np.float64, pa.string(): str}
+
+
+def load_csv(fpath, table_name):
+    # read dbgen's CSV output of a table into a pandas dataframe
+    columns = arrow_columns[table_name]
+    dates = date_columns[table_name]
+    return pd.read_csv(
+        fpath,
+        sep="|",
+        header=None,
+        names=[name for name, _ in columns],
+        # a str dtype would keep pandas 2 from parsing the dates
+        dtype={
+            name: csv_types.get(type, str)
+            for name, type in columns
+            if name not in dates
+        },
+        parse_dates=dates,
+    )
+
 
 # Change location of tpch-dbgen if not in same place as this script
 tpch_dbgen_location = "./tpch-dbgen"
 
-# First element is the table single character short-hand understood by dbgen
-# Second element is the number of pieces we want the parquet dataset to have for that table
-# Third element is the function that reads generated CSV to a pandas dataframe
-def get_tables_info(num_pieces_base):
+# Parquet physical layout profiles selectable with --layout. `row_group_size`
+# is passed to writer.write, everything else to pyarrow.parquet.ParquetWriter.
+layout_profiles = {
+    # pyarrow defaults: snappy, dictionary encoding, 1Mi rows per row group
+    "default": {},
+    # cheap to decode: LZ4 and one large row group per piece
+    "fast-scan": {
+        "compression": "lz4",
+        "row_group_size": 8 * 1024 * 1024,
+    },
+    # smallest files: ZSTD and dictionary pages large enough to keep
+    # dictionary encoding on every column
+    "compact": {
+        "compression": "zstd",
+        "compression_level": 9,
+        "use_dictionary": True,
+        "dictionary_pagesize_limit": 16 * 1024 * 1024,
+    },
+    # fine-grained min/max statistics for row-group and page skipping
+    "selective": {
+        "compression": "snappy",
+        "row_group_size": 64 * 1024,
+        "data_page_size": 64 * 1024,
+        "write_statistics": True,
+    },
+}
+
+# rows per row group of pyarrow's parquet writer
+default_row_group_size = 1024 * 1024
+
+# false positive rate of the bloom filters written with --bloom_filter. Low,
+# as a point lookup at a large SF hits only a few percent of the row groups.
+bloom_filter_fpp = 0.01
+
+# types of the money columns (prices, discounts, taxes, balances and costs)
+# selectable with --money. All of them have two decimals, so "int" stores
+# exact hundredths and "decimal" the decimal(15,2) of the TPC-H spec.
+money_types = {
+    "float": pa.float64(),
+    "decimal": pa.decimal128(15, 2),
+    "int": pa.int64(),
+}
+
+# Columns that make the rows of a table unique. They break ties between rows
+# with the same cluster key, so that the global sort order is total.
+cluster_tiebreak = {
+    "lineitem": ["L_ORDERKEY", "L_LINENUMBER"],
+    "orders": ["O_ORDERKEY"],
+}
+
+# Rows sampled from every sorted run to choose the piece boundaries
+cluster_samples = 100
+
+# Smallest row group written to a sorted run
+cluster_min_row_group = 1024
+
+# Default number of rows buffered by a streaming worker before they are
+# flushed to parquet; this bounds the memory used per worker
+default_stream_batch_rows = 1_000_000
+
+# Approximate size of a row in dbgen output, used with schema.table_rows_sf1
+# to estimate how much work a piece is
+row_bytes = {
+    "customer": 180,
+    "lineitem": 125,
+    "nation": 100,
+    "orders": 115,
+    "part": 130,
+    "partsupp": 145,
+    "region": 90,
+    "supplier": 160,
+}
+
+
+def estimate_piece_cost(table_name, scale_factor, num_pieces):
+    # bytes of dbgen output in one piece. nation and region do not grow
+    # with the scale factor.
+    rows = table_rows_sf1[table_name]
+    if table_name not in ("nation", "region"):
+        rows *= scale_factor
+    return rows * row_bytes[table_name] / num_pieces
+
+
+# Approximate bytes per row of every table on disk in each output format, as
+# measured on generated data with the default layout. Used to plan pieces of
+# a target size; the realized sizes are reported after generation.
+disk_row_bytes = {
+    "parquet": {
+        "customer": 94,
+        "lineitem": 33,
+        "nation": 130,
+        "orders": 40,
+        "part": 36,
+        "partsupp": 54,
+        "region": 350,
+        "supplier": 92,
+    },
+    "feather": {
+        "customer": 104,
+        "lineitem": 69,
+        "nation": 110,
+        "orders": 60,
+        "part": 71,
+        "partsupp": 62,
+        "region": 260,
+        "supplier": 100,
+    },
+    "ipc-uncompressed": {
+        "customer": 184,
+        "lineitem": 141,
+        "nation": 145,
+        "orders": 127,
+        "part": 145,
+        "partsupp": 160,
+        "region": 250,
+        "supplier": 164,
+    },
+    "orc": {
+        "customer": 152,
+        "lineitem": 91,
+        "nation": 126,
+        "orders": 90,
+        "part": 109,
+        "partsupp": 138,
+        "region": 254,
+        "supplier": 135,
+    },
+    "csv": row_bytes,
+}
+
+default_target_piece_mb = 128
+
+# tables written as directories of pieces, <table>.parquet/part-N.parquet,
+# even when they have a single piece: the polars, ibis and vaex loaders glob
+# their files. Nation and region are single files.
+directory_tables = {"customer", "lineitem", "orders", "part", "partsupp", "supplier"}
+
+
+def plan_pieces(scale_factor, target_piece_bytes, file_format):
+    # number of pieces of every table so that no piece is much larger than
+    # `target_piece_bytes` on disk
+    num_pieces = {}
+    for table_name, rows in table_rows_sf1.items():
+        if table_name not in directory_tables:
+            # dbgen always writes nation and region as one file
+            num_pieces[table_name] = 1
+            continue
+        rows = math.ceil(rows * scale_factor)
+        table_bytes = rows * disk_row_bytes[file_format][table_name]
+        num_pieces[table_name] = min(
+            rows, max(1, math.ceil(table_bytes / target_piece_bytes))
+        )
+    return num_pieces
+
+
+# dbgen's single character names of the tables
+dbgen_table_names = {
+    "customer": "c",
+    "lineitem": "L",
+    "nation": "n",
+    "orders": "O",
+    "part": "P",
+    "partsupp": "S",
+    "region": "r",
+    "supplier": "s",
+}
+
+
+def get_tables_info(num_pieces):
+    # First element is the table single character short-hand understood by dbgen
+    # Second element is the number of pieces we want the parquet dataset to have for that table
+    # Third element is the function that reads generated CSV to a pandas dataframe
     tables = {}
-    tables["customer"] = ("c", num_pieces_base, load_customer)
-    tables["lineitem"] = ("L", num_pieces_base * 10, load_lineitem_with_date)
-    # dbgen only produces one file for nation with SF1000
-    tables["nation"] = ("n", 1, load_nation)
-    tables["orders"] = ("O", num_pieces_base, load_orders_with_date)
-    tables["part"] = ("P", num_pieces_base, load_part)
-    tables["partsupp"] = ("S", num_pieces_base, load_partsupp)
-    # dbgen only produces one file for region with SF1000
-    tables["region"] = ("r", 1, load_region)
-    tables["supplier"] = ("s", num_pieces_base // 100, load_supplier)
+    for table_name, table_short in dbgen_table_names.items():
+        load_func = partial(load_csv, table_name=table_name)
+        tables[table_name] = (table_short, num_pieces[table_name], load_func)
     return tables
 
 
@@ -168,90 +257,1343 @@ def remove_file_if_exists(path):
         pass
 
 
-def to_parquet(args):
-    (
-        SCALE_FACTOR,
-        table_name,
-        table_short,
-        load_func,
-        piece,
-        num_pieces,
-        output_prefix,
-    ) = args
-    # generate `piece+1` of the table for the given scale factor with dbgen
-    dbgen_fname = f"{tpch_dbgen_location}/{table_name}.tbl.{piece+1}"
+def filesystem(path):
+    # pyarrow filesystem and path for a local path or an s3:// URI
+    if "://" not in path:
+        path = os.path.abspath(path)
+    return pafs.FileSystem.from_uri(path)
+
+
+def write_json(path, obj):
+    # write a small JSON document next to the dataset, local or on S3. It is
+    # written to a temporary name first so readers never see half a file, and
+    # the name is unique as shards on several hosts may write the same file.
+    fs, fpath = filesystem(path)
+    fs.create_dir(fpath.rsplit("/", 1)[0], recursive=True)
+    tmp_path = f"{fpath}.{uuid.uuid4().hex}.tmp"
+    with fs.open_output_stream(tmp_path) as f:
+        f.write(json.dumps(obj, indent=2).encode())
+    fs.move(tmp_path, fpath)
+
+
+def read_json(path):
+    fs, fpath = filesystem(path)
+    with fs.open_input_stream(fpath) as f:
+        return json.loads(f.read())
+
+
+def make_dirs(path):
+    # create a directory and its parents if missing, local or on S3
+    fs, fpath = filesystem(path)
+    fs.create_dir(fpath, recursive=True)
+
+
+def remove_dir(path):
+    # remove a directory tree if it exists, local or on S3
+    fs, fpath = filesystem(path)
+    if fs.get_file_info(fpath).type != pafs.FileType.NotFound:
+        fs.delete_dir(fpath)
+
+
+def remove_file(path):
+    # remove a file if it exists, local or on S3
+    fs, fpath = filesystem(path)
+    if fs.get_file_info(fpath).type != pafs.FileType.NotFound:
+        fs.delete_file(fpath)
+
+
+def file_info(path):
+    fs, fpath = filesystem(path)
+    return fs.get_file_info(fpath)
+
+
+def file_checksum(path):
+    fs, fpath = filesystem(path)
+    digest = hashlib.sha256()
+    with fs.open_input_stream(fpath) as f:
+        while chunk := f.read(8 * 1024 * 1024):
+            digest.update(chunk)
+    return "sha256:" + digest.hexdigest()
+
+
+def parquet_writer(output_path, schema, layout, sorting_columns=None, indexes=None):
+    # record the layout profile in the footer of every file
+    options = dict(layout_profiles[layout])
+    row_group_size = options.pop("row_group_size", default_row_group_size)
+    if sorting_columns:
+        options["sorting_columns"] = pq.SortingColumn.from_ordering(
+            schema, [(c, "ascending") for c in sorting_columns]
+        )
+    if indexes:
+        options["write_page_index"] = indexes["page_index"]
+        # a filter per column chunk, sized for a row group of distinct keys
+        options["bloom_filter_options"] = {
+            column: {"ndv": row_group_size, "fpp": bloom_filter_fpp}
+            for column in indexes["bloom_filter"]
+            if column in schema.names
+        }
+    metadata = dict(schema.metadata or {})
+    metadata[b"tpch_layout"] = layout.encode()
+    return pq.ParquetWriter(output_path, schema.with_metadata(metadata), **options)
+
+
+@contextlib.contextmanager
+def file_writer(
+    output_path, schema, layout, file_format, sorting_columns=None, indexes=None
+):
+    # writer of one output file; all of them have write(table). Files for an
+    # object store are uploaded while they are written.
+    if uploads.is_remote(output_path):
+        sink = uploads.UploadStream(output_path)
+    elif file_format == "parquet":
+        sink = contextlib.nullcontext(output_path)
+    else:
+        fs, path = filesystem(output_path)
+        sink = fs.open_output_stream(path)
+    with sink as sink:
+        with format_writer(
+            sink, schema, layout, file_format, sorting_columns, indexes
+        ) as w:
+            yield w
+
+
+def format_writer(
+    sink, schema, layout, file_format, sorting_columns=None, indexes=None
+):
+    if file_format == "parquet":
+        return parquet_writer(sink, schema, layout, sorting_columns, indexes)
+    if file_format == "orc":
+        return orc.ORCWriter(sink)
+    if file_format == "csv":
+        return pv.CSVWriter(sink, schema)
+    # feather is an lz4 compressed arrow IPC file; uncompressed IPC files can
+    # be memory mapped by readers without a copy
+    compression = "lz4" if file_format == "feather" else None
+    return pa.ipc.new_file(
+        sink, schema, options=pa.ipc.IpcWriteOptions(compression=compression)
+    )
+
+
+def write_options(layout, file_format):
+    # keyword arguments of writer.write for `file_format`
+    if file_format == "parquet":
+        return {"row_group_size": layout_profiles[layout].get("row_group_size")}
+    return {}
+
+
+def write_file(
+    table, output_path, layout, file_format, sorting_columns=None, indexes=None
+):
+    with stage("write"), file_writer(
+        output_path, table.schema, layout, file_format, sorting_columns, indexes
+    ) as writer:
+        writer.write(table, **write_options(layout, file_format))
+    return [(output_path, table.num_rows)]
+
+
+def to_arrow_table(df, table_name):
+    # converting with the table schema turns the parsed datetime64 columns
+    # into date32 with one vectorized cast per column
+    schema = table_schema(table_name)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def encoded_schema(table_name, dictionary, money):
+    # the table schema with the column encodings of --dictionary and --money
+    schema = table_schema(table_name)
+    if dictionary:
+        for name in dictionary_columns.get(table_name, {}):
+            i = schema.get_field_index(name)
+            schema = schema.set(
+                i, pa.field(name, pa.dictionary(pa.int8(), pa.string()))
+            )
+    for name in money_columns.get(table_name, []):
+        i = schema.get_field_index(name)
+        schema = schema.set(i, pa.field(name, money_types[money]))
+    return schema
+
+
+def encode_dictionaries(table, table_name):
+    # encode the dictionary columns of a table against their fixed value list
+    for name, values in dictionary_columns.get(table_name, {}).items():
+        dictionary = pa.array(values, pa.string())
+        column = table[name]
+        if pa.types.is_dictionary(column.type):
+            # merged from runs that were encoded already
+            continue
+        indices = pc.index_in(column, value_set=dictionary)
+        if indices.null_count != column.null_count:
+            raise ValueError(
+                f"{table_name}.{name} has values outside its dictionary"
+            )
+        encoded = pa.chunked_array(
+            [
+                pa.DictionaryArray.from_arrays(chunk.cast(pa.int8()), dictionary)
+                for chunk in indices.chunks
+            ],
+            pa.dictionary(pa.int8(), pa.string()),
+        )
+        table = table.set_column(table.schema.get_field_index(name), name, encoded)
+    return table
+
+
+def encode_money(table, table_name, money):
+    # convert the float money columns to hundredths or decimals. The floats
+    # were parsed from two decimal strings, so rounding recovers them exactly.
+    money_type = money_types[money]
+    for name in money_columns.get(table_name, []):
+        column = table[name]
+        if column.type == money_type:
+            continue
+        if money == "int":
+            encoded = pc.round(pc.multiply(column, 100)).cast(money_type)
+        else:
+            encoded = pc.round(column, 2).cast(money_type)
+        table = table.set_column(table.schema.get_field_index(name), name, encoded)
+    return table
+
+
+def encode_columns(table, table_name, dictionary, money):
+    if dictionary:
+        table = encode_dictionaries(table, table_name)
+    return encode_money(table, table_name, money)
+
+
+def encode_batches(batches, table_name, dictionary, money):
+    for batch in batches:
+        table = pa.Table.from_batches([batch])
+        yield from encode_columns(table, table_name, dictionary, money).to_batches()
+
+
+def release_fifo_reader(proc, fifo_path):
+    # If dbgen fails before opening the FIFO, the reader blocks in open()
+    # forever. Open the write end ourselves so that it sees EOF instead.
+    if proc.wait() == 0:
+        return
+    while True:
+        try:
+            os.close(os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK))
+            return
+        except FileNotFoundError:
+            # reader already finished and removed the FIFO
+            return
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            # reader has not opened the FIFO yet
+            time.sleep(0.05)
+
+
+def write_batches(
+    batches,
+    schema,
+    output_path,
+    batch_rows,
+    layout,
+    file_format,
+    indexes=None,
+    sketches=None,
+):
+    # buffer incoming record batches and flush them to the file in writes of
+    # exactly `batch_rows` rows once that many are pending, so memory is
+    # bounded by the batch size and row groups never exceed `batch_rows`.
+    # The rows written are added to `sketches` unless it is None.
+    options = write_options(layout, file_format)
+    total_rows = 0
+    with file_writer(
+        output_path, schema, layout, file_format, indexes=indexes
+    ) as writer:
+        pending = []
+        num_rows = 0
+        for batch in batches:
+            pending.append(batch)
+            num_rows += batch.num_rows
+            add_bytes("arrow_bytes", batch.nbytes)
+            if num_rows >= batch_rows:
+                table = pa.Table.from_batches(pending, schema)
+                # the rows past the last full batch stay pending
+                while table.num_rows >= batch_rows:
+                    add_sketches(sketches, table.slice(0, batch_rows))
+                    with stage("write"):
+                        writer.write(table.slice(0, batch_rows), **options)
+                    table = table.slice(batch_rows)
+                total_rows += num_rows - table.num_rows
+                pending = table.to_batches()
+                num_rows = table.num_rows
+        if pending:
+            table = pa.Table.from_batches(pending, schema)
+            add_sketches(sketches, table)
+            with stage("write"):
+                writer.write(table, **options)
+            total_rows += num_rows
+    return [(output_path, total_rows)]
+
+
+def add_sketches(sketches, table):
+    # merge the distinct count sketches of `table` into `sketches`, if any
+    if sketches is not None:
+        with stage("record"):
+            catalog.merge_sketches(sketches, catalog.table_sketches(table))
+
+
+def staged_batches(batches, name):
+    # count the time spent producing the batches as stage `name`
+    batches = iter(batches)
+    while True:
+        with stage(name):
+            batch = next(batches, None)
+        if batch is None:
+            return
+        yield batch
+
+
+class CountingReader(io.RawIOBase):
+    # file object over dbgen's FIFO that counts the CSV bytes read from it
+    def __init__(self, f):
+        self.f = f
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.f.readinto(buffer)
+        add_bytes("csv_bytes", n or 0)
+        return n
+
+
+@contextlib.contextmanager
+def dbgen_stream(cmd, dbgen_fname, table_name):
+    # dbgen writes into a FIFO instead of a file and pyarrow.csv parses it
+    # incrementally, so the generated CSV never touches the disk. Yields a
+    # reader of record batches.
+    remove_file_if_exists(dbgen_fname)
+    os.mkfifo(dbgen_fname)
+    try:
+        proc = subprocess.Popen(cmd.split(), cwd=tpch_dbgen_location)
+        threading.Thread(
+            target=release_fifo_reader, args=(proc, dbgen_fname), daemon=True
+        ).start()
+        schema = table_schema(table_name)
+        try:
+            # a FIFO is not seekable, so hand pyarrow a plain python file object.
+            # Opening it waits until dbgen has started and written a block.
+            with stage("dbgen"):
+                f = open(dbgen_fname, "rb")
+                reader = pv.open_csv(
+                    CountingReader(f),
+                    read_options=pv.ReadOptions(column_names=schema.names),
+                    parse_options=pv.ParseOptions(delimiter="|"),
+                    convert_options=pv.ConvertOptions(column_types=schema),
+                )
+            with f:
+                yield reader
+        finally:
+            # report a dbgen failure rather than the parse error it caused
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd)
+    finally:
+        remove_file_if_exists(dbgen_fname)
+
+
+def stream_to_file(
+    cmd,
+    dbgen_fname,
+    table_name,
+    output_path,
+    batch_rows,
+    layout,
+    file_format,
+    dictionary=False,
+    money="float",
+    scale_factor=1,
+    skew=None,
+    indexes=None,
+    sketches=None,
+):
+    with dbgen_stream(cmd, dbgen_fname, table_name) as reader:
+        # dbgen runs while its output is parsed, both count as parsing
+        batches, schema = staged_batches(reader, "parse"), reader.schema
+        if skew:
+            batches = skew_batches(batches, table_name, scale_factor, skew)
+        if dictionary or money != "float":
+            batches = encode_batches(batches, table_name, dictionary, money)
+            schema = encoded_schema(table_name, dictionary, money)
+        batches = staged_batches(batches, "convert")
+        return write_batches(
+            batches,
+            schema,
+            output_path,
+            batch_rows,
+            layout,
+            file_format,
+            indexes,
+            sketches,
+        )
+
+
+def dbgen_to_table(cmd, dbgen_fname, table_name, load_func, stream):
+    # run dbgen and return its whole output as an arrow table
+    if stream:
+        # dbgen runs while its output is parsed, both count as parsing
+        with dbgen_stream(cmd, dbgen_fname, table_name) as reader:
+            with stage("parse"):
+                return reader.read_all()
     remove_file_if_exists(dbgen_fname)
-    cmd = f"./dbgen -f -s {SCALE_FACTOR} -S {piece+1} -C {num_pieces} -T {table_short}"
-    subprocess.run(cmd.split(), check=True, cwd=tpch_dbgen_location)
+    with stage("dbgen"):
+        subprocess.run(cmd.split(), check=True, cwd=tpch_dbgen_location)
+    add_bytes("csv_bytes", os.path.getsize(dbgen_fname))
     # load csv file into pandas dataframe
-    df = load_func(dbgen_fname)
+    with stage("parse"):
+        df = load_func(dbgen_fname)
     # csv file no longer needed, remove
     os.remove(dbgen_fname)
-    # write dataframe to parquet
+    with stage("convert"):
+        return to_arrow_table(df, table_name)
+
+
+def cluster_sort_keys(table_name, cluster_key):
+    # rows are ordered by the cluster key and then by the primary key, so
+    # that every row has a distinct position even when keys repeat
+    return [cluster_key] + [c for c in cluster_tiebreak[table_name] if c != cluster_key]
+
+
+def rows_from(table, columns, bound):
+    # mask of the rows whose `columns` tuple is >= `bound` in lexicographic
+    # order, built from the last column backwards
+    mask = None
+    for column, value in reversed(list(zip(columns, bound))):
+        if mask is None:
+            mask = pc.greater_equal(table[column], value)
+        else:
+            mask = pc.or_(
+                pc.greater(table[column], value),
+                pc.and_(pc.equal(table[column], value), mask),
+            )
+    return mask
+
+
+def write_sorted_run(table, run_path, sort_keys, num_pieces):
+    # first pass of the external sort: the piece is sorted on its own and
+    # written as a run with about one row group per output piece, so the
+    # merge pass reads little more than the rows it needs from every run
+    with stage("sort"):
+        table = table.sort_by([(c, "ascending") for c in sort_keys])
+    num_rows = table.num_rows
+    row_group_size = max(cluster_min_row_group, -(-num_rows // num_pieces))
+    with stage("write"):
+        pq.write_table(table, run_path, row_group_size=row_group_size)
+    # key range of every row group, read off the sorted column
+    keys = table[sort_keys[0]]
+    ranges = [
+        (keys[start].as_py(), keys[min(start + row_group_size, num_rows) - 1].as_py())
+        for start in range(0, num_rows, row_group_size)
+    ]
+    # evenly spaced sample of the sorted rows used to choose the splitters
+    step = max(1, num_rows // cluster_samples)
+    sample = table.select(sort_keys).take(list(range(0, num_rows, step)))
+    sample = list(zip(*(sample[c].to_pylist() for c in sort_keys)))
+    return run_path, ranges, sample
+
+
+def choose_splitters(samples, num_pieces):
+    # boundaries between the output pieces, taken at the quantiles of the
+    # samples of all runs
+    samples = sorted(samples)
+    return [
+        samples[len(samples) * i // num_pieces] for i in range(1, num_pieces)
+    ]
+
+
+def merge_runs(args):
+    # second pass of the external sort: collect the rows in [lower, upper)
+    # from every run and write them, sorted, as one output piece
+    options, piece, runs, sort_keys, lower, upper = args
+    parts = []
+    with stage("read"):
+        for run_path, row_groups in runs:
+            if not row_groups:
+                continue
+            part = pq.ParquetFile(run_path).read_row_groups(row_groups)
+            mask = None
+            if lower is not None:
+                mask = rows_from(part, sort_keys, lower)
+            if upper is not None:
+                below = pc.invert(rows_from(part, sort_keys, upper))
+                mask = below if mask is None else pc.and_(mask, below)
+            parts.append(part if mask is None else part.filter(mask))
+    schema = encoded_schema(
+        options["table_name"], options["dictionary"], options["money"]
+    )
+    table = pa.concat_tables(parts) if parts else schema.empty_table()
+    with stage("sort"):
+        table = table.sort_by([(c, "ascending") for c in sort_keys])
+    output_path = piece_path(
+        options["output_prefix"],
+        piece,
+        options["num_pieces"],
+        file_extensions[options["file_format"]],
+    )
+    sketches = piece_sketches(options)
+    files = write_piece(table, output_path, options, sort_keys, sketches)
+    if options["generator"] == "numpy":
+        cmd = numpy_command(options, piece)
+    else:
+        cmd = dbgen_command(options, piece)[0]
+    record_piece(options, piece, files, cmd, sketches)
+
+
+def merge_tasks(options, runs, pieces):
+    # assign to every output piece the row groups of every run whose key
+    # range overlaps the piece's key range
+    num_pieces = options["num_pieces"]
+    sort_keys = cluster_sort_keys(options["table_name"], options["cluster_key"])
+    samples = [s for _, _, run_sample in runs for s in run_sample]
+    splitters = choose_splitters(samples, num_pieces)
+    bounds = [None] + splitters + [None]
+    tasks = []
+    for piece in pieces:
+        lower, upper = bounds[piece], bounds[piece + 1]
+        selected = []
+        for run_path, ranges, _ in runs:
+            row_groups = [
+                i
+                for i, (lo, hi) in enumerate(ranges)
+                if (lower is None or hi >= lower[0])
+                and (upper is None or lo <= upper[0])
+            ]
+            selected.append((run_path, row_groups))
+        tasks.append((options, piece, selected, sort_keys, lower, upper))
+    return tasks
+
+
+def write_partitioned(
+    table, output_path, partition_key, layout, file_format, sorting_columns, indexes
+):
+    # split a piece by the year and month of `partition_key` and write every
+    # slice under <prefix>/year=YYYY/month=MM/ with the piece's file name.
+    # Pieces are clustered by the same date, so they cover consecutive date
+    # ranges and only their first and last months are shared with another
+    # piece. A table has at most about pieces + months files. With fewer
+    # pieces than months, every month is a file of its own, smaller than a
+    # piece.
+    output_prefix, file_name = output_path.rsplit("/", 1)
+    dates = table[partition_key]
+    months = pc.add(pc.multiply(pc.year(dates), 100), pc.month(dates))
+    files = []
+    for month in pc.unique(months).to_pylist():
+        directory = f"{output_prefix}/year={month // 100}/month={month % 100:02d}"
+        make_dirs(directory)
+        files += write_file(
+            table.filter(pc.equal(months, month)),
+            f"{directory}/{file_name}",
+            layout,
+            file_format,
+            sorting_columns=sorting_columns,
+            indexes=indexes,
+        )
+    return files
+
+
+def write_piece(table, output_path, options, sorting_columns=None, sketches=None):
+    # write one generated piece, split into month partitions if requested,
+    # and add its rows to `sketches`. Returns the (path, rows) of every file
+    # written.
+    with stage("convert"):
+        table = encode_columns(
+            table, options["table_name"], options["dictionary"], options["money"]
+        )
+    add_bytes("arrow_bytes", table.nbytes)
+    add_sketches(sketches, table)
+    if options["partition_key"]:
+        with stage("write"):
+            return write_partitioned(
+                table,
+                output_path,
+                options["partition_key"],
+                options["layout"],
+                options["file_format"],
+                sorting_columns,
+                options["indexes"],
+            )
+    return write_file(
+        table,
+        output_path,
+        options["layout"],
+        options["file_format"],
+        sorting_columns=sorting_columns,
+        indexes=options["indexes"],
+    )
+
+
+def piece_path(output_prefix, piece, num_pieces, extension="parquet"):
     zeros = "0" * (len(str(num_pieces)) - len(str(piece)))
-    df.to_parquet(f"{output_prefix}/part-{zeros}{piece}.parquet")
+    return f"{output_prefix}/part-{zeros}{piece}.{extension}"
+
+
+def dbgen_command(options, piece):
+    # dbgen command line and the file it writes for `piece` of the table
+    table_name = options["table_name"]
+    cmd = f"./dbgen -f -s {options['scale_factor']} -T {options['table_short']}"
+    if options["num_pieces"] == 1:
+        return cmd, f"{tpch_dbgen_location}/{table_name}.tbl"
+    # generate `piece+1` of the table for the given scale factor with dbgen
+    cmd += f" -S {piece+1} -C {options['num_pieces']}"
+    return cmd, f"{tpch_dbgen_location}/{table_name}.tbl.{piece+1}"
+
+
+def numpy_command(options, piece):
+    # the call recorded in the manifest for a piece of the NumPy generator
+    return (
+        f"numpy_dbgen.generate_table('{options['table_name']}', "
+        f"{options['scale_factor']}, {piece}, {options['num_pieces']})"
+    )
+
+
+def numpy_to_table(options, piece):
+    # the same rows as dbgen_command() writes, generated in memory
+    with stage("dbgen"):
+        table = numpy_dbgen.generate_table(
+            options["table_name"], options["scale_factor"], piece, options["num_pieces"]
+        )
+    with stage("convert"):
+        return table.cast(table_schema(options["table_name"]))
+
+
+def to_parquet(args):
+    options, piece = args
+    table_name = options["table_name"]
+    num_pieces = options["num_pieces"]
+    stream_batch_rows = options["stream_batch_rows"]
+    cluster_key = options["cluster_key"]
+    cmd, dbgen_fname = dbgen_command(options, piece)
+    extension = file_extensions[options["file_format"]]
+    if table_name in directory_tables:
+        output_path = piece_path(options["output_prefix"], piece, num_pieces, extension)
+    else:
+        output_path = options["output_prefix"]
+    table = None
+    sketches = piece_sketches(options)
+    if options["generator"] == "numpy":
+        cmd = numpy_command(options, piece)
+        table = numpy_to_table(options, piece)
+    elif cluster_key or not stream_batch_rows:
+        table = dbgen_to_table(
+            cmd, dbgen_fname, table_name, options["load_func"], stream_batch_rows
+        )
+    if options["skew"] and table is not None:
+        with stage("convert"):
+            table = skew_table(
+                table, table_name, options["scale_factor"], options["skew"]
+            )
+    if cluster_key:
+        sort_keys = cluster_sort_keys(table_name, cluster_key)
+        if num_pieces > 1:
+            # the piece becomes a sorted run, merged into the output later
+            run_path = piece_path(f"{options['output_prefix']}/_runs", piece, num_pieces)
+            return write_sorted_run(table, run_path, sort_keys, num_pieces)
+        with stage("sort"):
+            table = table.sort_by([(c, "ascending") for c in sort_keys])
+        files = write_piece(table, output_path, options, sort_keys, sketches)
+    elif table is None:
+        files = stream_to_file(
+            cmd,
+            dbgen_fname,
+            table_name,
+            output_path,
+            stream_batch_rows,
+            options["layout"],
+            options["file_format"],
+            options["dictionary"],
+            options["money"],
+            options["scale_factor"],
+            options["skew"],
+            options["indexes"],
+            sketches,
+        )
+    else:
+        files = write_piece(table, output_path, options, sketches=sketches)
+    record_piece(options, piece, files, cmd, sketches)
+
+
+def refresh_to_parquet(args):
+    # RF1/RF2 refresh sets from `dbgen -U`: the orders and lineitems that RF1
+    # inserts and the order keys that RF2 deletes, written as
+    # refresh/u<N>/{orders,lineitem,delete}.<extension>
+    options, piece = args
+    num_sets = options["refresh_sets"]
+    extension = file_extensions[options["file_format"]]
+    cmd = f"./dbgen -f -s {options['scale_factor']} -U {num_sets}"
+    # lineitem comes first, the order totals of a skewed set are summed over
+    # its skewed lines
+    outputs = {
+        "lineitem": "lineitem.tbl.u{}",
+        "orders": "orders.tbl.u{}",
+        "delete": "delete.{}",
+    }
+    fnames = [
+        f"{tpch_dbgen_location}/{fname.format(n)}"
+        for n in range(1, num_sets + 1)
+        for fname in outputs.values()
+    ]
+    for fname in fnames:
+        remove_file_if_exists(fname)
+    with stage("dbgen"):
+        subprocess.run(cmd.split(), check=True, cwd=tpch_dbgen_location)
+    for fname in fnames:
+        add_bytes("csv_bytes", os.path.getsize(fname))
+    files = []
+    sketches = piece_sketches(options)
+    for n in range(1, num_sets + 1):
+        make_dirs(f"{options['output_prefix']}/u{n}")
+        lineitem = None
+        for name, fname in outputs.items():
+            if name == "delete":
+                # one key per line, with a trailing separator
+                column_names = ["O_ORDERKEY", "_"]
+                schema = pa.schema([("O_ORDERKEY", pa.int64())])
+            else:
+                schema = table_schema(name)
+                column_names = schema.names
+            with stage("parse"):
+                table = pv.read_csv(
+                    f"{tpch_dbgen_location}/{fname.format(n)}",
+                    read_options=pv.ReadOptions(column_names=column_names),
+                    parse_options=pv.ParseOptions(delimiter="|"),
+                    convert_options=pv.ConvertOptions(
+                        column_types=schema, include_columns=schema.names
+                    ),
+                )
+            with stage("convert"):
+                if options["skew"] and name != "delete":
+                    # the inserted rows are skewed like the tables
+                    table = skew_table(
+                        table,
+                        name,
+                        options["scale_factor"],
+                        options["skew"],
+                        lineitem,
+                    )
+                if name == "lineitem":
+                    lineitem = table
+                table = encode_columns(
+                    table, name, options["dictionary"], options["money"]
+                )
+            add_bytes("arrow_bytes", table.nbytes)
+            add_sketches(sketches, table)
+            files += write_file(
+                table,
+                f"{options['output_prefix']}/u{n}/{name}.{extension}",
+                options["layout"],
+                options["file_format"],
+                indexes=options["indexes"],
+            )
+    for fname in fnames:
+        os.remove(fname)
+    record_piece(options, piece, files, cmd, sketches)
+
+
+def piece_sketches(options):
+    # empty distinct count sketches, filled while a piece is written. Only
+    # parquet datasets have a catalog.
+    return {} if options["file_format"] == "parquet" else None
+
+
+def stored_file(path, uploaded):
+    # size and checksum of a written file
+    if path in uploaded:
+        return uploaded[path]
+    return {"bytes": file_info(path).size, "checksum": file_checksum(path)}
+
+
+def record_piece(options, piece, files, cmd, sketches=None):
+    # a piece counts as done once its entry is in the manifest. Workers write
+    # one small entry per piece, merged into _manifest.json at the end.
+    with stage("record"):
+        record_files(options, piece, files, cmd, sketches)
+
+
+def record_files(options, piece, files, cmd, sketches):
+    folder = options["folder"]
+    uploaded = uploads.take_files([path for path, _ in files])
+    entry = {
+        "table": options["table_name"],
+        "piece": piece,
+        "dbgen": cmd,
+        "files": [
+            {
+                "path": path[len(folder) + 1 :],
+                "rows": num_rows,
+                **stored_file(path, uploaded),
+            }
+            for path, num_rows in files
+        ],
+    }
+    add_bytes("file_bytes", sum(f["bytes"] for f in entry["files"]))
+    if sketches is not None:
+        entry["hll"] = catalog.encode_sketches(sketches)
+    entry_path = piece_path(
+        f"{folder}/_manifest/{options['table_name']}", piece, options["num_pieces"]
+    ).replace(".parquet", ".json")
+    write_json(entry_path, entry)
+
+
+def read_manifest(folder):
+    # completed pieces as {table: {piece: entry}}, from the consolidated
+    # manifest of a finished run and the entries left by an unfinished one
+    pieces = {}
+    if file_info(f"{folder}/_manifest.json").type == pafs.FileType.File:
+        for table_name, entries in read_json(f"{folder}/_manifest.json")["tables"].items():
+            pieces[table_name] = {e["piece"]: e for e in entries}
+    fs, root = filesystem(f"{folder}/_manifest")
+    selector = pafs.FileSelector(root, allow_not_found=True, recursive=True)
+    for info in fs.get_file_info(selector):
+        if info.type == pafs.FileType.File and info.path.endswith(".json"):
+            with fs.open_input_stream(info.path) as f:
+                entry = json.loads(f.read())
+            pieces.setdefault(entry["table"], {})[entry["piece"]] = entry
+    return pieces
+
+
+def piece_is_complete(folder, entry, verify_checksums):
+    # a piece is complete if all its files exist with the recorded size and,
+    # optionally, the recorded checksum
+    fs, root = filesystem(folder)
+    paths = [f"{root}/{f['path']}" for f in entry["files"]]
+    for f, info in zip(entry["files"], fs.get_file_info(paths)):
+        if info.type != pafs.FileType.File or info.size != f["bytes"]:
+            return False
+        if verify_checksums and file_checksum(f"{folder}/{f['path']}") != f["checksum"]:
+            return False
+    return True
+
+
+def report_piece_sizes(completed, tables, target_piece_bytes):
+    # realized file sizes of every table, to compare with the planned size
+    mb = 1024 * 1024
+    if target_piece_bytes:
+        print(f"Target piece size: {target_piece_bytes / mb:.1f} MB")
+    print(
+        f"{'table':<10}{'pieces':>8}{'files':>8}{'min MB':>10}{'median MB':>11}"
+        f"{'max MB':>10}{'total MB':>11}"
+    )
+    for table_name, info in tables.items():
+        sizes = sorted(
+            f["bytes"]
+            for entry in completed.get(table_name, {}).values()
+            for f in entry["files"]
+        )
+        if not sizes:
+            continue
+        print(
+            f"{table_name:<10}{info[1]:>8}{len(sizes):>8}{sizes[0] / mb:>10.1f}"
+            f"{sizes[len(sizes) // 2] / mb:>11.1f}{sizes[-1] / mb:>10.1f}"
+            f"{sum(sizes) / mb:>11.1f}"
+        )
+
+
+def write_catalog(folder, dataset_info, completed):
+    # write a _metadata file with the footers of all files of every
+    # partitioned table, and the row counts and column statistics of the
+    # dataset to _catalog.json, so readers can plan without opening each file
+    catalog_path = f"{folder}/{catalog.catalog_file}"
+    previous = {}
+    if file_info(catalog_path).type == pafs.FileType.File:
+        previous = read_json(catalog_path)["tables"]
+    tables = {}
+    for table_name, entries in sorted(completed.items()):
+        if table_name not in dataset_info["num_pieces"]:
+            # refresh sets
+            continue
+        entries = [entry for _, entry in sorted(entries.items())]
+        # sketches are merged with max, so pieces regenerated on a resume can
+        # be merged again into the sketches of the previous run
+        sketches = catalog.decode_sketches(previous.get(table_name, {}).get("hll", {}))
+        has_sketches = bool(sketches) or all("hll" in entry for entry in entries)
+        prefix = f"{table_name}.parquet/"
+        metadata = None
+        num_files = num_bytes = 0
+        for entry in entries:
+            catalog.merge_sketches(sketches, catalog.decode_sketches(entry.get("hll", {})))
+            for f in entry["files"]:
+                fs, fpath = filesystem(f"{folder}/{f['path']}")
+                file_metadata = pq.read_metadata(fpath, filesystem=fs)
+                if f["path"].startswith(prefix):
+                    file_metadata.set_file_path(f["path"][len(prefix) :])
+                if metadata is None:
+                    metadata = file_metadata
+                else:
+                    metadata.append_row_groups(file_metadata)
+                num_files += 1
+                num_bytes += f["bytes"]
+        if metadata is None:
+            continue
+        if entries[0]["files"][0]["path"].startswith(prefix):
+            fs, fpath = filesystem(f"{folder}/{prefix}_metadata")
+            with fs.open_output_stream(fpath) as f:
+                metadata.write_metadata_file(f)
+        stats = catalog.table_statistics(metadata, sketches if has_sketches else None)
+        stats.update(files=num_files, bytes=num_bytes)
+        stats["hll"] = catalog.encode_sketches(sketches) if has_sketches else {}
+        tables[table_name] = stats
+    write_json(
+        catalog_path,
+        {"scale_factor": dataset_info["scale_factor"], "tables": tables},
+    )
+
+
+def timed_task(args):
+    # run a task in a worker and report when and where it ran, and what it
+    # spent its time and memory on
+    func, task_args = args
+    profiling.start_task()
+    start = time.time()
+    result = func(task_args)
+    return os.getpid(), start, time.time(), result, profiling.finish_task()
+
+
+def run_scheduled(
+    tasks, num_processes, on_done, upload_budget=uploads.default_budget_bytes
+):
+    # Run (cost, func, args) tasks in a single Pool, most expensive first.
+    # Only as many tasks as there are workers are handed to the Pool at a
+    # time, so tasks returned by `on_done(func, args, result)` on completion
+    # are ordered by cost together with the ones still queued. Returns the
+    # profiles of the tasks added up per table.
+    ready = []
+    order = itertools.count()
+    for cost, func, args in tasks:
+        heapq.heappush(ready, (-cost, next(order), func, args))
+    finished = queue.SimpleQueue()
+    busy = collections.defaultdict(float)
+    num_tasks = collections.defaultdict(int)
+    table_profiles = {}
+    start = time.time()
+    in_flight = 0
+    budget = (upload_budget // num_processes,)
+    with Pool(num_processes, uploads.set_budget, budget) as pool:
+        while ready or in_flight:
+            while ready and in_flight < num_processes:
+                _, _, func, args = heapq.heappop(ready)
+                pool.apply_async(
+                    timed_task,
+                    ((func, args),),
+                    callback=lambda r, f=func, a=args: finished.put((f, a, r)),
+                    error_callback=lambda e: finished.put((None, None, e)),
+                )
+                in_flight += 1
+            func, args, result = finished.get()
+            in_flight -= 1
+            if func is None:
+                raise result
+            pid, task_start, task_end, result, profile = result
+            busy[pid] += task_end - task_start
+            num_tasks[pid] += 1
+            profiling.add_task(
+                table_profiles, args[0]["table_name"], task_end - task_start, profile
+            )
+            for cost, func, args in on_done(func, args, result):
+                heapq.heappush(ready, (-cost, next(order), func, args))
+    wall = time.time() - start
+    if not num_tasks:
+        return table_profiles
+    print(f"Generation wall time (s): {wall:.1f}")
+    for pid in sorted(busy):
+        print(
+            f"worker {pid}: {num_tasks[pid]} tasks, busy {busy[pid]:.1f}s "
+            f"({100 * busy[pid] / wall:.0f}%)"
+        )
+    total = sum(busy.values()) / (wall * num_processes)
+    print(f"Average worker utilization: {100 * total:.0f}%")
+    return table_profiles
+
+
+def write_profile(path, profile):
+    # per-stage time, bytes and peak memory of the generation tasks
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(profile.to_string(index=False))
+    fs, fpath = filesystem(path)
+    fs.create_dir(fpath.rsplit("/", 1)[0], recursive=True)
+    with fs.open_output_stream(fpath) as f:
+        f.write(profile.to_csv(index=False).encode())
+
+
+def read_profiles(folder):
+    # the profiles written by the shards of a dataset
+    fs, root = filesystem(f"{folder}/{profiling.shard_profile_dir}")
+    selector = pafs.FileSelector(root, allow_not_found=True)
+    profiles = []
+    for info in fs.get_file_info(selector):
+        if info.type == pafs.FileType.File and info.path.endswith(".csv"):
+            with fs.open_input_stream(info.path) as f:
+                profiles.append(pd.read_csv(f))
+    return profiles
+
+
+def shard_pieces(tables, scale_factor, refresh_sets, shard, num_shards):
+    # Pieces of shard `shard` (1-based) of `num_shards`. The pieces of all
+    # tables are dealt out most expensive first, each to the shard with the
+    # least work so far, so every shard gets about the same amount of work.
+    # The assignment only depends on the arguments, so independent runs on
+    # different hosts agree on it.
+    tasks = [
+        (estimate_piece_cost(table_name, scale_factor, info[1]), table_name, piece)
+        for table_name, info in tables.items()
+        for piece in range(info[1])
+    ]
+    if refresh_sets:
+        tasks.append((estimate_piece_cost("orders", scale_factor, 1), "refresh", 0))
+    tasks.sort(key=lambda task: (-task[0], task[1], task[2]))
+    loads = [(0.0, i) for i in range(num_shards)]
+    pieces = {}
+    for cost, table_name, piece in tasks:
+        load, i = heapq.heappop(loads)
+        if i == shard - 1:
+            pieces.setdefault(table_name, []).append(piece)
+        heapq.heappush(loads, (load + cost, i))
+    load = next(load for load, i in loads if i == shard - 1)
+    share = load / sum(task[0] for task in tasks)
+    print(f"shard {shard}/{num_shards}: {100 * share:.1f}% of the estimated work")
+    return {table_name: sorted(p) for table_name, p in pieces.items()}
+
+
+def range_pieces(tables, refresh_sets, start, end):
+    # pieces start..end-1 of every table; the refresh sets go with piece 0
+    pieces = {
+        table_name: list(range(start, min(end, info[1])))
+        for table_name, info in tables.items()
+    }
+    if refresh_sets and start == 0 < end:
+        pieces["refresh"] = [0]
+    return {table_name: p for table_name, p in pieces.items() if p}
+
+
+def write_answers(folder):
+    # reference answers of a dataset, from the pandas queries
+    shutil.rmtree(f"{folder}/answers", ignore_errors=True)
+    subprocess.run(
+        [sys.executable, "pandas_query.py", "--path", os.path.abspath(folder)]
+        + ["--write_answers"],
+        check=True,
+        cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), "pandas"),
+    )
 
 
 def generate(
-    tables, SCALE_FACTOR, folder, upload_to_s3, validate_dataset, num_processes
+    tables,
+    SCALE_FACTOR,
+    folder,
+    upload_to_s3,
+    validate_dataset,
+    num_processes,
+    stream_batch_rows=None,
+    layout="default",
+    cluster_keys=None,
+    partition_keys=None,
+    resume=False,
+    verify_checksums=False,
+    refresh_sets=0,
+    file_format="parquet",
+    target_piece_bytes=None,
+    dictionary=False,
+    money="float",
+    generator="dbgen",
+    skew=None,
+    upload_budget=uploads.default_budget_bytes,
+    shard=None,
+    indexes=None,
 ):
+    # `shard` is {"name": ..., "pieces": {table: [piece, ...]}} for a run that
+    # generates only some pieces of a dataset shared with other runs
+    skew = skew or {}
+    cluster_keys = cluster_keys or {}
+    partition_keys = partition_keys or {}
+    if shard:
+        # shards never remove what other shards wrote, and skip the pieces
+        # that are already complete like a resumed run
+        resume = True
 
     if upload_to_s3:
         assert "AWS_ACCESS_KEY_ID" in os.environ, "AWS credentials not set"
-    else:
+    elif not resume:
         shutil.rmtree(f"{folder}", ignore_errors=True)
-        os.mkdir(f"{folder}")
-
-    if validate_dataset:
-        fs = None
-        if upload_to_s3:
-            import s3fs
+    if not upload_to_s3:
+        os.makedirs(f"{folder}", exist_ok=True)
 
-            fs = s3fs.S3FileSystem()
+    # record how the dataset was written so that runs against datasets with
+    # different layouts at the same SF can be told apart
+    dataset_prefix = folder.rstrip("/") if upload_to_s3 else folder
+    dataset_info = {
+        "scale_factor": SCALE_FACTOR,
+        "generator": generator,
+        "skew": skew,
+        "format": file_format,
+        "layout": layout,
+        "dictionary": dictionary,
+        "money": money,
+        "parquet_options": layout_profiles[layout],
+        "cluster_by": cluster_keys,
+        "partition_by": partition_keys,
+        "stream_batch_rows": stream_batch_rows,
+        "target_piece_bytes": target_piece_bytes,
+        "num_pieces": {name: info[1] for name, info in tables.items()},
+        "refresh_sets": refresh_sets,
+        "indexes": indexes,
+    }
+    completed = {}
+    info_path = f"{dataset_prefix}/_dataset.json"
+    if resume and file_info(info_path).type == pafs.FileType.File:
+        # pieces can only be reused if they were generated the same way
+        previous = read_json(info_path)
+        if previous != json.loads(json.dumps(dataset_info)):
+            raise ValueError(f"cannot resume {folder}: it was generated with {previous}")
+        completed = read_manifest(dataset_prefix)
+    elif not resume:
+        # entries left in the bucket by an earlier run
+        remove_dir(f"{dataset_prefix}/_manifest")
+        remove_file(f"{dataset_prefix}/_manifest.json")
+        remove_file(f"{dataset_prefix}/{catalog.catalog_file}")
+    write_json(info_path, dataset_info)
+    if generator == "numpy":
+        # build the text pool once, before the workers read it from the cache
+        numpy_dbgen.text_pool()
 
+    # every piece of every table goes into one task queue
+    tasks = []
+    pending = {}
     for table_name, (table_short, num_pieces, load_func) in tables.items():
 
-        if upload_to_s3:
-            output_prefix = f"s3://{folder}/{table_name}.parquet"
+        extension = file_extensions[file_format]
+        output_prefix = f"{dataset_prefix}/{table_name}.{extension}"
+        if upload_to_s3 and not resume:
+            # objects left in the bucket by an earlier run
+            remove_dir(output_prefix)
+        elif not upload_to_s3 and table_name in directory_tables:
+            os.makedirs(output_prefix, exist_ok=True)
+
+        cluster_key = cluster_keys.get(table_name)
+        partition_key = partition_keys.get(table_name)
+        if partition_key:
+            # partitions are cut from pieces clustered by the partition date
+            cluster_key = partition_key
+        options = {
+            "scale_factor": SCALE_FACTOR,
+            "table_name": table_name,
+            "table_short": table_short,
+            "num_pieces": num_pieces,
+            "load_func": load_func,
+            "folder": dataset_prefix,
+            "output_prefix": output_prefix,
+            "stream_batch_rows": stream_batch_rows,
+            "layout": layout,
+            "file_format": file_format,
+            "dictionary": dictionary,
+            "money": money,
+            "generator": generator,
+            "skew": skew,
+            "indexes": indexes,
+            "cluster_key": cluster_key,
+            "partition_key": partition_key,
+        }
+
+        done = {
+            piece
+            for piece, entry in completed.get(table_name, {}).items()
+            if piece_is_complete(dataset_prefix, entry, verify_checksums)
+        }
+        assigned = shard["pieces"].get(table_name, []) if shard else range(num_pieces)
+        pieces = [p for p in assigned if p not in done]
+        if not pieces:
+            if assigned:
+                print(f"{table_name}: all {len(assigned)} pieces complete, skipping")
+            continue
+        if cluster_key and len(pieces) < num_pieces:
+            # clustered pieces share their boundaries, so rebuild the table
+            print(f"{table_name}: clustered table incomplete, regenerating")
+            remove_dir(output_prefix)
+            if not upload_to_s3 and table_name in directory_tables:
+                os.makedirs(output_prefix)
+            pieces = list(range(num_pieces))
+        elif len(pieces) < num_pieces:
+            print(f"{table_name}: generating {len(pieces)} of {num_pieces} pieces")
+
+        if cluster_key and num_pieces > 1 and not upload_to_s3:
+            os.makedirs(f"{output_prefix}/_runs", exist_ok=True)
+        cost = estimate_piece_cost(table_name, SCALE_FACTOR, num_pieces)
+        tasks += [(cost, to_parquet, (options, p)) for p in pieces]
+        pending[table_name] = (options, pieces)
+
+    if refresh_sets and (not shard or "refresh" in shard["pieces"]):
+        options = {
+            "scale_factor": SCALE_FACTOR,
+            "table_name": "refresh",
+            "num_pieces": 1,
+            "folder": dataset_prefix,
+            "output_prefix": f"{dataset_prefix}/refresh",
+            "layout": layout,
+            "file_format": file_format,
+            "dictionary": dictionary,
+            "money": money,
+            "skew": skew,
+            "indexes": indexes,
+            "refresh_sets": refresh_sets,
+        }
+        entry = completed.get("refresh", {}).get(0)
+        if entry and piece_is_complete(dataset_prefix, entry, verify_checksums):
+            print(f"refresh: all {refresh_sets} sets complete, skipping")
         else:
-            output_prefix = f"{folder}/{table_name}.parquet"
-            if num_pieces > 1:
-                os.mkdir(output_prefix)
+            remove_dir(options["output_prefix"])
+            # dbgen -U walks through the whole orders table to produce the
+            # update sets, so it costs about as much as generating orders
+            cost = estimate_piece_cost("orders", SCALE_FACTOR, 1)
+            tasks.append((cost, refresh_to_parquet, (options, 0)))
 
-        if num_pieces > 1:
-            with Pool(num_processes) as pool:
-                pool.map(
-                    to_parquet,
-                    [
-                        (
-                            SCALE_FACTOR,
-                            table_name,
-                            table_short,
-                            load_func,
-                            p,
-                            num_pieces,
-                            output_prefix,
-                        )
-                        for p in range(num_pieces)
-                    ],
+    # the sorted runs of a clustered table are merged into globally ordered
+    # pieces once all of them are written
+    runs = {table_name: [] for table_name in pending}
+    merges_left = {}
+
+    def on_done(func, args, result):
+        options = args[0]
+        table_name = options["table_name"]
+        if func is to_parquet and result is not None:
+            runs[table_name].append(result)
+            pieces = pending[table_name][1]
+            if len(runs[table_name]) == len(pieces):
+                merges = merge_tasks(options, runs[table_name], pieces)
+                merges_left[table_name] = len(merges)
+                cost = estimate_piece_cost(
+                    table_name, SCALE_FACTOR, options["num_pieces"]
                 )
+                return [(cost, merge_runs, merge) for merge in merges]
+        elif func is merge_runs:
+            merges_left[table_name] -= 1
+            if merges_left[table_name] == 0:
+                remove_dir(f"{options['output_prefix']}/_runs")
+        return []
+
+    table_profiles = run_scheduled(tasks, num_processes, on_done, upload_budget)
+    if table_profiles:
+        profile = profiling.profile_summary(table_profiles, SCALE_FACTOR)
+        if shard:
+            profile_path = f"{profiling.shard_profile_dir}/{shard['name']}.csv"
         else:
-            dbgen_fname = f"{tpch_dbgen_location}/{table_name}.tbl"
-            # generate the whole table for the given scale factor with dbgen
-            remove_file_if_exists(dbgen_fname)
-            cmd = f"./dbgen -f -s {SCALE_FACTOR} -T {table_short}"
-            subprocess.run(cmd.split(), check=True, cwd=tpch_dbgen_location)
-            # load csv file into pandas dataframe
-            df = load_func(dbgen_fname)
-            # csv file no longer needed, remove
-            os.remove(dbgen_fname)
-            # write dataframe to parquet
-            df.to_parquet(output_prefix)
-
-        if validate_dataset:
-            # make sure dataset is correct
-            ds = pq.ParquetDataset(output_prefix, filesystem=fs)
-            assert len(ds.pieces) == num_pieces
+            profile_path = profiling.profile_file
+        write_profile(f"{dataset_prefix}/{profile_path}", profile)
+    completed = read_manifest(dataset_prefix)
+    missing = [
+        f"{table_name} piece {piece}"
+        for table_name, (_, pieces) in pending.items()
+        for piece in pieces
+        if piece not in completed.get(table_name, {})
+    ]
+    if missing:
+        retry = "Run this shard again" if shard else "Rerun with --resume"
+        raise RuntimeError(f"not written: {', '.join(missing)}. {retry} to retry them")
+    if shard:
+        # the manifest, catalog and answers are written by --finalize
+        print(f"{shard['name']} done, run --finalize once all shards are done")
+        return
+
+    validate_tables = list(pending) if validate_dataset else []
+    finish_dataset(folder, dataset_info, tables, completed, validate_tables, pending)
+
+
+def finish_dataset(folder, dataset_info, tables, completed, validate_tables, rebuild):
+    # validate the tables, write the catalog and the consolidated manifest,
+    # and the answers of a skewed dataset. The catalog and answers are
+    # written if `rebuild` or if they do not exist yet.
+    upload_to_s3 = folder.startswith("s3://")
+    dataset_prefix = folder.rstrip("/") if upload_to_s3 else folder
+    file_format = dataset_info["format"]
+    for table_name in validate_tables:
+        # make sure dataset is correct
+        output_prefix = table_path(dataset_prefix, table_name, file_format)
+        num_pieces = dataset_info["num_pieces"][table_name]
+        if file_format == "parquet":
+            ds = pq.ParquetDataset(output_prefix)
+            num_files = len(ds.fragments)
+        else:
+            dataset_format = {"feather": "ipc", "ipc-uncompressed": "ipc"}
+            ds = pads.dataset(
+                output_prefix, format=dataset_format.get(file_format, file_format)
+            )
+            num_files = len(ds.files)
+        if table_name in dataset_info["partition_by"]:
+            # pieces that span a month boundary are split in two files
+            assert num_files >= num_pieces
+        else:
+            assert num_files == num_pieces
+
+    report_piece_sizes(completed, tables, dataset_info["target_piece_bytes"])
+    catalog_info = file_info(f"{dataset_prefix}/{catalog.catalog_file}")
+    # the catalog is built from parquet footers
+    if file_format == "parquet" and (
+        rebuild or catalog_info.type != pafs.FileType.File
+    ):
+        start = time.time()
+        write_catalog(dataset_prefix, dataset_info, completed)
+        print(f"wrote _metadata files and catalog in {time.time() - start:.2f}s")
+
+    # consolidate the per-piece entries into a single manifest; the sketches
+    # now live in the catalog
+    write_json(
+        f"{dataset_prefix}/_manifest.json",
+        {
+            "parameters": dataset_info,
+            "tables": {
+                table_name: [
+                    {k: v for k, v in entry.items() if k != "hll"}
+                    for _, entry in sorted(entries.items())
+                ]
+                for table_name, entries in completed.items()
+            },
+        },
+    )
+    remove_dir(f"{dataset_prefix}/_manifest")
+
+    if dataset_info["skew"]:
+        # the official answers only hold for dbgen's uniform keys
+        if upload_to_s3 or file_format != "parquet":
+            print(
+                "run pandas/pandas_query.py --path <local copy> --write_answers "
+                "to write the answers of the skewed dataset"
+            )
+        elif rebuild or not os.path.isdir(f"{folder}/answers"):
+            start = time.time()
+            write_answers(folder)
+            print(f"wrote answers of the skewed dataset in {time.time() - start:.2f}s")
+
+
+def finalize(folder, validate_dataset):
+    # Once every shard is done: check that all pieces were written, then
+    # write the manifest, catalog, answers and profile of the whole dataset
+    dataset_prefix = folder.rstrip("/") if folder.startswith("s3://") else folder
+    info_path = f"{dataset_prefix}/_dataset.json"
+    if file_info(info_path).type != pafs.FileType.File:
+        raise ValueError(f"{folder} has no _dataset.json, no shard was run")
+    dataset_info = read_json(info_path)
+    expected = dict(dataset_info["num_pieces"])
+    if dataset_info["refresh_sets"]:
+        expected["refresh"] = 1
+    completed = read_manifest(dataset_prefix)
+    missing = [
+        f"{table_name} piece {piece}"
+        for table_name, num_pieces in expected.items()
+        for piece in range(num_pieces)
+        if piece not in completed.get(table_name, {})
+    ]
+    if missing:
+        raise RuntimeError(
+            f"not written: {', '.join(missing)}. Run the shards that generate "
+            "them again before finalizing"
+        )
+    profiles = read_profiles(dataset_prefix)
+    if profiles:
+        profile = profiling.merge_profiles(profiles)
+        write_profile(f"{dataset_prefix}/{profiling.profile_file}", profile)
+    tables = get_tables_info(dataset_info["num_pieces"])
+    validate_tables = list(dataset_info["num_pieces"]) if validate_dataset else []
+    finish_dataset(folder, dataset_info, tables, completed, validate_tables, True)
 
 
 if __name__ == "__main__":
@@ -275,20 +1617,273 @@ if __name__ == "__main__":
         default=True,
         help="Validate each parquet dataset with pyarrow.parquet.ParquetDataset",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream dbgen output through a FIFO into parquet instead of writing "
+        "intermediate .tbl files",
+    )
+    parser.add_argument(
+        "--stream_batch_rows",
+        type=int,
+        default=default_stream_batch_rows,
+        help="Rows buffered per worker before flushing to parquet in stream mode",
+    )
+    parser.add_argument(
+        "--layout",
+        type=str,
+        choices=list(layout_profiles),
+        default="default",
+        help="Parquet physical layout profile (row groups, codec, pages, dictionary)",
+    )
+    parser.add_argument(
+        "--cluster_by",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Globally sort lineitem and/or orders by these columns before "
+        "writing, e.g. L_SHIPDATE O_ORDERDATE",
+    )
+    parser.add_argument(
+        "--partition_by",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Write lineitem and/or orders as year=YYYY/month=MM/ directories "
+        "of this date column, e.g. L_SHIPDATE O_ORDERDATE",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep the pieces already recorded in the manifest of FOLDER and "
+        "generate only missing or corrupt ones",
+    )
+    parser.add_argument(
+        "--verify_checksums",
+        action="store_true",
+        help="With --resume, also check the checksum of every recorded piece",
+    )
+    parser.add_argument(
+        "--num_processes",
+        type=int,
+        default=max(1, os.cpu_count() // 2),
+        help="Number of worker processes running dbgen (Default half the CPUs)",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=list(file_extensions),
+        default="parquet",
+        help="File format of the generated tables",
+    )
+    parser.add_argument(
+        "--dictionary",
+        action="store_true",
+        help="Store low-cardinality string columns as dictionaries, read back "
+        "as categoricals",
+    )
+    parser.add_argument(
+        "--money",
+        type=str,
+        default="float",
+        choices=list(money_types),
+        help="Type of the price, discount, tax, balance and cost columns: "
+        "float64, decimal(15,2) or int64 hundredths",
+    )
+    parser.add_argument(
+        "--generator",
+        type=str,
+        default="dbgen",
+        choices=["dbgen", "numpy"],
+        help="Run the dbgen binary or its NumPy port, which writes the same rows "
+        "without intermediate files",
+    )
+    parser.add_argument(
+        "--skew",
+        type=str,
+        nargs="+",
+        default=[],
+        metavar="COLUMN=THETA",
+        help="Draw these foreign keys from a Zipf distribution with exponent THETA "
+        f"instead of uniformly, out of {', '.join(skew_columns)}. Skewed lineitem "
+        "keys recompute L_EXTENDEDPRICE and O_TOTALPRICE",
+    )
+    parser.add_argument(
+        "--upload_budget_mb",
+        type=float,
+        default=uploads.default_budget_bytes / 1024 / 1024,
+        help="Bytes that may be written to an object store and not yet uploaded "
+        "at a time, in MB, split evenly among the workers",
+    )
+    parser.add_argument(
+        "--target_piece_mb",
+        type=float,
+        default=default_target_piece_mb,
+        help="Approximate size of every output piece on disk, in MB",
+    )
+    parser.add_argument(
+        "--refresh_sets",
+        type=int,
+        default=0,
+        help="Number of RF1/RF2 refresh sets to generate with dbgen -U",
+    )
+    parser.add_argument(
+        "--page_index",
+        action="store_true",
+        help="Write the column and offset indexes of the Parquet pages of every "
+        "column, so readers can skip pages within a row group",
+    )
+    parser.add_argument(
+        "--bloom_filter",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Write a split-block bloom filter of every row group for these "
+        "columns, e.g. L_PARTKEY O_CUSTKEY",
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        metavar="I/N",
+        help="Generate only the I-th (1-based) of N shares of the pieces into a "
+        "folder shared with the runs of the other shares, then run --finalize",
+    )
+    parser.add_argument(
+        "--piece_range",
+        type=str,
+        metavar="START:END",
+        help="Generate only pieces START to END-1 of every table into a folder "
+        "shared with other runs, then run --finalize",
+    )
+    parser.add_argument(
+        "--finalize",
+        action="store_true",
+        help="Write the manifest, catalog and answers of a dataset generated by "
+        "--shard or --piece_range runs, once all of them are done",
+    )
     args = parser.parse_args()
     SCALE_FACTOR = args.SF
     folder = args.folder
     validate_dataset = args.validate_dataset
-    num_processes = os.cpu_count() // 2
+    stream_batch_rows = args.stream_batch_rows if args.stream else None
+    num_processes = args.num_processes
     upload_to_s3 = True if folder.startswith("s3://") else False
-    # For SF1000 or more 1000
-    if SCALE_FACTOR >= 1000:
-        num_pieces_base = 1000
-    else:
-        # For smaller SFs
-        num_pieces_base = 100
-    tables = get_tables_info(num_pieces_base)
+    if args.finalize:
+        # all the other parameters come from the dataset's _dataset.json
+        finalize(folder, validate_dataset)
+        sys.exit()
+    if args.shard and args.piece_range:
+        parser.error("--shard and --piece_range cannot be combined")
+    if (args.shard or args.piece_range) and (args.cluster_by or args.partition_by):
+        # clustered tables are sorted across all their pieces at once
+        parser.error("--cluster_by and --partition_by cannot be sharded")
+    if args.format != "parquet" and args.layout != "default":
+        parser.error("--layout only applies to --format parquet")
+    indexes = None
+    if args.page_index or args.bloom_filter:
+        if args.format != "parquet":
+            parser.error(
+                "--page_index and --bloom_filter only apply to --format parquet"
+            )
+        for column in args.bloom_filter:
+            if not any(column in dict(columns) for columns in arrow_columns.values()):
+                parser.error(f"--bloom_filter: {column} is not a TPC-H column")
+        indexes = {"page_index": args.page_index, "bloom_filter": args.bloom_filter}
+    if args.generator == "numpy":
+        if args.stream:
+            parser.error("--stream only applies to --generator dbgen")
+        if SCALE_FACTOR >= numpy_dbgen.max_scale_factor:
+            parser.error(
+                f"--generator numpy supports SF below {numpy_dbgen.max_scale_factor}"
+            )
+    try:
+        skew = parse_skew(args.skew)
+    except ValueError as e:
+        parser.error(f"--skew: {e}")
+    if (
+        any(skew_columns[c] == "lineitem" for c in skew)
+        and SCALE_FACTOR >= numpy_dbgen.max_scale_factor
+    ):
+        # the order totals are summed over lines of the NumPy port
+        parser.error(
+            "--skew: lineitem keys can only be skewed below "
+            f"SF{numpy_dbgen.max_scale_factor}"
+        )
+    cluster_keys = {}
+    for column in args.cluster_by:
+        table_name = next(
+            (t for t in cluster_tiebreak if column in dict(arrow_columns[t])), None
+        )
+        if table_name is None:
+            parser.error(f"--cluster_by: {column} is not a lineitem or orders column")
+        if table_name in cluster_keys:
+            parser.error(f"--cluster_by: more than one column given for {table_name}")
+        cluster_keys[table_name] = column
+    partition_keys = {}
+    for column in args.partition_by:
+        table_name = next(
+            (t for t in cluster_tiebreak if column in dict(arrow_columns[t])), None
+        )
+        if table_name is None or dict(arrow_columns[table_name])[column] != pa.date32():
+            parser.error(
+                f"--partition_by: {column} is not a lineitem or orders date column"
+            )
+        if table_name in partition_keys:
+            parser.error(f"--partition_by: more than one column given for {table_name}")
+        if cluster_keys.get(table_name, column) != column:
+            parser.error(
+                f"--partition_by: {table_name} must be clustered by {column}"
+            )
+        partition_keys[table_name] = column
+    target_piece_bytes = args.target_piece_mb * 1024 * 1024
+    num_pieces = plan_pieces(SCALE_FACTOR, target_piece_bytes, args.format)
+    print(f"Pieces per table: {num_pieces}")
+    tables = get_tables_info(num_pieces)
+    shard = None
+    if args.shard:
+        try:
+            i, n = (int(x) for x in args.shard.split("/"))
+        except ValueError:
+            parser.error("--shard: expected I/N, e.g. 1/4")
+        if not 1 <= i <= n:
+            parser.error("--shard: I must be between 1 and N")
+        shard = {
+            "name": f"shard-{i}-of-{n}",
+            "pieces": shard_pieces(tables, SCALE_FACTOR, args.refresh_sets, i, n),
+        }
+    elif args.piece_range:
+        try:
+            start, end = (int(x) for x in args.piece_range.split(":"))
+        except ValueError:
+            parser.error("--piece_range: expected START:END, e.g. 0:8")
+        if not 0 <= start < end:
+            parser.error("--piece_range: expected 0 <= START < END")
+        shard = {
+            "name": f"pieces-{start}-{end}",
+            "pieces": range_pieces(tables, args.refresh_sets, start, end),
+        }
     set_start_method("spawn")
     generate(
-        tables, SCALE_FACTOR, folder, upload_to_s3, validate_dataset, num_processes
+        tables,
+        SCALE_FACTOR,
+        folder,
+        upload_to_s3,
+        validate_dataset,
+        num_processes,
+        stream_batch_rows,
+        args.layout,
+        cluster_keys,
+        partition_keys,
+        args.resume,
+        args.verify_checksums,
+        args.refresh_sets,
+        args.format,
+        target_piece_bytes,
+        args.dictionary,
+        args.money,
+        args.generator,
+        skew,
+        int(args.upload_budget_mb * 1024 * 1024),
+        shard,
+        indexes,
     )
@@ -1,3 +1,5 @@
+import os
+import sys
 import argparse
 import json
 import time
@@ -11,6 +13,12 @@ from utils import append_row
 import duckdb
 import ibis
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+from schema import money_columns
+from common_utils import MONEY_SCALE
+
 
 @functools.singledispatch
 def add_date(datestr, dy=0, dm=0, dd=0):
@@ -19,60 +27,73 @@ def add_date(datestr, dy=0, dm=0, dd=0):
     return dt.isoformat()
 
 
+def decode_money(t, table_name: str):
+    # --money decimal or int datasets store the money columns exactly, the
+    # queries work on float64
+    columns = {}
+    for name in money_columns.get(table_name, []):
+        dtype = t.schema()[name]
+        if dtype.is_integer():
+            columns[name] = t[name] / MONEY_SCALE
+        elif not dtype.is_floating():
+            columns[name] = t[name].cast("float64")
+    return t.mutate(**columns) if columns else t
+
+
 def load_lineitem(con, root: str):
-    data_path = root + "/lineitem.parquet/*.parquet"
+    data_path = root + "/lineitem.parquet/**/*.parquet"
     con.read_parquet(data_path, table_name="lineitem")
     t = con.table("lineitem")
-    return t
+    return decode_money(t, "lineitem")
 
 
 def load_part(con, root: str):
     data_path = root + "/part.parquet/*.parquet"
     con.read_parquet(data_path, table_name="part")
     t = con.table("part")
-    return t
+    return decode_money(t, "part")
 
 
 def load_orders(con, root: str):
-    data_path = root + "/orders.parquet/*.parquet"
+    data_path = root + "/orders.parquet/**/*.parquet"
     con.read_parquet(data_path, table_name="orders")
     t = con.table("orders")
-    return t
+    return decode_money(t, "orders")
 
 
 def load_customer(con, root: str):
     data_path = root + "/customer.parquet/*.parquet"
     con.read_parquet(data_path, table_name="customer")
     t = con.table("customer")
-    return t
+    return decode_money(t, "customer")
 
 
 def load_nation(con, root: str):
     data_path = root + "/nation.parquet"
     con.read_parquet(data_path, table_name="nation")
     t = con.table("nation")
-    return t
+    return decode_money(t, "nation")
 
 
 def load_region(con, root: str):
     data_path = root + "/region.parquet"
     con.read_parquet(data_path, table_name="region")
     t = con.table("region")
-    return t
+    return decode_money(t, "region")
 
 
 def load_supplier(con, root: str):
-    data_path = root + "/supplier.parquet"
+    data_path = root + "/supplier.parquet/*.parquet"
     con.read_parquet(data_path, table_name="supplier")
     t = con.table("supplier")
-    return t
+    return decode_money(t, "supplier")
 
 
 def load_partsupp(con, root: str):
     data_path = root + "/partsupp.parquet/*.parquet"
     con.read_parquet(data_path, table_name="partsupp")
     t = con.table("partsupp")
-    return t
+    return decode_money(t, "partsupp")
 
 
 def q01(con, root, DELTA=0, DATE="1998-09-02"):
@@ -8,114 +8,130 @@ import traceback
 import ray
 import modin
 import modin.pandas as pd
+from modin.pandas.utils import from_arrow
 
 from pandas.core.frame import DataFrame as PandasDF
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
-from common_utils import append_row, ANSWERS_BASE_DIR
-
-dataset_dict = {}
-
-def load_lineitem(root: str, 
-                include_io: bool=False):
-    if 'lineitem' not in dataset_dict or include_io:
-        data_path = root + "/lineitem.parquet"
-        df = pd.read_parquet(data_path)
-        df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
-        df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
-        df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
-        result = df
-        dataset_dict['lineitem'] = result
+import table_memory
+from schema import (
+    query_columns,
+    query_scan_filters,
+    refresh_columns,
+    selected_columns,
+    table_weights,
+)
+from table_cache import cached_table
+from common_utils import (
+    append_row,
+    answers_dir,
+    dataset_format,
+    dataset_info,
+    decode_table,
+    read_arrow,
+    report_scan,
+    table_path,
+    timestamp_dates,
+    ANSWERS_BASE_DIR,
+)
+
+# columns of every table read by the loaders, those of the selected queries.
+# A table without an entry is read whole.
+table_columns = {}
+# --pushdown passes the filters of schema.query_filters to the reads of the
+# tables of each query with --include_io, with the year and month predicates
+# that prune the directories of tables written with --partition_by
+pushdown = False
+scan_filters = {}
+# seconds spent reading every table of the running query
+load_times = {}
+# --table_cache reads the tables from the memory-mapped decoded arrow files of
+# table_cache.py
+use_table_cache = False
+
+def read_table(
+    data_path: str, table_name: str, file_format: str = "parquet", cached=False
+):
+    t1 = time.time()
+    columns = table_columns.get(table_name)
+    filters = scan_filters.get(table_name)
+    if cached and filters is None and file_format == "parquet":
+        df = from_arrow(cached_table(data_path, table_name, columns))
+    elif file_format != "parquet":
+        table = read_arrow(data_path, table_name, file_format, columns, filters)
+        df = from_arrow(timestamp_dates(table, table_name))
     else:
-        result = dataset_dict['lineitem']
-    return result
+        df = pd.read_parquet(data_path, columns=columns, filters=filters)
+    df = decode_table(df, table_name, pd.to_datetime)
+    load_times[table_name] = load_times.get(table_name, 0.0) + time.time() - t1
+    return df
 
 
-def load_part(root: str, 
-            include_io: bool=False):
-    if 'part' not in dataset_dict or include_io:
-        data_path = root + "/part.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict['part'] = result
-    else:
-        result = dataset_dict['part']
-    return result
-
-
-def load_orders(root: str,
-            include_io: bool=False):
-    if "orders" not in dataset_dict or include_io:
-        data_path = root + "/orders.parquet"
-        df = pd.read_parquet(data_path)
-        df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
-        result = df
-        dataset_dict['orders'] = result
-    else:
-        result = dataset_dict['orders']
-    return result
+table_nbytes = table_memory.frame_nbytes
 
 
-def load_customer(root: str,
-            include_io: bool=False):
-    if "customer" not in dataset_dict or include_io:
-        data_path = root + "/customer.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict['customer'] = result
-    else:
-        result = dataset_dict['customer']
-    return result
+def load_table(root: str, table_name: str, include_io: bool = False):
+    df = table_memory.get_table(table_name)
+    if df is None or include_io:
+        file_format = dataset_format(root)
+        df = read_table(
+            table_path(root, table_name, file_format),
+            table_name,
+            file_format,
+            use_table_cache,
+        )
+        table_memory.put_table(table_name, df, table_nbytes)
+    return df
 
 
-def load_nation(root: str,
-            include_io: bool=False):
-    if "nation" not in dataset_dict or include_io:
-        data_path = root + "/nation.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict['nation'] = result
-    else:
-        result = dataset_dict['nation']
-    return result
+def load_lineitem(root: str, include_io: bool = False):
+    return load_table(root, "lineitem", include_io)
 
 
-def load_region(root: str,
-            include_io: bool=False):
-    if "region" not in dataset_dict or include_io:
-        data_path = root + "/region.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict['region'] = result
-    else:
-        result = dataset_dict['region']
-    return result
+def load_part(root: str, include_io: bool = False):
+    return load_table(root, "part", include_io)
 
 
-def load_supplier(root: str,
-            include_io: bool=False):
-    if "supplier" not in dataset_dict or include_io:
-        data_path = root + "/supplier.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict['supplier'] = result
-    else:
-        result = dataset_dict['supplier']
-    return result
+def load_orders(root: str, include_io: bool = False):
+    return load_table(root, "orders", include_io)
 
 
-def load_partsupp(root: str,
-            include_io: bool=False):
-    if "partsupp" not in dataset_dict or include_io:
-        data_path = root + "/partsupp.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict['partsupp'] = result
-    else:
-        result = dataset_dict['partsupp']
-    return result
+def load_customer(root: str, include_io: bool = False):
+    return load_table(root, "customer", include_io)
+
+
+def load_nation(root: str, include_io: bool = False):
+    return load_table(root, "nation", include_io)
+
+
+def load_region(root: str, include_io: bool = False):
+    return load_table(root, "region", include_io)
+
+
+def load_supplier(root: str, include_io: bool = False):
+    return load_table(root, "supplier", include_io)
+
+
+def load_partsupp(root: str, include_io: bool = False):
+    return load_table(root, "partsupp", include_io)
+
+
+def load_refresh_set(root: str, refresh_set: int):
+    # rows inserted by RF1 and order keys deleted by RF2 in one refresh set
+    set_path = root + f"/refresh/u{refresh_set}"
+    file_format = dataset_format(root)
+    orders = read_table(
+        table_path(set_path, "orders", file_format), "orders", file_format
+    )
+    lineitem = read_table(
+        table_path(set_path, "lineitem", file_format), "lineitem", file_format
+    )
+    delete = from_arrow(
+        read_arrow(table_path(set_path, "delete", file_format), "delete", file_format)
+    )
+    return orders, lineitem, delete
 
 
 def q01(root: str, 
@@ -148,7 +164,9 @@ def q01(root: str,
         * (1 - lineitem_filtered.L_DISCOUNT)
         * (1 + lineitem_filtered.L_TAX)
     )
-    gb = lineitem_filtered.groupby(["L_RETURNFLAG", "L_LINESTATUS"], as_index=False)[
+    gb = lineitem_filtered.groupby(
+        ["L_RETURNFLAG", "L_LINESTATUS"], as_index=False, observed=True
+    )[
         [
             "L_ORDERKEY",
             "L_QUANTITY",
@@ -348,7 +366,7 @@ def q04(root: str,
     forders = orders[osel]
     jn = forders[forders["O_ORDERKEY"].isin(flineitem["L_ORDERKEY"])]
     total = (
-        jn.groupby("O_ORDERPRIORITY", as_index=False)["O_ORDERKEY"]
+        jn.groupby("O_ORDERPRIORITY", as_index=False, observed=True)["O_ORDERKEY"]
         .count()
         .sort_values(["O_ORDERPRIORITY"])
     )
@@ -379,7 +397,7 @@ def q05(root: str,
         jn4, left_on=["S_SUPPKEY", "S_NATIONKEY"], right_on=["L_SUPPKEY", "N_NATIONKEY"]
     )
     jn5["REVENUE"] = jn5.L_EXTENDEDPRICE * (1.0 - jn5.L_DISCOUNT)
-    gb = jn5.groupby("N_NAME", as_index=False)["REVENUE"].sum()
+    gb = jn5.groupby("N_NAME", as_index=False, observed=True)["REVENUE"].sum()
     total = gb.sort_values("REVENUE", ascending=False)
     
     return total
@@ -496,9 +514,9 @@ def q07(root: str,
     # concat results
     total = pd.concat([total1, total2])
 
-    total = total.groupby(["SUPP_NATION", "CUST_NATION", "L_YEAR"], as_index=False).agg(
-        REVENUE=pd.NamedAgg(column="VOLUME", aggfunc="sum")
-    )
+    total = total.groupby(
+        ["SUPP_NATION", "CUST_NATION", "L_YEAR"], as_index=False, observed=True
+    ).agg(REVENUE=pd.NamedAgg(column="VOLUME", aggfunc="sum"))
     total = total.sort_values(
         by=["SUPP_NATION", "CUST_NATION", "L_YEAR"],
         ascending=[
@@ -613,7 +631,7 @@ def q09(root: str,
         (1 * jn5.PS_SUPPLYCOST) * jn5.L_QUANTITY
     )
     jn5["O_YEAR"] = jn5.O_ORDERDATE.apply(lambda x: x.year)
-    gb = jn5.groupby(["N_NAME", "O_YEAR"], as_index=False)["TMP"].sum()
+    gb = jn5.groupby(["N_NAME", "O_YEAR"], as_index=False, observed=True)["TMP"].sum()
     total = gb.sort_values(["N_NAME", "O_YEAR"], ascending=[True, False])
     
     return total
@@ -647,6 +665,7 @@ def q10(root: str,
             "C_COMMENT",
         ],
         as_index=False,
+        observed=True,
     )["TMP"].sum()
     total = gb.sort_values("TMP", ascending=False)
     total = total.head(20)
@@ -709,7 +728,9 @@ def q12(root: str,
     def g2(x):
         return ((x != "1-URGENT") & (x != "2-HIGH")).sum()
 
-    total = jn.groupby("L_SHIPMODE", as_index=False)["O_ORDERPRIORITY"].agg((g1, g2))
+    total = jn.groupby("L_SHIPMODE", as_index=False, observed=True)[
+        "O_ORDERPRIORITY"
+    ].agg((g1, g2))
     total = total.sort_values("L_SHIPMODE")
     return total
 
@@ -828,9 +849,9 @@ def q16(root: str,
     )
     total = total[total["S_SUPPKEY"].isna()]
     total = total.loc[:, ["P_BRAND", "P_TYPE", "P_SIZE", "PS_SUPPKEY"]]
-    total = total.groupby(["P_BRAND", "P_TYPE", "P_SIZE"], as_index=False)[
-        "PS_SUPPKEY"
-    ].nunique()
+    total = total.groupby(
+        ["P_BRAND", "P_TYPE", "P_SIZE"], as_index=False, observed=True
+    )["PS_SUPPKEY"].nunique()
     total.columns = ["P_BRAND", "P_TYPE", "P_SIZE", "SUPPLIER_CNT"]
     total = total.sort_values(
         by=["SUPPLIER_CNT", "P_BRAND", "P_TYPE", "P_SIZE"],
@@ -1151,6 +1172,28 @@ def q22(root: str,
     return total
 
 
+def rf1(root: str, refresh, include_io: bool = False):
+    # insert the new orders and their lineitems
+    new_orders, new_lineitem, _ = refresh
+    orders = load_orders(root, include_io)
+    lineitem = load_lineitem(root, include_io)
+    orders = pd.concat([orders, new_orders], ignore_index=True)
+    lineitem = pd.concat([lineitem, new_lineitem], ignore_index=True)
+    table_memory.put_table("orders", orders, table_nbytes, pin=True)
+    table_memory.put_table("lineitem", lineitem, table_nbytes, pin=True)
+
+
+def rf2(root: str, refresh, include_io: bool = False):
+    # delete the orders of the refresh set and their lineitems
+    _, _, delete = refresh
+    orders = load_orders(root, include_io)
+    lineitem = load_lineitem(root, include_io)
+    orders = orders[~orders.O_ORDERKEY.isin(delete.O_ORDERKEY)]
+    lineitem = lineitem[~lineitem.L_ORDERKEY.isin(delete.O_ORDERKEY)]
+    table_memory.put_table("orders", orders, table_nbytes, pin=True)
+    table_memory.put_table("lineitem", lineitem, table_nbytes, pin=True)
+
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1231,15 +1274,14 @@ def get_query_answer(query: int, base_dir: str = ANSWERS_BASE_DIR) -> PandasDF:
         os.path.join(base_dir, f"q{query}.out"),
         sep="|",
         parse_dates=True,
-        infer_datetime_format=True,
     )
     return answer_df.rename(columns=lambda x: x.strip())
 
 
-def test_results(q_num: int, result_df: PandasDF):
+def test_results(q_num: int, result_df: PandasDF, base_dir: str = ANSWERS_BASE_DIR):
     import pandas as pd
 
-    answer = get_query_answer(q_num)
+    answer = get_query_answer(q_num, base_dir)
 
     for column_index in range(len(answer.columns)):
         column_name = answer.columns[column_index]
@@ -1259,28 +1301,52 @@ def test_results(q_num: int, result_df: PandasDF):
                 rtol=1e-2)
 
 
+def load_query_tables(path, query, include_io=False):
+    for loader in query_to_loaders[query]:
+        loader(path, include_io)
+
+
 def run_queries(path, queries,
             backend = "ray",
             log_timing = True, 
             include_io = False, 
             test_result = True, 
             print_result = False):
+    # with a memory budget, the tables of each query are loaded before it
+    # runs, and the queries run in the order that shares the most tables
+    # between consecutive ones
+    budget = table_memory.budget_bytes is not None
+    if budget:
+        queries = table_memory.query_order(
+            queries, query_columns, table_weights(table_columns)
+        )
+        print(f"Query order: {queries}")
+    partition_by = dataset_info(path).get("partition_by", {})
     print("Start data loading")
     total_start = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path, include_io)
-    print(f"Data loading time (s): {time.time() - total_start}")
+    if not budget:
+        for query in queries:
+            load_query_tables(path, query, include_io)
+        print(f"Data loading time (s): {time.time() - total_start}")
+    load_time = 0.0
     total_start = time.time()
-    for query in queries:
+    for i, query in enumerate(queries):
+        table_memory.set_upcoming(query_columns[q] for q in queries[i:])
+        if budget and not include_io:
+            # with include_io the query reads its tables itself
+            t1 = time.time()
+            load_query_tables(path, query)
+            load_time += time.time() - t1
+        if pushdown:
+            scan_filters.update(query_scan_filters(query, partition_by))
+        load_times.clear()
         try:
             t1 = time.time()
             result = query_to_runner[query](path, include_io)
             dur = time.time() - t1
             success = True
             if test_result:
-                test_results(query, result)
+                test_results(query, result, answers_dir(path))
             if print_result:
                 print(result)
         except Exception as e: 
@@ -1291,7 +1357,53 @@ def run_queries(path, queries,
             if log_timing:
                 backend_str = "modin_on_" + backend
                 append_row(backend_str, query, dur, modin.__version__, success)
-    print(f"Total query execution time (s): {time.time() - total_start}")
+            if include_io:
+                report_scan(
+                    "modin_on_" + backend,
+                    path,
+                    query,
+                    pushdown,
+                    load_times,
+                    table_columns,
+                    scan_filters,
+                    log_timing,
+                )
+            scan_filters.clear()
+    query_time = time.time() - total_start - load_time
+    if budget:
+        print(f"Data loading time (s): {load_time}")
+        peak_mb = table_memory.peak_bytes / 1024 / 1024
+        print(f"Peak memory of the loaded tables (MB): {peak_mb:.0f}")
+    print(f"Total query execution time (s): {query_time}")
+
+
+def run_refresh(path, refresh_sets, backend="ray", log_timing=True, include_io=False):
+    # RF1 and RF2 of every refresh set, after the queries since they change
+    # orders and lineitem
+    total_start = time.time()
+    table_memory.set_upcoming([refresh_columns])
+    # the refresh sets change the in-memory tables in turn, so RF1 and RF2
+    # never read the base tables. With include_io they are read once
+    # here, as the queries may have kept filtered reads of them.
+    if include_io:
+        load_orders(path, include_io)
+        load_lineitem(path, include_io)
+    for refresh_set in range(1, refresh_sets + 1):
+        refresh = load_refresh_set(path, refresh_set)
+        for name, refresh_function in [("RF1", rf1), ("RF2", rf2)]:
+            try:
+                t1 = time.time()
+                refresh_function(path, refresh)
+                dur = time.time() - t1
+                success = True
+            except Exception as e:
+                print("".join(traceback.TracebackException.from_exception(e).format()))
+                dur = 0.0
+                success = False
+            finally:
+                if log_timing:
+                    append_row("modin_on_" + backend, name, dur, modin.__version__, success)
+    print(f"Total refresh time (s): {time.time() - total_start}")
 
 
 def main():
@@ -1344,8 +1456,41 @@ def main():
         action="store_true",
         help="print result.",
     )
+    parser.add_argument(
+        "--refresh_sets",
+        type=int,
+        default=0,
+        help="number of refresh sets to apply with RF1 and RF2 after the queries.",
+    )
+    parser.add_argument(
+        "--pushdown",
+        action="store_true",
+        help="filter the reads of --include_io with the date predicates of the "
+        "queries.",
+    )
+    parser.add_argument(
+        "--memory_budget_gb",
+        type=float,
+        help="keep the loaded tables within this many GB, evicting those "
+        "the next queries need last. By default every table stays loaded.",
+    )
+    parser.add_argument(
+        "--table_cache",
+        action="store_true",
+        help="read the tables from memory-mapped arrow files of the decoded "
+        "tables next to the dataset, written by the first run.",
+    )
     
     args = parser.parse_args()
+    if args.pushdown and not args.include_io:
+        parser.error("--pushdown filters the reads of --include_io")
+    if args.table_cache and "://" in args.path:
+        parser.error("--table_cache needs a local dataset")
+    global pushdown, use_table_cache
+    pushdown = args.pushdown
+    use_table_cache = args.table_cache
+    if args.memory_budget_gb is not None:
+        table_memory.set_budget(args.memory_budget_gb * 1024 * 1024 * 1024)
     backend = args.backend
     log_timing = args.log_timing
     include_io = args.include_io
@@ -1372,6 +1517,8 @@ def main():
     if args.queries is not None:
         queries = args.queries
     print(f"Queries to run: {queries}")
+    # read only the columns the queries use
+    table_columns.update(selected_columns(queries, args.refresh_sets > 0))
 
     import ray
     ray.init(address="auto")
@@ -1388,6 +1535,8 @@ def main():
     #     ray.init(address=args.endpoint)
 
     run_queries(path, queries, backend, log_timing, include_io, test_answer, print_result)
+    if args.refresh_sets:
+        run_refresh(path, args.refresh_sets, backend, log_timing, include_io)
 
     # if endpoint is None:
     #     ray.shutdown()
@@ -0,0 +1,798 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# A NumPy port of tpch-dbgen. Every column is drawn from the same random
+# number streams as dbgen, so the tables are identical to dbgen's output and
+# the queries return the official answers. dbgen moves every stream to a fixed
+# boundary after each row, which lets the k-th number of any row be computed
+# directly, so whole columns are generated at once instead of row by row.
+
+dbgen_location = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tpch-dbgen")
+dists_path = os.path.join(dbgen_location, "dists.dss")
+
+# dbg_text() draws every comment from this pool of generated sentences. It is
+# the same for every table and scale factor, so it is built once and cached.
+text_pool_size = 300 * 1024 * 1024
+text_pool_cache = os.path.join(
+    os.path.expanduser("~"), ".cache", "tpch", "text_pool.bin"
+)
+text_pool_seed = 933588178
+
+# Park & Miller "minimum standard" generator of rnd.c
+rng_multiplier = 16807
+rng_modulus = 2147483647
+max_long = 2147483647
+
+# from SF30000 on dbgen switches the order keys to a 64 bit generator
+max_scale_factor = 30000
+
+# seed and calls per row of the random number streams (rnd.h, dss.h)
+streams = {
+    "P_MFG": (1, 1),
+    "P_BRND": (46831694, 1),
+    "P_TYPE": (1841581359, 1),
+    "P_SIZE": (1193163244, 1),
+    "P_CNTR": (727633698, 1),
+    "P_CMNT": (804159733, 2),
+    "P_NAME": (709314158, 92),
+    "PS_QTY": (1671059989, 4),
+    "PS_SCST": (1051288424, 4),
+    "PS_CMNT": (1961692154, 8),
+    "O_CLRK": (1171034773, 1),
+    "O_CMNT": (276090261, 2),
+    "O_ODATE": (1066728069, 1),
+    "O_PRIO": (591449447, 1),
+    "O_CKEY": (851767375, 1),
+    "O_LCNT": (1434868289, 1),
+    "L_QTY": (209208115, 7),
+    "L_DCNT": (554590007, 7),
+    "L_TAX": (721958466, 7),
+    "L_SHIP": (1371272478, 7),
+    "L_SMODE": (675466456, 7),
+    "L_PKEY": (1808217256, 7),
+    "L_SKEY": (2095021727, 7),
+    "L_SDTE": (1769349045, 7),
+    "L_CDTE": (904914315, 7),
+    "L_RDTE": (373135028, 7),
+    "L_RFLG": (717419739, 7),
+    "L_CMNT": (1095462486, 14),
+    "C_ADDR": (881155353, 9),
+    "C_NTRG": (1489529863, 1),
+    "C_PHNE": (1521138112, 3),
+    "C_ABAL": (298370230, 1),
+    "C_MSEG": (1140279430, 1),
+    "C_CMNT": (1335826707, 2),
+    "S_ADDR": (706178559, 9),
+    "S_NTRG": (110356601, 1),
+    "S_PHNE": (884434366, 3),
+    "S_ABAL": (962338209, 1),
+    "S_CMNT": (1341315363, 2),
+    "BBB_JNK": (263032577, 1),
+    "BBB_TYPE": (753643799, 1),
+    "BBB_CMNT": (202794285, 1),
+    "BBB_OFFSET": (715851524, 1),
+    "N_CMNT": (606179079, 2),
+    "R_CMNT": (1500869201, 2),
+}
+
+# rows of every table at SF1. Partsupp and lineitem are generated from their
+# parts and orders.
+base_rows = {
+    "part": 200000,
+    "partsupp": 200000,
+    "supplier": 10000,
+    "customer": 150000,
+    "orders": 1500000,
+    "lineitem": 1500000,
+}
+
+# average lengths of the V_STR addresses and TEXT comments (shared.h)
+address_length = 25
+comment_lengths = {
+    "P_CMNT": 14,
+    "PS_CMNT": 124,
+    "S_CMNT": 63,
+    "C_CMNT": 73,
+    "O_CMNT": 49,
+    "L_CMNT": 27,
+    "N_CMNT": 72,
+    "R_CMNT": 72,
+}
+
+alpha_num = np.frombuffer(
+    b"0123456789abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ,", np.uint8
+)
+
+# dates are drawn as days since 1992-01-01 and stored as date32, days since
+# 1970-01-01. Orders are placed up to 151 days before the end of 1998.
+epoch_offset = 8035
+order_days = 2405
+# lines shipped by 1995-06-17 are filled and lines received by then returned
+current_day = 1263
+
+
+def read_dists(path=dists_path):
+    # every distribution of dists.dss as (members, cumulative weights), read
+    # like read_dist() of bm_utils.c
+    dists = {}
+    name = None
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n").split("#", 1)[0]
+            if not line:
+                continue
+            if name is None:
+                words = line.split()
+                if len(words) > 1 and words[0].lower() == "begin":
+                    name = words[1].lower()
+                    members, weights = [], []
+                continue
+            if line[:3].lower() == "end":
+                dists[name] = (members, np.cumsum(weights, dtype=np.int64))
+                name = None
+                continue
+            token, sep, weight = line.partition("|")
+            if not sep or not token:
+                continue
+            if token.lower() == "count":
+                continue
+            members.append(token)
+            weights.append(int(weight.split()[0]))
+    return dists
+
+
+def _powers(multiplier, count):
+    # multiplier**i mod the modulus for i in range(count)
+    powers = np.ones(max(count, 1), dtype=np.int64)
+    n = 1
+    while n < count:
+        step = min(n, count - n)
+        factor = pow(multiplier, n, rng_modulus)
+        powers[n : n + step] = powers[:step] * factor % rng_modulus
+        n += step
+    return powers[:count]
+
+
+def stream_values(name, first_row, num_rows, calls=None):
+    # the random numbers drawn from a stream by rows first_row to
+    # first_row + num_rows - 1 (0-based), one column per call
+    seed, boundary = streams[name]
+    calls = boundary if calls is None else calls
+    start = seed * pow(rng_multiplier, first_row * boundary, rng_modulus)
+    rows = _powers(pow(rng_multiplier, boundary, rng_modulus), num_rows)
+    rows = rows * (start % rng_modulus) % rng_modulus
+    return rows[:, None] * _powers(rng_multiplier, calls + 1)[1:] % rng_modulus
+
+
+def unif_int(values, low, high):
+    # UnifInt() of rnd.c with its double arithmetic. For (0, MAX_LONG) the
+    # range overflows a 32 bit int and becomes negative.
+    if np.isscalar(low) and np.isscalar(high) and (low, high) == (0, max_long):
+        rng = -2147483648.0
+    else:
+        rng = (np.asarray(high, dtype=np.int64) - low + 1).astype(np.float64)
+    return low + (values / float(rng_modulus) * rng).astype(np.int64)
+
+
+def pick(dist, values):
+    # index of the member chosen by pick_str(): the first one whose
+    # cumulative weight reaches a uniform draw
+    weights = dist[1]
+    return np.searchsorted(weights, unif_int(values, 1, int(weights[-1])))
+
+
+def table_rows(table_name, scale_factor):
+    # row count of a table, or of the parts/orders behind partsupp/lineitem,
+    # scaled like dbgen: below SF1 the base counts are cut in thousandths
+    if table_name in ("nation", "region"):
+        return {"nation": 25, "region": 5}[table_name]
+    if scale_factor < 1:
+        return max(int(1000 * scale_factor) * base_rows[table_name] // 1000, 1)
+    return base_rows[table_name] * int(scale_factor)
+
+
+def piece_rows(table_name, scale_factor, piece, num_pieces):
+    # first row and row count of `piece` out of `num_pieces`, split as
+    # `dbgen -S piece+1 -C num_pieces` splits them
+    rows = table_rows(table_name, scale_factor)
+    per_piece = rows // num_pieces
+    if piece == num_pieces - 1:
+        return per_piece * piece, rows - per_piece * piece
+    return per_piece * piece, per_piece
+
+
+def _lookup(dist):
+    # table from a uniform draw 1..total weight to the chosen member
+    return np.searchsorted(dist[1], np.arange(int(dist[1][-1]) + 1))
+
+
+def _picks(uniform, dist):
+    # pick() for draws already divided by the modulus
+    return _lookup(dist)[1 + (uniform * float(dist[1][-1])).astype(np.int32)]
+
+
+# parts of speech of the text grammar and their word lists
+parts_of_speech = {
+    "N": "nouns",
+    "V": "verbs",
+    "J": "adjectives",
+    "D": "adverbs",
+    "X": "auxillaries",
+    "A": "articles",
+    "P": "prepositions",
+    "T": "terminators",
+}
+# words are followed by a space, by a comma and a space (the first adjective
+# of "J, J N"), by " the " (prepositions), or by nothing when a terminator
+# abuts them
+word_separators = [b" ", b", ", b" the ", b""]
+# sentence symbols: 1 noun phrase, 2 verb phrase, 3 preposition and noun
+# phrase, 4 terminator
+sentence_symbols = {"N": 1, "V": 2, "P": 3, "T": 4}
+
+
+def text_grammar(dists):
+    # lookup tables of the sentence forms, the phrase forms and the words of
+    # the text grammar
+    speech = list(parts_of_speech)
+    names = list(parts_of_speech.values())
+    grammar = {"speech": speech}
+    # one lookup table from the draws of every part of speech to words
+    first_word = np.cumsum([0] + [len(dists[n][0]) for n in names])
+    grammar["total_weight"] = np.array([dists[n][1][-1] for n in names], np.float64)
+    grammar["first_draw"] = np.cumsum([0] + [dists[n][1][-1] for n in names])
+    grammar["words"] = np.concatenate(
+        [first_word[i] + _lookup(dists[n])[1:] for i, n in enumerate(names)]
+    )
+    # every word with every separator, padded to a fixed width so that they
+    # can be gathered as rows
+    pieces = [
+        word.encode() + sep
+        for n in names
+        for word in dists[n][0]
+        for sep in word_separators
+    ]
+    grammar["piece_length"] = np.array([len(p) for p in pieces])
+    grammar["pieces"] = np.zeros(
+        (len(pieces), grammar["piece_length"].max()), np.uint8
+    )
+    for i, p in enumerate(pieces):
+        grammar["pieces"][i, : len(p)] = np.frombuffer(p, np.uint8)
+
+    forms = [form.split() for form in dists["grammar"][0]]
+    symbols = np.zeros((len(forms), max(len(f) for f in forms)), np.int64)
+    for i, form in enumerate(forms):
+        symbols[i, : len(form)] = [sentence_symbols[s] for s in form]
+    grammar["symbols"] = symbols
+    # part of speech and separator of every word of a phrase form, and the
+    # draws the phrase takes: one for the form and one per word
+    for name in ("np", "vp"):
+        forms = [form.split() for form in dists[name][0]]
+        width = max(len(f) for f in forms)
+        words = np.full((len(forms), width), -1, np.int8)
+        seps = np.zeros((len(forms), width), np.int8)
+        for i, form in enumerate(forms):
+            for j, word in enumerate(form):
+                words[i, j] = speech.index(word[0])
+                seps[i, j] = 1 if word[1:] == "," else 0
+        grammar[name] = (words, seps, np.array([1 + len(f) for f in forms]))
+    return grammar
+
+
+def build_text_pool(chunk=1 << 22):
+    # the 300MB text pool of dbg_text(): sentences from a small grammar with
+    # words drawn from stream 5 until the pool is full, the last one cut
+    # short. Every sentence form, phrase form and word takes one draw, so the
+    # draws are generated in chunks and the sentences walked through them.
+    dists = read_dists()
+    grammar = text_grammar(dists)
+    # draws a sentence can take beyond the end of a chunk
+    margin = 64
+    size = chunk + margin
+    powers = _powers(rng_multiplier, size)
+    index = np.arange(chunk, dtype=np.int32)
+    position = 0
+    carry = 0
+    chunks = []
+    pool_size = 0
+    while pool_size < text_pool_size:
+        start = text_pool_seed * pow(rng_multiplier, position + 1, rng_modulus)
+        uniform = powers * (start % rng_modulus) % rng_modulus / float(rng_modulus)
+        form = _picks(uniform, dists["grammar"])
+        np_form = _picks(uniform, dists["np"])
+        vp_form = _picks(uniform, dists["vp"])
+
+        # draws taken by each symbol when it starts at a position, one row
+        # per symbol, and by a sentence starting at each position
+        units = np.zeros((len(sentence_symbols) + 1, size), np.int32)
+        units[1] = grammar["np"][2][np_form]
+        units[2] = grammar["vp"][2][vp_form]
+        units[3, :-1] = 1 + units[1, 1:]
+        units[4] = 1
+        units = units.ravel()
+        end = index + 1
+        offsets = grammar["symbols"] * size
+        for k in range(offsets.shape[1]):
+            end += units[offsets[form[:chunk], k] + end]
+        lengths = (end - index).tolist()
+
+        # walk the chain of sentences through the chunk
+        starts = []
+        p = carry
+        while p < chunk:
+            starts.append(p)
+            p += lengths[p]
+        carry = p - chunk
+        starts = np.array(starts, dtype=np.int64)
+
+        # mark the draws that produce a word with its part of speech and
+        # separator
+        speech = np.full(size, -1, dtype=np.int8)
+        sep = np.zeros(size, dtype=np.int8)
+        at = starts + 1
+        symbols = grammar["symbols"][form[starts]]
+        for k in range(symbols.shape[1]):
+            symbol = symbols[:, k]
+            for code, name in ((1, "np"), (2, "vp"), (3, "np")):
+                mask = symbol == code
+                p = at[mask]
+                if code == 3:
+                    speech[p] = grammar["speech"].index("P")
+                    sep[p] = 2
+                    p = p + 1
+                f = np_form[p] if name == "np" else vp_form[p]
+                words, seps, draws = grammar[name]
+                words, seps = words[f], seps[f]
+                for j in range(words.shape[1]):
+                    valid = words[:, j] >= 0
+                    speech[p[valid] + 1 + j] = words[valid, j]
+                    sep[p[valid] + 1 + j] = seps[valid, j]
+                at[mask] = p + draws[f]
+            mask = symbol == 4
+            p = at[mask]
+            speech[p] = grammar["speech"].index("T")
+            sep[p] = 0
+            sep[p - 1] = 3
+            at[mask] = p + 1
+
+        emitted = np.flatnonzero(speech >= 0)
+        kind = speech[emitted]
+        draw = (uniform[emitted] * grammar["total_weight"][kind]).astype(np.int32)
+        word = grammar["words"][grammar["first_draw"][kind] + draw]
+        piece = word * len(word_separators) + sep[emitted]
+        # concatenate the padded pieces, dropping the padding
+        text = grammar["pieces"][piece]
+        keep = np.arange(text.shape[1]) < grammar["piece_length"][piece][:, None]
+        text = text[keep]
+        chunks.append(text)
+        pool_size += len(text)
+        position += chunk
+    return np.concatenate(chunks)[:text_pool_size]
+
+
+def text_pool(path=text_pool_cache):
+    # the text pool, memory mapped from the cache file so that worker
+    # processes share it. Built and written on first use.
+    if not os.path.exists(path) or os.path.getsize(path) != text_pool_size:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pool = build_text_pool()
+        # rename so that concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pool)
+        os.replace(tmp_path, path)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+def _strings(data, lengths):
+    # arrow string array of consecutive byte strings
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    return pa.StringArray.from_buffers(
+        len(lengths), pa.py_buffer(offsets), pa.py_buffer(np.asarray(data))
+    )
+
+
+def _cut(pool, offset, length):
+    # pool[offset:offset + length] of every row, concatenated
+    ends = np.cumsum(length)
+    index = np.repeat(offset - ends + length, length)
+    index += np.arange(len(index))
+    return pool[index]
+
+
+def _comment_draws(values, average):
+    # offsets and lengths of dbg_text() comments, two draws each
+    low, high = int(average * 0.4), int(average * 1.6)
+    offset = unif_int(values[:, 0], 0, text_pool_size - high)
+    return offset, unif_int(values[:, 1], low, high)
+
+
+def _text(pool, values, average):
+    # TEXT() comments, cut from the pool in batches of about 16M characters
+    # to bound the size of the gather index
+    offset, length = _comment_draws(values, average)
+    rows = (1 << 24) // average
+    chunks = []
+    for i in range(0, len(offset), rows):
+        lengths = length[i : i + rows]
+        chunks.append(_strings(_cut(pool, offset[i : i + rows], lengths), lengths))
+    return pa.chunked_array(chunks, pa.string())
+
+
+def _address(values):
+    # V_STR(): 10 to 40 random characters. One draw gives the length and
+    # every further draw 5 characters of 6 bits.
+    low, high = int(address_length * 0.4), int(address_length * 1.6)
+    length = unif_int(values[:, 0], low, high)
+    bits = unif_int(values[:, 1:], 0, max_long)
+    i = np.arange(bits.shape[1] * 5)
+    chars = alpha_num[(bits[:, i // 5] >> (6 * (i % 5))) & 63]
+    return _strings(chars[i < length[:, None]], length)
+
+
+def _numbered(prefix, numbers, width):
+    # prefix followed by the zero padded numbers, like "%s%0*d"
+    digits = pc.utf8_lpad(pa.array(numbers).cast(pa.string()), width, "0")
+    return pc.binary_join_element_wise(prefix, digits, "")
+
+
+def _phone(values, nation):
+    # gen_phone(): country code from the nation, then three random groups
+    groups = [
+        pa.array(nation + 10).cast(pa.string()),
+        pa.array(unif_int(values[:, 0], 100, 999)).cast(pa.string()),
+        pa.array(unif_int(values[:, 1], 100, 999)).cast(pa.string()),
+        pa.array(unif_int(values[:, 2], 1000, 9999)).cast(pa.string()),
+    ]
+    return pc.binary_join_element_wise(*groups, "-")
+
+
+def _members(dist, index):
+    return pa.array(dist[0], pa.string()).take(pa.array(index))
+
+
+def _money(cents):
+    return pa.array(cents / 100)
+
+
+def _dates(days):
+    return pa.array((epoch_offset + days).astype(np.int32), pa.date32())
+
+
+def retail_price(partkey):
+    # rpb_routine(), in cents
+    return 90000 + (partkey // 10) % 20001 + (partkey % 1000) * 100
+
+
+def part_supplier(partkey, i, suppliers):
+    # PART_SUPP_BRIDGE: the i-th of the four suppliers of a part
+    return (partkey + i * (suppliers // 4 + (partkey - 1) // suppliers)) % suppliers + 1
+
+
+def _part_names(colors, values):
+    # agg_str(): the first 5 colors of a random permutation of all 92. The
+    # shuffle draws 92 numbers per part, but only its first 5 swaps touch
+    # the first 5 positions.
+    n = len(values)
+    order = np.tile(np.arange(len(colors), dtype=np.int16), (n, 1))
+    rows = np.arange(n)
+    for i in range(values.shape[1]):
+        source = unif_int(values[:, i], i, len(colors) - 1)
+        swapped = order[rows, source]
+        order[rows, source] = order[rows, i]
+        order[rows, i] = swapped
+    names = pa.array(colors, pa.string())
+    words = [names.take(pa.array(order[:, i])) for i in range(values.shape[1])]
+    return pc.binary_join_element_wise(*words, " ")
+
+
+def make_part(scale_factor, first, count, dists, pool):
+    key = np.arange(first + 1, first + count + 1)
+    mfgr = unif_int(stream_values("P_MFG", first, count)[:, 0], 1, 5)
+    brand = unif_int(stream_values("P_BRND", first, count)[:, 0], 1, 5)
+    return pa.table(
+        {
+            "P_PARTKEY": key,
+            "P_NAME": _part_names(
+                dists["colors"][0], stream_values("P_NAME", first, count, 5)
+            ),
+            "P_MFGR": _numbered("Manufacturer#", mfgr, 1),
+            "P_BRAND": _numbered("Brand#", mfgr * 10 + brand, 2),
+            "P_TYPE": _members(
+                dists["p_types"],
+                pick(dists["p_types"], stream_values("P_TYPE", first, count)[:, 0]),
+            ),
+            "P_SIZE": unif_int(stream_values("P_SIZE", first, count)[:, 0], 1, 50),
+            "P_CONTAINER": _members(
+                dists["p_cntr"],
+                pick(dists["p_cntr"], stream_values("P_CNTR", first, count)[:, 0]),
+            ),
+            "P_RETAILPRICE": _money(retail_price(key)),
+            "P_COMMENT": _text(
+                pool, stream_values("P_CMNT", first, count), comment_lengths["P_CMNT"]
+            ),
+        }
+    )
+
+
+def make_partsupp(scale_factor, first, count, dists, pool):
+    # four rows per part
+    partkey = np.repeat(np.arange(first + 1, first + count + 1), 4)
+    i = np.tile(np.arange(4), count)
+    suppliers = table_rows("supplier", scale_factor)
+    return pa.table(
+        {
+            "PS_PARTKEY": partkey,
+            "PS_SUPPKEY": part_supplier(partkey, i, suppliers),
+            "PS_AVAILQTY": unif_int(
+                stream_values("PS_QTY", first, count).ravel(), 1, 9999
+            ),
+            "PS_SUPPLYCOST": _money(
+                unif_int(stream_values("PS_SCST", first, count).ravel(), 100, 100000)
+            ),
+            "PS_COMMENT": _text(
+                pool,
+                stream_values("PS_CMNT", first, count).reshape(-1, 2),
+                comment_lengths["PS_CMNT"],
+            ),
+        }
+    )
+
+
+def make_supplier(scale_factor, first, count, dists, pool):
+    key = np.arange(first + 1, first + count + 1)
+    nation = unif_int(stream_values("S_NTRG", first, count)[:, 0], 0, 24)
+    offset, length = _comment_draws(
+        stream_values("S_CMNT", first, count), comment_lengths["S_CMNT"]
+    )
+    comment = _cut(pool, offset, length)
+    # about 10 suppliers per SF get a "Customer ... Complaints" or
+    # "Customer ... Recommends" comment. The draws are taken for every row.
+    bad_press = unif_int(stream_values("BBB_CMNT", first, count)[:, 0], 1, 10000)
+    kind = unif_int(stream_values("BBB_TYPE", first, count)[:, 0], 0, 100)
+    noise = unif_int(stream_values("BBB_JNK", first, count)[:, 0], 0, length - 19)
+    at = unif_int(
+        stream_values("BBB_OFFSET", first, count)[:, 0], 0, length - (19 + noise)
+    )
+    start = np.cumsum(length) - length
+    for row in np.flatnonzero(bad_press <= 10):
+        p = start[row] + at[row]
+        comment[p : p + 9] = np.frombuffer(b"Customer ", np.uint8)
+        word = b"Complaints" if kind[row] < 50 else b"Recommends"
+        p += 9 + noise[row]
+        comment[p : p + 10] = np.frombuffer(word, np.uint8)
+    return pa.table(
+        {
+            "S_SUPPKEY": key,
+            "S_NAME": _numbered("Supplier#", key, 9),
+            "S_ADDRESS": _address(stream_values("S_ADDR", first, count)),
+            "S_NATIONKEY": nation,
+            "S_PHONE": _phone(stream_values("S_PHNE", first, count), nation),
+            "S_ACCTBAL": _money(
+                unif_int(stream_values("S_ABAL", first, count)[:, 0], -99999, 999999)
+            ),
+            "S_COMMENT": _strings(comment, length),
+        }
+    )
+
+
+def make_customer(scale_factor, first, count, dists, pool):
+    key = np.arange(first + 1, first + count + 1)
+    nation = unif_int(stream_values("C_NTRG", first, count)[:, 0], 0, 24)
+    return pa.table(
+        {
+            "C_CUSTKEY": key,
+            "C_NAME": _numbered("Customer#", key, 9),
+            "C_ADDRESS": _address(stream_values("C_ADDR", first, count)),
+            "C_NATIONKEY": nation,
+            "C_PHONE": _phone(stream_values("C_PHNE", first, count), nation),
+            "C_ACCTBAL": _money(
+                unif_int(stream_values("C_ABAL", first, count)[:, 0], -99999, 999999)
+            ),
+            "C_MKTSEGMENT": _members(
+                dists["msegmnt"],
+                pick(dists["msegmnt"], stream_values("C_MSEG", first, count)[:, 0]),
+            ),
+            "C_COMMENT": _text(
+                pool, stream_values("C_CMNT", first, count), comment_lengths["C_CMNT"]
+            ),
+        }
+    )
+
+
+def order_lines(scale_factor, first, count):
+    # the lines of orders first .. first + count - 1: up to 7 per order, each
+    # taking its own draw of the line streams
+    index = np.arange(first + 1, first + count + 1)
+    lines = unif_int(stream_values("O_LCNT", first, count)[:, 0], 1, 7)
+    mask = np.arange(7) < lines[:, None]
+    order, number = np.nonzero(mask)
+    day = unif_int(stream_values("O_ODATE", first, count)[:, 0], 0, order_days)
+
+    def draws(name, low, high):
+        return unif_int(stream_values(name, first, count)[mask], low, high)
+
+    parts = table_rows("part", scale_factor)
+    partkey = draws("L_PKEY", 1, parts)
+    ship = day[order] + draws("L_SDTE", 1, 121)
+    lines = {
+        "orderkey": ((index >> 3) << 5) + (index & 7),
+        "orderdate": day,
+        "order": order,
+        "starts": np.cumsum(lines) - lines,
+        "mask": mask,
+        "L_LINENUMBER": number + 1,
+        "L_PARTKEY": partkey,
+        "L_QUANTITY": draws("L_QTY", 1, 50),
+        "L_DISCOUNT": draws("L_DCNT", 0, 10),
+        "L_TAX": draws("L_TAX", 0, 8),
+        "L_SHIPDATE": ship,
+    }
+    lines["L_EXTENDEDPRICE"] = retail_price(partkey) * lines["L_QUANTITY"]
+    return lines
+
+
+def line_totals(lines):
+    # what each line adds to O_TOTALPRICE, in cents with the rounding of
+    # mk_order()
+    price = lines["L_EXTENDEDPRICE"] * (100 - lines["L_DISCOUNT"]) // 100
+    return price * (100 + lines["L_TAX"]) // 100
+
+
+def order_index(orderkey):
+    # the inverse of the sparse order keys of order_lines(), 1-based
+    return ((orderkey >> 5) << 3) + (orderkey & 7)
+
+
+def make_orders(scale_factor, first, count, dists, pool):
+    lines = order_lines(scale_factor, first, count)
+    total = np.add.reduceat(line_totals(lines), lines["starts"])
+    filled = np.add.reduceat(lines["L_SHIPDATE"] <= current_day, lines["starts"])
+    status = np.where(filled == 0, 2, np.where(filled == lines["mask"].sum(1), 0, 1))
+
+    # custkeys divisible by 3 are moved to a neighbour, so a third of the
+    # customers have no orders
+    customers = table_rows("customer", scale_factor)
+    custkey = unif_int(stream_values("O_CKEY", first, count)[:, 0], 1, customers)
+    delta = 1
+    moved = custkey % 3 == 0
+    while moved.any():
+        custkey[moved] = np.minimum(custkey[moved] + delta, customers)
+        delta = -delta
+        moved &= custkey % 3 == 0
+    clerks = max(int(scale_factor), 1) * 1000
+    clerk = unif_int(stream_values("O_CLRK", first, count)[:, 0], 1, clerks)
+    return pa.table(
+        {
+            "O_ORDERKEY": lines["orderkey"],
+            "O_CUSTKEY": custkey,
+            "O_ORDERSTATUS": _members((["F", "P", "O"], None), status),
+            "O_TOTALPRICE": _money(total),
+            "O_ORDERDATE": _dates(lines["orderdate"]),
+            "O_ORDERPRIORITY": _members(
+                dists["o_oprio"],
+                pick(dists["o_oprio"], stream_values("O_PRIO", first, count)[:, 0]),
+            ),
+            "O_CLERK": _numbered("Clerk#", clerk, 9),
+            "O_SHIPPRIORITY": np.zeros(count, dtype=np.int64),
+            "O_COMMENT": _text(
+                pool, stream_values("O_CMNT", first, count), comment_lengths["O_CMNT"]
+            ),
+        }
+    )
+
+
+def make_lineitem(scale_factor, first, count, dists, pool):
+    lines = order_lines(scale_factor, first, count)
+    mask, order = lines["mask"], lines["order"]
+    ship = lines["L_SHIPDATE"]
+    commit = lines["orderdate"][order] + unif_int(
+        stream_values("L_CDTE", first, count)[mask], 30, 90
+    )
+    receipt = ship + unif_int(stream_values("L_RDTE", first, count)[mask], 1, 30)
+    # only lines received by the current date draw a return flag, so the
+    # n-th such line of an order takes the n-th draw of its order
+    returned = np.zeros(mask.shape, dtype=bool)
+    returned[mask] = receipt <= current_day
+    draw = np.cumsum(returned, axis=1) - 1
+    values = stream_values("L_RFLG", first, count)
+    values = np.take_along_axis(values, np.maximum(draw, 0), axis=1)[mask]
+    flags = dists["rflag"][0] + ["N"]
+    flag = np.where(
+        receipt <= current_day, pick(dists["rflag"], values), len(flags) - 1
+    )
+    comment = stream_values("L_CMNT", first, count).reshape(count, 7, 2)[mask]
+    return pa.table(
+        {
+            "L_ORDERKEY": lines["orderkey"][order],
+            "L_PARTKEY": lines["L_PARTKEY"],
+            "L_SUPPKEY": part_supplier(
+                lines["L_PARTKEY"],
+                unif_int(stream_values("L_SKEY", first, count)[mask], 0, 3),
+                table_rows("supplier", scale_factor),
+            ),
+            "L_LINENUMBER": lines["L_LINENUMBER"],
+            "L_QUANTITY": lines["L_QUANTITY"].astype(np.float64),
+            "L_EXTENDEDPRICE": _money(lines["L_EXTENDEDPRICE"]),
+            "L_DISCOUNT": _money(lines["L_DISCOUNT"]),
+            "L_TAX": _money(lines["L_TAX"]),
+            "L_RETURNFLAG": _members((flags, None), flag),
+            "L_LINESTATUS": _members(
+                (["F", "O"], None), (ship > current_day).astype(np.int8)
+            ),
+            "L_SHIPDATE": _dates(ship),
+            "L_COMMITDATE": _dates(commit),
+            "L_RECEIPTDATE": _dates(receipt),
+            "L_SHIPINSTRUCT": _members(
+                dists["instruct"],
+                pick(dists["instruct"], stream_values("L_SHIP", first, count)[mask]),
+            ),
+            "L_SHIPMODE": _members(
+                dists["smode"],
+                pick(dists["smode"], stream_values("L_SMODE", first, count)[mask]),
+            ),
+            "L_COMMENT": _text(pool, comment, comment_lengths["L_CMNT"]),
+        }
+    )
+
+
+def make_nation(scale_factor, first, count, dists, pool):
+    names, regions = dists["nations"]
+    return pa.table(
+        {
+            "N_NATIONKEY": np.arange(first, first + count),
+            "N_NAME": pa.array(names[first : first + count], pa.string()),
+            "N_REGIONKEY": regions[first : first + count],
+            "N_COMMENT": _text(
+                pool, stream_values("N_CMNT", first, count), comment_lengths["N_CMNT"]
+            ),
+        }
+    )
+
+
+def make_region(scale_factor, first, count, dists, pool):
+    return pa.table(
+        {
+            "R_REGIONKEY": np.arange(first, first + count),
+            "R_NAME": pa.array(dists["regions"][0][first : first + count], pa.string()),
+            "R_COMMENT": _text(
+                pool, stream_values("R_CMNT", first, count), comment_lengths["R_CMNT"]
+            ),
+        }
+    )
+
+
+table_builders = {
+    "part": make_part,
+    "partsupp": make_partsupp,
+    "supplier": make_supplier,
+    "customer": make_customer,
+    "orders": make_orders,
+    "lineitem": make_lineitem,
+    "nation": make_nation,
+    "region": make_region,
+}
+
+
+def generate_table(table_name, scale_factor, piece=0, num_pieces=1, pool=None):
+    # `piece` of `num_pieces` of a table as an arrow table, the same rows as
+    # `dbgen -s SF -T <table> -S piece+1 -C num_pieces` writes
+    if scale_factor >= max_scale_factor:
+        raise ValueError(f"SF{max_scale_factor} and above use dbgen's 64 bit generator")
+    if pool is None:
+        pool = text_pool()
+    first, count = piece_rows(table_name, scale_factor, piece, num_pieces)
+    return table_builders[table_name](scale_factor, first, count, read_dists(), pool)
+
+
+def generate_tables(scale_factor, tables=None):
+    # all (or the named) tables of a scale factor, in memory
+    pool = text_pool()
+    return {
+        name: generate_table(name, scale_factor, pool=pool)
+        for name in tables or table_builders
+    }
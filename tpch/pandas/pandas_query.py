@@ -4,8 +4,11 @@ import argparse
 import json
 import time
 import traceback
+from datetime import date
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from pandas.core.frame import DataFrame as PandasDF
 
 pd.set_option("display.max_columns", None)
@@ -13,101 +16,178 @@ pd.set_option("display.max_columns", None)
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
-from common_utils import append_row, ANSWERS_BASE_DIR
+import table_memory
+from schema import (
+    money_columns,
+    query_columns,
+    query_scan_filters,
+    refresh_columns,
+    selected_columns,
+    table_weights,
+)
+from table_cache import cached_table
+from common_utils import (
+    append_row,
+    answers_dir,
+    dataset_format,
+    dataset_info,
+    decode_dates,
+    decode_money,
+    read_arrow,
+    report_scan,
+    table_path,
+    timestamp_dates,
+    ANSWERS_BASE_DIR,
+    MONEY_SCALE,
+)
+
+# columns of every table read by the loaders, those of the selected queries.
+# A table without an entry is read whole.
+table_columns = {}
+# --pushdown passes the filters of schema.query_filters to the reads of the
+# tables of each query with --include_io, with the year and month predicates
+# that prune the directories of tables written with --partition_by
+pushdown = False
+scan_filters = {}
+# seconds spent reading every table of the running query
+load_times = {}
+# --table_cache reads the tables from the memory-mapped decoded arrow files of
+# table_cache.py
+use_table_cache = False
+
+# --dtype_backend pyarrow loads every column as a pd.ArrowDtype column,
+# except the dictionary columns, which load as categoricals
+dtype_backend = "numpy"
+
+# --exact_money keeps the money columns as int64 hundredths and runs the
+# integer versions of the queries in exact_query_to_runner
+exact_money = False
+
+
+def money_hundredths(df, table_name: str):
+    # float and decimal money columns have two decimals, so rounding gives
+    # the exact hundredths
+    for column in money_columns.get(table_name, []):
+        if column in df.columns and df[column].dtype.kind not in "iu":
+            df[column] = (
+                (df[column].astype("float64") * MONEY_SCALE).round().astype("int64")
+            )
+    return df
 
-dataset_dict = {}
 
+def load_money(df, table_name: str):
+    if exact_money:
+        return money_hundredths(df, table_name)
+    return decode_money(df, table_name)
 
-def load_lineitem(root: str, include_io: bool = False):
-    if "lineitem" not in dataset_dict or include_io:
-        data_path = root + "/lineitem.parquet"
-        df = pd.read_parquet(data_path)
-        df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
-        df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
-        df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
-        result = df
-        dataset_dict["lineitem"] = result
+
+def arrow_datetime(column):
+    # date columns not read as timestamps, strings of older datasets, as
+    # pyarrow timestamps, which compare with pd.Timestamp
+    return column.astype(pd.ArrowDtype(pa.timestamp("s")))
+
+
+def arrow_dtype(arrow_type):
+    # --dtype_backend pyarrow dtype of an arrow column. Dictionary columns of
+    # --dictionary datasets stay categoricals, as arrow dictionaries cannot be
+    # sorted and their groupbys ignore observed=True.
+    if pa.types.is_dictionary(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
+
+def round_div(numerator, denominator):
+    # non-negative numerator / denominator rounded half up, in python ints
+    numerator, denominator = int(numerator), int(denominator)
+    return (2 * numerator + denominator) // (2 * denominator)
+
+
+def read_table(
+    data_path: str, table_name: str, file_format: str = "parquet", cached=False
+):
+    t1 = time.time()
+    columns = table_columns.get(table_name)
+    filters = scan_filters.get(table_name)
+    arrow = dtype_backend == "pyarrow"
+    if cached and filters is None and file_format == "parquet":
+        df = cached_table(data_path, table_name, columns).to_pandas(
+            split_blocks=True, types_mapper=arrow_dtype if arrow else None
+        )
     else:
-        result = dataset_dict["lineitem"]
-    return result
+        # planned from the _metadata file of parquet tables split into pieces
+        table = read_arrow(data_path, table_name, file_format, columns, filters)
+        df = timestamp_dates(table, table_name).to_pandas(
+            types_mapper=arrow_dtype if arrow else None
+        )
+    to_datetime = arrow_datetime if arrow else pd.to_datetime
+    df = load_money(decode_dates(df, table_name, to_datetime), table_name)
+    load_times[table_name] = load_times.get(table_name, 0.0) + time.time() - t1
+    return df
+
+
+table_nbytes = table_memory.frame_nbytes
+
+
+def load_table(root: str, table_name: str, include_io: bool = False):
+    df = table_memory.get_table(table_name)
+    if df is None or include_io:
+        file_format = dataset_format(root)
+        df = read_table(
+            table_path(root, table_name, file_format),
+            table_name,
+            file_format,
+            use_table_cache,
+        )
+        table_memory.put_table(table_name, df, table_nbytes)
+    return df
+
+
+def load_lineitem(root: str, include_io: bool = False):
+    return load_table(root, "lineitem", include_io)
 
 
 def load_part(root: str, include_io: bool = False):
-    if "part" not in dataset_dict or include_io:
-        data_path = root + "/part.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["part"] = result
-    else:
-        result = dataset_dict["part"]
-    return result
+    return load_table(root, "part", include_io)
 
 
 def load_orders(root: str, include_io: bool = False):
-    if "orders" not in dataset_dict or include_io:
-        data_path = root + "/orders.parquet"
-        df = pd.read_parquet(data_path)
-        df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
-        result = df
-        dataset_dict["orders"] = result
-    else:
-        result = dataset_dict["orders"]
-    return result
+    return load_table(root, "orders", include_io)
 
 
 def load_customer(root: str, include_io: bool = False):
-    if "customer" not in dataset_dict or include_io:
-        data_path = root + "/customer.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["customer"] = result
-    else:
-        result = dataset_dict["customer"]
-    return result
+    return load_table(root, "customer", include_io)
 
 
 def load_nation(root: str, include_io: bool = False):
-    if "nation" not in dataset_dict or include_io:
-        data_path = root + "/nation.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["nation"] = result
-    else:
-        result = dataset_dict["nation"]
-    return result
+    return load_table(root, "nation", include_io)
 
 
 def load_region(root: str, include_io: bool = False):
-    if "region" not in dataset_dict or include_io:
-        data_path = root + "/region.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["region"] = result
-    else:
-        result = dataset_dict["region"]
-    return result
+    return load_table(root, "region", include_io)
 
 
 def load_supplier(root: str, include_io: bool = False):
-    if "supplier" not in dataset_dict or include_io:
-        data_path = root + "/supplier.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["supplier"] = result
-    else:
-        result = dataset_dict["supplier"]
-    return result
+    return load_table(root, "supplier", include_io)
 
 
 def load_partsupp(root: str, include_io: bool = False):
-    if "partsupp" not in dataset_dict or include_io:
-        data_path = root + "/partsupp.parquet"
-        df = pd.read_parquet(data_path)
-        result = df
-        dataset_dict["partsupp"] = result
-    else:
-        result = dataset_dict["partsupp"]
-    return result
+    return load_table(root, "partsupp", include_io)
+
+
+def load_refresh_set(root: str, refresh_set: int):
+    # rows inserted by RF1 and order keys deleted by RF2 in one refresh set
+    set_path = root + f"/refresh/u{refresh_set}"
+    file_format = dataset_format(root)
+    orders = read_table(
+        table_path(set_path, "orders", file_format), "orders", file_format
+    )
+    lineitem = read_table(
+        table_path(set_path, "lineitem", file_format), "lineitem", file_format
+    )
+    delete = read_arrow(
+        table_path(set_path, "delete", file_format), "delete", file_format
+    ).to_pandas()
+    return orders, lineitem, delete
 
 
 def q01(root: str, include_io: bool = False):
@@ -139,7 +219,9 @@ def q01(root: str, include_io: bool = False):
         * (1 - lineitem_filtered.L_DISCOUNT)
         * (1 + lineitem_filtered.L_TAX)
     )
-    gb = lineitem_filtered.groupby(["L_RETURNFLAG", "L_LINESTATUS"], as_index=False)[
+    gb = lineitem_filtered.groupby(
+        ["L_RETURNFLAG", "L_LINESTATUS"], as_index=False, observed=True
+    )[
         [
             "L_ORDERKEY",
             "L_QUANTITY",
@@ -168,6 +250,88 @@ def q01(root: str, include_io: bool = False):
     return total
 
 
+def q01_exact(root: str, include_io: bool = False):
+    # q01 on hundredths. The sums stay exact in int64 up to about SF80, and
+    # every result column is returned in hundredths, rounded half up.
+    lineitem = load_lineitem(root, include_io)
+
+    date = pd.Timestamp("1998-09-02")
+    lineitem_filtered = lineitem.loc[
+        :,
+        [
+            "L_ORDERKEY",
+            "L_QUANTITY",
+            "L_EXTENDEDPRICE",
+            "L_DISCOUNT",
+            "L_TAX",
+            "L_RETURNFLAG",
+            "L_LINESTATUS",
+            "L_SHIPDATE",
+        ],
+    ]
+    sel = lineitem_filtered.L_SHIPDATE <= date
+    lineitem_filtered = lineitem_filtered[sel]
+    # 10**-4 and 10**-6 units
+    lineitem_filtered["DISC_PRICE"] = lineitem_filtered.L_EXTENDEDPRICE * (
+        100 - lineitem_filtered.L_DISCOUNT
+    )
+    lineitem_filtered["CHARGE"] = lineitem_filtered.DISC_PRICE * (
+        100 + lineitem_filtered.L_TAX
+    )
+    gb = lineitem_filtered.groupby(
+        ["L_RETURNFLAG", "L_LINESTATUS"], as_index=False, observed=True
+    )
+    total = gb.agg(
+        L_QUANTITY=("L_QUANTITY", "sum"),
+        L_EXTENDEDPRICE=("L_EXTENDEDPRICE", "sum"),
+        DISC_PRICE=("DISC_PRICE", "sum"),
+        CHARGE=("CHARGE", "sum"),
+        L_DISCOUNT=("L_DISCOUNT", "sum"),
+        L_ORDERKEY=("L_ORDERKEY", "count"),
+    )
+    total = total.sort_values(["L_RETURNFLAG", "L_LINESTATUS"])
+    rows = zip(
+        total.L_QUANTITY,
+        total.L_EXTENDEDPRICE,
+        total.DISC_PRICE,
+        total.CHARGE,
+        total.L_DISCOUNT,
+        total.L_ORDERKEY,
+    )
+    values = [
+        (
+            int(qty) * 100,
+            price,
+            round_div(disc_price, 100),
+            round_div(charge, 10000),
+            round_div(int(qty) * 100, count),
+            round_div(price, count),
+            round_div(discount, count),
+            count,
+        )
+        for qty, price, disc_price, charge, discount, count in rows
+    ]
+    return pd.concat(
+        [
+            total.loc[:, ["L_RETURNFLAG", "L_LINESTATUS"]].reset_index(drop=True),
+            pd.DataFrame(
+                values,
+                columns=[
+                    "L_QUANTITY",
+                    "L_EXTENDEDPRICE",
+                    "DISC_PRICE",
+                    "CHARGE",
+                    "AVG_QTY",
+                    "AVG_PRICE",
+                    "L_DISCOUNT",
+                    "L_ORDERKEY",
+                ],
+            ),
+        ],
+        axis=1,
+    )
+
+
 def q02(root: str, include_io: bool = False):
     part = load_part(root, include_io)
     partsupp = load_partsupp(root, include_io)
@@ -337,7 +501,7 @@ def q04(root: str, include_io: bool = False):
     forders = orders[osel]
     jn = forders[forders["O_ORDERKEY"].isin(flineitem["L_ORDERKEY"])]
     total = (
-        jn.groupby("O_ORDERPRIORITY", as_index=False)["O_ORDERKEY"]
+        jn.groupby("O_ORDERPRIORITY", as_index=False, observed=True)["O_ORDERKEY"]
         .count()
         .sort_values(["O_ORDERPRIORITY"])
     )
@@ -369,7 +533,7 @@ def q05(root: str, include_io: bool = False):
         jn4, left_on=["S_SUPPKEY", "S_NATIONKEY"], right_on=["L_SUPPKEY", "N_NATIONKEY"]
     )
     jn5["REVENUE"] = jn5.L_EXTENDEDPRICE * (1.0 - jn5.L_DISCOUNT)
-    gb = jn5.groupby("N_NAME", as_index=False)["REVENUE"].sum()
+    gb = jn5.groupby("N_NAME", as_index=False, observed=True)["REVENUE"].sum()
     total = gb.sort_values("REVENUE", ascending=False)
 
     return total
@@ -396,6 +560,28 @@ def q06(root: str, include_io: bool = False):
     return total
 
 
+def q06_exact(root: str, include_io: bool = False):
+    # q06 on hundredths, the revenue in hundredths
+    lineitem = load_lineitem(root, include_io)
+
+    date1 = pd.Timestamp("1996-01-01")
+    date2 = pd.Timestamp("1997-01-01")
+    lineitem_filtered = lineitem.loc[
+        :, ["L_QUANTITY", "L_EXTENDEDPRICE", "L_DISCOUNT", "L_SHIPDATE"]
+    ]
+    sel = (
+        (lineitem_filtered.L_SHIPDATE >= date1)
+        & (lineitem_filtered.L_SHIPDATE < date2)
+        & (lineitem_filtered.L_DISCOUNT >= 8)
+        & (lineitem_filtered.L_DISCOUNT <= 10)
+        & (lineitem_filtered.L_QUANTITY < 24)
+    )
+    flineitem = lineitem_filtered[sel]
+    total = (flineitem.L_EXTENDEDPRICE * flineitem.L_DISCOUNT).sum()
+
+    return round_div(total, 100)
+
+
 def q07(root: str, include_io: bool = False):
     lineitem = load_lineitem(root, include_io)
     orders = load_orders(root, include_io)
@@ -483,9 +669,9 @@ def q07(root: str, include_io: bool = False):
     # concat results
     total = pd.concat([total1, total2])
 
-    total = total.groupby(["SUPP_NATION", "CUST_NATION", "L_YEAR"], as_index=False).agg(
-        REVENUE=pd.NamedAgg(column="VOLUME", aggfunc="sum")
-    )
+    total = total.groupby(
+        ["SUPP_NATION", "CUST_NATION", "L_YEAR"], as_index=False, observed=True
+    ).agg(REVENUE=pd.NamedAgg(column="VOLUME", aggfunc="sum"))
     total = total.sort_values(
         by=["SUPP_NATION", "CUST_NATION", "L_YEAR"],
         ascending=[
@@ -597,7 +783,7 @@ def q09(root: str, include_io: bool = False):
         (1 * jn5.PS_SUPPLYCOST) * jn5.L_QUANTITY
     )
     jn5["O_YEAR"] = jn5.O_ORDERDATE.apply(lambda x: x.year)
-    gb = jn5.groupby(["N_NAME", "O_YEAR"], as_index=False)["TMP"].sum()
+    gb = jn5.groupby(["N_NAME", "O_YEAR"], as_index=False, observed=True)["TMP"].sum()
     total = gb.sort_values(["N_NAME", "O_YEAR"], ascending=[True, False])
 
     return total
@@ -630,6 +816,7 @@ def q10(root: str, include_io: bool = False):
             "C_COMMENT",
         ],
         as_index=False,
+        observed=True,
     )["TMP"].sum()
     total = gb.sort_values("TMP", ascending=False)
     total = total.head(20)
@@ -691,7 +878,9 @@ def q12(root: str, include_io: bool = False):
     def g2(x):
         return ((x != "1-URGENT") & (x != "2-HIGH")).sum()
 
-    total = jn.groupby("L_SHIPMODE", as_index=False)["O_ORDERPRIORITY"].agg((g1, g2))
+    total = jn.groupby("L_SHIPMODE", as_index=False, observed=True)[
+        "O_ORDERPRIORITY"
+    ].agg((g1, g2))
     total = total.sort_values("L_SHIPMODE")
     return total
 
@@ -747,6 +936,30 @@ def q14(root: str, include_io: bool = False):
     return total
 
 
+def q14_exact(root: str, include_io: bool = False):
+    # q14 on hundredths, the percentage in hundredths
+    lineitem = load_lineitem(root, include_io)
+    part = load_part(root, include_io)
+
+    startDate = pd.Timestamp("1994-03-01")
+    endDate = pd.Timestamp("1994-04-01")
+    p_type_like = "PROMO"
+    part_filtered = part.loc[:, ["P_PARTKEY", "P_TYPE"]]
+    lineitem_filtered = lineitem.loc[
+        :, ["L_EXTENDEDPRICE", "L_DISCOUNT", "L_SHIPDATE", "L_PARTKEY"]
+    ]
+    sel = (lineitem_filtered.L_SHIPDATE >= startDate) & (
+        lineitem_filtered.L_SHIPDATE < endDate
+    )
+    flineitem = lineitem_filtered[sel]
+    jn = flineitem.merge(part_filtered, left_on="L_PARTKEY", right_on="P_PARTKEY")
+    jn["TMP"] = jn.L_EXTENDEDPRICE * (100 - jn.L_DISCOUNT)
+    promo = jn[jn.P_TYPE.str.startswith(p_type_like)].TMP.sum()
+    total = round_div(int(promo) * 100 * 100, jn.TMP.sum())
+
+    return total
+
+
 def q15(root: str, include_io: bool = False):
     lineitem = load_lineitem(root, include_io)
     supplier = load_supplier(root, include_io)
@@ -806,7 +1019,9 @@ def q16(root: str, include_io: bool = False):
     )
     total = total[total["S_SUPPKEY"].isna()]
     total = total.loc[:, ["P_BRAND", "P_TYPE", "P_SIZE", "PS_SUPPKEY"]]
-    total = total.groupby(["P_BRAND", "P_TYPE", "P_SIZE"], as_index=False)[
+    total = total.groupby(
+        ["P_BRAND", "P_TYPE", "P_SIZE"], as_index=False, observed=True
+    )[
         "PS_SUPPKEY"
     ].nunique()
     total.columns = ["P_BRAND", "P_TYPE", "P_SIZE", "SUPPLIER_CNT"]
@@ -1116,6 +1331,28 @@ def q22(root: str, include_io: bool = False):
     return total
 
 
+def rf1(root: str, refresh, include_io: bool = False):
+    # insert the new orders and their lineitems
+    new_orders, new_lineitem, _ = refresh
+    orders = load_orders(root, include_io)
+    lineitem = load_lineitem(root, include_io)
+    orders = pd.concat([orders, new_orders], ignore_index=True)
+    lineitem = pd.concat([lineitem, new_lineitem], ignore_index=True)
+    table_memory.put_table("orders", orders, table_nbytes, pin=True)
+    table_memory.put_table("lineitem", lineitem, table_nbytes, pin=True)
+
+
+def rf2(root: str, refresh, include_io: bool = False):
+    # delete the orders of the refresh set and their lineitems
+    _, _, delete = refresh
+    orders = load_orders(root, include_io)
+    lineitem = load_lineitem(root, include_io)
+    orders = orders[~orders.O_ORDERKEY.isin(delete.O_ORDERKEY)]
+    lineitem = lineitem[~lineitem.L_ORDERKEY.isin(delete.O_ORDERKEY)]
+    table_memory.put_table("orders", orders, table_nbytes, pin=True)
+    table_memory.put_table("lineitem", lineitem, table_nbytes, pin=True)
+
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1188,19 +1425,26 @@ query_to_runner = {
     22: q22,
 }
 
+exact_query_to_runner = {
+    1: q01_exact,
+    6: q06_exact,
+    14: q14_exact,
+}
+
 
 def get_query_answer(query: int, base_dir: str = ANSWERS_BASE_DIR) -> PandasDF:
     answer_df = pd.read_csv(
         os.path.join(base_dir, f"q{query}.out"),
         sep="|",
         parse_dates=True,
-        infer_datetime_format=True,
     )
     return answer_df.rename(columns=lambda x: x.strip())
 
 
-def test_results(q_num: int, result_df: PandasDF):
-    answer = get_query_answer(q_num)
+def test_results(q_num: int, result_df: PandasDF, base_dir: str = ANSWERS_BASE_DIR):
+    answer = get_query_answer(q_num, base_dir)
+    if not isinstance(result_df, PandasDF):
+        result_df = pd.DataFrame([[result_df]])
 
     for column_index in range(len(answer.columns)):
         column_name = answer.columns[column_index]
@@ -1208,8 +1452,11 @@ def test_results(q_num: int, result_df: PandasDF):
 
         s1 = result_df.iloc[:, column_index]
         s2 = answer.iloc[:, column_index]
+        if isinstance(s1.dtype, pd.ArrowDtype):
+            s1 = s1.astype(s1.dtype.numpy_dtype)
 
-        if column_data_type.name == "object":
+        # strings are object columns before pandas 3 and str columns after
+        if column_data_type.kind == "O" or s1.dtype.kind == "O":
             s1 = s1.astype("string").apply(lambda x: x.strip())
             s2 = s2.astype("string").apply(lambda x: x.strip())
 
@@ -1223,6 +1470,127 @@ def test_results(q_num: int, result_df: PandasDF):
         )
 
 
+def arrow_hundredths(column):
+    # a money column of any --money encoding as python ints of hundredths.
+    # Decimal values are exact, floats have two decimals.
+    if pa.types.is_integer(column.type):
+        return column.to_pylist()
+    if pa.types.is_decimal(column.type):
+        return [int(v * MONEY_SCALE) for v in column.to_pylist()]
+    return [round(v * MONEY_SCALE) for v in column.to_pylist()]
+
+
+def read_reference(path: str, table_name: str, columns):
+    # columns of a table read with pyarrow alone, not by the loaders under test
+    file_format = dataset_format(path)
+    data_path = table_path(path, table_name, file_format)
+    return read_arrow(data_path, table_name, file_format, columns)
+
+
+def between_dates(column, start, end):
+    return pc.and_(
+        pc.greater_equal(column, pa.scalar(start, pa.date32())),
+        pc.less(column, pa.scalar(end, pa.date32())),
+    )
+
+
+def q06_reference(path: str):
+    # the revenue of q06 in hundredths, from the rows in python ints
+    lineitem = read_reference(
+        path, "lineitem", ["L_QUANTITY", "L_EXTENDEDPRICE", "L_DISCOUNT", "L_SHIPDATE"]
+    )
+    mask = pc.and_(
+        between_dates(lineitem["L_SHIPDATE"], date(1996, 1, 1), date(1997, 1, 1)),
+        pc.less(lineitem["L_QUANTITY"], 24),
+    )
+    lineitem = lineitem.filter(mask)
+    prices = arrow_hundredths(lineitem["L_EXTENDEDPRICE"])
+    discounts = arrow_hundredths(lineitem["L_DISCOUNT"])
+    total = sum(p * d for p, d in zip(prices, discounts) if 8 <= d <= 10)
+    return round_div(total, 100)
+
+
+def q14_reference(path: str):
+    # the promotion percentage of q14 in hundredths, from the rows in python
+    # ints
+    lineitem = read_reference(
+        path, "lineitem", ["L_EXTENDEDPRICE", "L_DISCOUNT", "L_SHIPDATE", "L_PARTKEY"]
+    )
+    lineitem = lineitem.filter(
+        between_dates(lineitem["L_SHIPDATE"], date(1994, 3, 1), date(1994, 4, 1))
+    )
+    part = read_reference(path, "part", ["P_PARTKEY", "P_TYPE"])
+    promo_parts = part.filter(
+        pc.starts_with(part["P_TYPE"].cast(pa.string()), "PROMO")
+    )["P_PARTKEY"]
+    promo = pc.is_in(lineitem["L_PARTKEY"], value_set=promo_parts).to_pylist()
+    prices = arrow_hundredths(lineitem["L_EXTENDEDPRICE"])
+    discounts = arrow_hundredths(lineitem["L_DISCOUNT"])
+    revenue = [p * (100 - d) for p, d in zip(prices, discounts)]
+    promo_revenue = sum(r for r, is_promo in zip(revenue, promo) if is_promo)
+    return round_div(promo_revenue * 100 * 100, sum(revenue))
+
+
+# Q6 and Q14 do not use the validation parameters of the official answers, so
+# their exact versions are checked against values computed from the rows with
+# python ints
+reference_queries = {6: q06_reference, 14: q14_reference}
+
+
+def test_exact_results(q_num: int, result, path: str):
+    # the answers have two decimals, so the hundredths must match exactly
+    if q_num in reference_queries:
+        expected = reference_queries[q_num](path)
+        if int(result) != expected:
+            raise AssertionError(f"Q{q_num}: {int(result)} != {expected} hundredths")
+        return
+    answer = get_query_answer(q_num, answers_dir(path))
+    if not isinstance(result, PandasDF):
+        result = pd.DataFrame([[result]])
+
+    for column_index in range(len(answer.columns)):
+        s1 = result.iloc[:, column_index].reset_index(drop=True)
+        s2 = answer.iloc[:, column_index]
+        if isinstance(s1.dtype, pd.ArrowDtype):
+            s1 = s1.astype(s1.dtype.numpy_dtype)
+
+        # strings are object columns before pandas 3 and str columns after.
+        # The categoricals of --dictionary datasets have the object kind too.
+        if s2.dtype.kind == "O" or s1.dtype.kind == "O":
+            s1 = s1.astype("string").apply(lambda x: x.strip())
+            s2 = s2.astype("string").apply(lambda x: x.strip())
+        elif s2.dtype.kind == "f":
+            s1 = s1.astype("int64")
+            s2 = (s2 * MONEY_SCALE).round().astype("int64")
+
+        pd.testing.assert_series_equal(
+            left=s1,
+            right=s2,
+            check_index=False,
+            check_names=False,
+            check_dtype=False,
+        )
+
+
+def write_answer(path: str, q_num: int, result):
+    # the result as a reference answer of the dataset at `path`, in the
+    # layout of the official answers
+    if isinstance(result, pd.Series):
+        result = result.to_frame()
+    elif not isinstance(result, PandasDF):
+        result = pd.DataFrame([[result]])
+    answers = os.path.join(path, "answers")
+    os.makedirs(answers, exist_ok=True)
+    result.rename(columns=lambda x: str(x).lower()).to_csv(
+        os.path.join(answers, f"q{q_num}.out"), sep="|", index=False
+    )
+
+
+def load_query_tables(path, query, include_io=False):
+    for loader in query_to_loaders[query]:
+        loader(path, include_io)
+
+
 def run_queries(
     path,
     queries,
@@ -1230,33 +1598,109 @@ def run_queries(
     include_io=False,
     test_result=True,
     print_result=False,
+    write_answers=False,
 ):
+    # with a memory budget, the tables of each query are loaded before it
+    # runs, and the queries run in the order that shares the most tables
+    # between consecutive ones
+    budget = table_memory.budget_bytes is not None
+    if budget:
+        queries = table_memory.query_order(
+            queries, query_columns, table_weights(table_columns)
+        )
+        print(f"Query order: {queries}")
+    partition_by = dataset_info(path).get("partition_by", {})
     print("Start data loading")
     total_start = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path, include_io)
-    print(f"Data loading time (s): {time.time() - total_start}")
+    if not budget:
+        for query in queries:
+            load_query_tables(path, query, include_io)
+        print(f"Data loading time (s): {time.time() - total_start}")
+    load_time = 0.0
     total_start = time.time()
-    for query in queries:
+    runners, solution = query_to_runner, "pandas"
+    if exact_money:
+        runners, solution = exact_query_to_runner, "pandas-exact"
+    if dtype_backend == "pyarrow":
+        solution += "-pyarrow"
+    for i, query in enumerate(queries):
+        table_memory.set_upcoming(query_columns[q] for q in queries[i:])
+        if budget and not include_io:
+            # with include_io the query reads its tables itself
+            t1 = time.time()
+            load_query_tables(path, query)
+            load_time += time.time() - t1
+        if pushdown:
+            scan_filters.update(query_scan_filters(query, partition_by))
+        load_times.clear()
         try:
             t1 = time.time()
-            result = query_to_runner[query](path, include_io)
+            result = runners[query](path, include_io)
             dur = time.time() - t1
             success = True
-            if test_result:
-                test_results(query, result)
+            if test_result and exact_money:
+                test_exact_results(query, result, path)
+            elif test_result:
+                test_results(query, result, answers_dir(path))
             if print_result:
                 print(result)
+            if write_answers:
+                write_answer(path, query, result)
         except Exception as e:
             print("".join(traceback.TracebackException.from_exception(e).format()))
             dur = 0.0
             success = False
         finally:
             if log_timing:
-                append_row("pandas", query, dur, pd.__version__, success)
-    print(f"Total query execution time (s): {time.time() - total_start}")
+                append_row(solution, query, dur, pd.__version__, success)
+            if include_io:
+                report_scan(
+                    solution,
+                    path,
+                    query,
+                    pushdown,
+                    load_times,
+                    table_columns,
+                    scan_filters,
+                    log_timing,
+                )
+            scan_filters.clear()
+    query_time = time.time() - total_start - load_time
+    if budget:
+        print(f"Data loading time (s): {load_time}")
+        peak_mb = table_memory.peak_bytes / 1024 / 1024
+        print(f"Peak memory of the loaded tables (MB): {peak_mb:.0f}")
+    print(f"Total query execution time (s): {query_time}")
+
+
+def run_refresh(path, refresh_sets, log_timing=True, include_io=False):
+    # RF1 and RF2 of every refresh set, after the queries since they change
+    # orders and lineitem
+    total_start = time.time()
+    solution = "pandas-pyarrow" if dtype_backend == "pyarrow" else "pandas"
+    table_memory.set_upcoming([refresh_columns])
+    # the refresh sets change the in-memory tables in turn, so RF1 and RF2
+    # never read the base tables. With include_io they are read once
+    # here, as the queries may have kept filtered reads of them.
+    if include_io:
+        load_orders(path, include_io)
+        load_lineitem(path, include_io)
+    for refresh_set in range(1, refresh_sets + 1):
+        refresh = load_refresh_set(path, refresh_set)
+        for name, refresh_function in [("RF1", rf1), ("RF2", rf2)]:
+            try:
+                t1 = time.time()
+                refresh_function(path, refresh)
+                dur = time.time() - t1
+                success = True
+            except Exception as e:
+                print("".join(traceback.TracebackException.from_exception(e).format()))
+                dur = 0.0
+                success = False
+            finally:
+                if log_timing:
+                    append_row(solution, name, dur, pd.__version__, success)
+    print(f"Total refresh time (s): {time.time() - total_start}")
 
 
 def main():
@@ -1297,8 +1741,58 @@ def main():
         action="store_true",
         help="print result.",
     )
+    parser.add_argument(
+        "--refresh_sets",
+        type=int,
+        default=0,
+        help="number of refresh sets to apply with RF1 and RF2 after the queries.",
+    )
+    parser.add_argument(
+        "--pushdown",
+        action="store_true",
+        help="filter the reads of --include_io with the date predicates of the "
+        "queries.",
+    )
+    parser.add_argument(
+        "--dtype_backend",
+        choices=["numpy", "pyarrow"],
+        default="numpy",
+        help="load the columns as numpy arrays or as pd.ArrowDtype columns.",
+    )
+    parser.add_argument(
+        "--memory_budget_gb",
+        type=float,
+        help="keep the loaded tables within this many GB, evicting those "
+        "the next queries need last. By default every table stays loaded.",
+    )
+    parser.add_argument(
+        "--table_cache",
+        action="store_true",
+        help="read the tables from memory-mapped arrow files of the decoded "
+        "tables next to the dataset, written by the first run.",
+    )
+    parser.add_argument(
+        "--write_answers",
+        action="store_true",
+        help="write the results as the reference answers of a skewed dataset.",
+    )
+    parser.add_argument(
+        "--exact_money",
+        action="store_true",
+        help="run queries 1, 6 and 14 on integer hundredths, tested exactly.",
+    )
 
     args = parser.parse_args()
+    if args.pushdown and not args.include_io:
+        parser.error("--pushdown filters the reads of --include_io")
+    if args.table_cache and "://" in args.path:
+        parser.error("--table_cache needs a local dataset")
+    global pushdown, use_table_cache, dtype_backend
+    pushdown = args.pushdown
+    dtype_backend = args.dtype_backend
+    use_table_cache = args.table_cache
+    if args.memory_budget_gb is not None:
+        table_memory.set_budget(args.memory_budget_gb * 1024 * 1024 * 1024)
     log_timing = args.log_timing
     include_io = args.include_io
     test_answer = args.test_answer
@@ -1316,11 +1810,38 @@ def main():
     print(f"Storage options: {storage_options}")
 
     queries = list(range(1, 23))
+    if args.exact_money:
+        global exact_money
+        exact_money = True
+        queries = list(exact_query_to_runner)
     if args.queries is not None:
         queries = args.queries
+        if args.exact_money and not set(queries) <= set(exact_query_to_runner):
+            parser.error(
+                f"--exact_money runs only queries {list(exact_query_to_runner)}"
+            )
     print(f"Queries to run: {queries}")
-
-    run_queries(path, queries, log_timing, include_io, test_answer, print_result)
+    # read only the columns the queries use
+    table_columns.update(selected_columns(queries, args.refresh_sets > 0))
+
+    if args.write_answers and args.exact_money:
+        parser.error("--write_answers runs the float queries")
+    if args.write_answers and not dataset_info(path).get("skew"):
+        parser.error(
+            "--write_answers writes the answers of skewed datasets, the others "
+            "are tested against the official answers"
+        )
+    run_queries(
+        path,
+        queries,
+        log_timing,
+        include_io,
+        test_answer,
+        print_result,
+        args.write_answers,
+    )
+    if args.refresh_sets:
+        run_refresh(path, args.refresh_sets, log_timing, include_io)
 
 
 if __name__ == "__main__":
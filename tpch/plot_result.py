@@ -292,6 +292,10 @@ if __name__ == "__main__":
     LIMIT = 120
 
     df = pd.read_csv(TIMINGS_FILE)
+    # RF1/RF2 refresh timings are not queries
+    df = df[~df["query_no"].astype(str).str.startswith("RF")]
+    # --exact_money runs cover only a few queries
+    df = df[~df["solution"].str.endswith("-exact")]
     df["solution-version"] = df["solution"].str.cat(df["version"], sep="-")
     df["query_no"] = "q" + df["query_no"].astype(str)
 
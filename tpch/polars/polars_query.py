@@ -12,27 +12,51 @@ from polars import testing as pl_test
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
-from common_utils import append_row, ANSWERS_BASE_DIR
+import table_memory
+from schema import money_columns, query_columns, refresh_columns, table_weights
+from common_utils import (
+    append_row,
+    answers_dir,
+    ANSWERS_BASE_DIR,
+    MONEY_SCALE,
+)
+
+def _decode_money(lf: pl.LazyFrame, data_key: str):
+    # --money decimal or int datasets store the money columns exactly,
+    # the queries work on Float64
+    schema = lf.schema
+    columns = []
+    for name in money_columns.get(data_key, []):
+        if schema[name].is_integer():
+            columns.append(pl.col(name) / MONEY_SCALE)
+        elif schema[name] != pl.Float64:
+            columns.append(pl.col(name).cast(pl.Float64))
+    return lf.with_columns(columns) if columns else lf
+
+
+def _table_nbytes(lf: pl.LazyFrame):
+    # the stored LazyFrames wrap collected frames, collecting them copies nothing
+    return lf.collect().estimated_size()
 
-dataset_dict = {}
 
 def _load_data(data_path: str, data_key: str, include_io: bool):
-    if data_key not in dataset_dict:
+    result = table_memory.get_table(data_key)
+    if result is None:
         # load data using eagar mode with `collect()`
         # turn the data into lazy mode as queries are in lazy mode
-        # the `dataset_dict` stores `LazyFrame`
-        result = pl.scan_parquet(data_path).collect().rechunk().lazy()
-        dataset_dict[data_key] = result
+        # `table_memory` stores `LazyFrame`
+        result = _decode_money(pl.scan_parquet(data_path), data_key)
+        result = result.collect().rechunk().lazy()
+        table_memory.put_table(data_key, result, _table_nbytes)
     else:
         # if we want to include_io, use the lazy mode
         if include_io:
-            result = pl.scan_parquet(data_path)
+            result = _decode_money(pl.scan_parquet(data_path), data_key)
             return result
-        result = dataset_dict[data_key]
     return result
 
 def load_lineitem(root: str, include_io: bool=False):
-    data_path = root + "/lineitem.parquet/*.parquet"
+    data_path = root + "/lineitem.parquet/**/*.parquet"
     return _load_data(data_path, "lineitem", include_io)
 
 
@@ -42,7 +66,7 @@ def load_part(root: str, include_io: bool=False):
 
 
 def load_orders(root: str, include_io: bool=False):
-    data_path = root + "/orders.parquet/*.parquet"
+    data_path = root + "/orders.parquet/**/*.parquet"
     return _load_data(data_path, "orders", include_io)
 
 
@@ -62,7 +86,7 @@ def load_region(root: str, include_io: bool=False):
 
 
 def load_supplier(root: str, include_io: bool=False):
-    data_path = root + "/supplier.parquet"
+    data_path = root + "/supplier.parquet/*.parquet"
     return _load_data(data_path, "supplier", include_io)
 
 
@@ -71,6 +95,19 @@ def load_partsupp(root: str, include_io: bool=False):
     return _load_data(data_path, "partsupp", include_io)
 
 
+def load_refresh_set(root: str, refresh_set: int):
+    # rows inserted by RF1 and order keys deleted by RF2 in one refresh set
+    set_path = root + f"/refresh/u{refresh_set}"
+    orders = _decode_money(
+        pl.read_parquet(set_path + "/orders.parquet").lazy(), "orders"
+    )
+    lineitem = _decode_money(
+        pl.read_parquet(set_path + "/lineitem.parquet").lazy(), "lineitem"
+    )
+    delete = pl.read_parquet(set_path + "/delete.parquet")
+    return orders, lineitem, delete
+
+
 def q01(root: str,
         include_io: bool=False):
     lineitem = load_lineitem(root, include_io)
@@ -370,6 +407,30 @@ def q10(root: str, include_io: bool=False):
     return result
 
 
+def rf1(root: str, refresh, include_io: bool=False):
+    # insert the new orders and their lineitems; "diagonal" fills the
+    # year/month columns of a partitioned dataset with nulls
+    new_orders, new_lineitem, _ = refresh
+    orders = load_orders(root, include_io)
+    lineitem = load_lineitem(root, include_io)
+    orders = pl.concat([orders, new_orders], how="diagonal").collect().lazy()
+    lineitem = pl.concat([lineitem, new_lineitem], how="diagonal").collect().lazy()
+    table_memory.put_table("orders", orders, _table_nbytes, pin=True)
+    table_memory.put_table("lineitem", lineitem, _table_nbytes, pin=True)
+
+
+def rf2(root: str, refresh, include_io: bool=False):
+    # delete the orders of the refresh set and their lineitems
+    _, _, delete = refresh
+    orders = load_orders(root, include_io)
+    lineitem = load_lineitem(root, include_io)
+    keys = delete.get_column("O_ORDERKEY")
+    orders = orders.filter(~pl.col("O_ORDERKEY").is_in(keys)).collect().lazy()
+    lineitem = lineitem.filter(~pl.col("L_ORDERKEY").is_in(keys)).collect().lazy()
+    table_memory.put_table("orders", orders, _table_nbytes, pin=True)
+    table_memory.put_table("lineitem", lineitem, _table_nbytes, pin=True)
+
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -458,8 +519,8 @@ def get_query_answer(query: int, base_dir: str = ANSWERS_BASE_DIR) -> pl.LazyFra
     return answer_ldf.collect()
 
 
-def test_results(q_num: int, result_df: pl.DataFrame):
-    answer = get_query_answer(q_num)
+def test_results(q_num: int, result_df: pl.DataFrame, base_dir: str = ANSWERS_BASE_DIR):
+    answer = get_query_answer(q_num, base_dir)
 
     for column_index in range(len(answer.columns)):
         answer_column_name = answer.columns[column_index]
@@ -474,27 +535,44 @@ def test_results(q_num: int, result_df: pl.DataFrame):
                 check_exact=False, 
                 rtol=1e-2)
 
+def load_query_tables(path, query):
+    for loader in query_to_loaders[query]:
+        loader(path, False)
+
+
 def run_queries(path, queries, 
             log_timing = True, 
             include_io = False, 
             test_answer = True, 
             print_result = False):
+    # with a memory budget, the tables of each query are loaded before it
+    # runs, and the queries run in the order that shares the most tables
+    # between consecutive ones
+    budget = table_memory.budget_bytes is not None
+    if budget:
+        queries = table_memory.query_order(queries, query_columns, table_weights({}))
+        print(f"Query order: {queries}")
     print("Start data loading")
     total_start = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path, False)
-    print(f"Data loading time (s): {time.time() - total_start}")
+    if not budget:
+        for query in queries:
+            load_query_tables(path, query)
+        print(f"Data loading time (s): {time.time() - total_start}")
+    load_time = 0.0
     total_start = time.time()
-    for query in queries:
+    for i, query in enumerate(queries):
+        table_memory.set_upcoming(query_columns[q] for q in queries[i:])
+        if budget:
+            t1 = time.time()
+            load_query_tables(path, query)
+            load_time += time.time() - t1
         try:
             t1 = time.time()
             result = query_to_runner[query](path, include_io)
             dur = time.time() - t1
             success = True
             if test_answer:
-                test_results(query, result)
+                test_results(query, result, answers_dir(path))
         except Exception as e: 
             print(''.join(traceback.TracebackException.from_exception(e).format()))
             dur = 0.0
@@ -502,7 +580,37 @@ def run_queries(path, queries,
         finally:
             if log_timing:
                 append_row("polars", query, dur, pl.__version__, success)
-    print(f"Total query execution time (s): {time.time() - total_start}")
+    query_time = time.time() - total_start - load_time
+    if budget:
+        print(f"Data loading time (s): {load_time}")
+        peak_mb = table_memory.peak_bytes / 1024 / 1024
+        print(f"Peak memory of the loaded tables (MB): {peak_mb:.0f}")
+    print(f"Total query execution time (s): {query_time}")
+
+
+def run_refresh(path, refresh_sets, log_timing = True, include_io = False):
+    # RF1 and RF2 of every refresh set, after the queries since they change
+    # orders and lineitem
+    total_start = time.time()
+    table_memory.set_upcoming([refresh_columns])
+    # the refresh sets change the in-memory tables in turn, so RF1 and RF2
+    # never read the base tables, even with include_io
+    for refresh_set in range(1, refresh_sets + 1):
+        refresh = load_refresh_set(path, refresh_set)
+        for name, refresh_function in [("RF1", rf1), ("RF2", rf2)]:
+            try:
+                t1 = time.time()
+                refresh_function(path, refresh)
+                dur = time.time() - t1
+                success = True
+            except Exception as e:
+                print(''.join(traceback.TracebackException.from_exception(e).format()))
+                dur = 0.0
+                success = False
+            finally:
+                if log_timing:
+                    append_row("polars", name, dur, pl.__version__, success)
+    print(f"Total refresh time (s): {time.time() - total_start}")
 
 
 def main():
@@ -543,7 +651,21 @@ def main():
         action="store_true",
         help="print result.",
     )
+    parser.add_argument(
+        "--refresh_sets",
+        type=int,
+        default=0,
+        help="number of refresh sets to apply with RF1 and RF2 after the queries.",
+    )
+    parser.add_argument(
+        "--memory_budget_gb",
+        type=float,
+        help="keep the loaded tables within this many GB, evicting those "
+        "the next queries need last. By default every table stays loaded.",
+    )
     args = parser.parse_args()
+    if args.memory_budget_gb is not None:
+        table_memory.set_budget(args.memory_budget_gb * 1024 * 1024 * 1024)
     log_timing = args.log_timing
     include_io = args.include_io
     test_answer = args.test_answer
@@ -566,6 +688,8 @@ def main():
     print(f"Queries to run: {queries}")
 
     run_queries(path, queries, log_timing, include_io, test_answer, print_result)
+    if args.refresh_sets:
+        run_refresh(path, args.refresh_sets, log_timing, include_io)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+import collections
+import contextlib
+import resource
+import time
+
+import pandas as pd
+
+# Time, bytes and peak memory of the stages of the generation tasks. Stages
+# nest, and an inner stage's time is not counted in the outer one, so the
+# stages of a task add up to at most its run time. The rest is "other".
+
+profile_file = "_profile.csv"
+# profiles of the shards of a dataset, merged into profile_file by --finalize
+shard_profile_dir = "_profile"
+
+stages = [
+    "dbgen",
+    "parse",
+    "convert",
+    "sort",
+    "read",
+    "write",
+    "record",
+    "upload_wait",
+]
+# bytes of dbgen's CSV output, of the arrow tables handed to the writers and of
+# the files written
+byte_counters = ["csv_bytes", "arrow_bytes", "file_bytes"]
+
+task_profile = collections.Counter()
+stage_stack = []
+
+
+@contextlib.contextmanager
+def stage(name):
+    now = time.perf_counter()
+    if stage_stack:
+        outer, since = stage_stack[-1]
+        task_profile[outer] += now - since
+    stage_stack.append([name, now])
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        name, since = stage_stack.pop()
+        task_profile[name] += now - since
+        if stage_stack:
+            stage_stack[-1][1] = now
+
+
+def add_bytes(counter, nbytes):
+    task_profile[counter] += nbytes
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its high-water mark, so that the peak
+    # covers a single task
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss():
+    # peak resident memory in bytes, of this process only (not of dbgen)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def start_task():
+    task_profile.clear()
+    stage_stack.clear()
+    reset_peak_rss()
+
+
+def finish_task():
+    profile = dict(task_profile)
+    profile["peak_rss"] = peak_rss()
+    return profile
+
+
+def add_task(table_profiles, table_name, seconds, profile):
+    # add up the profiles of the tasks of every table
+    totals = table_profiles.setdefault(table_name, collections.Counter())
+    totals["tasks"] += 1
+    totals["task"] += seconds
+    for name, value in profile.items():
+        if name == "peak_rss":
+            totals[name] = max(totals[name], value)
+        else:
+            totals[name] += value
+
+
+def profile_summary(table_profiles, scale_factor):
+    # one row per table and a total, in seconds, MB and MB/s
+    mb = 1024 * 1024
+    rows = []
+    for table_name, totals in sorted(table_profiles.items()):
+        row = {"scale_factor": scale_factor, "table": table_name}
+        row["tasks"] = totals["tasks"]
+        row["task_s"] = totals["task"]
+        for name in stages:
+            row[f"{name}_s"] = totals[name]
+        row["other_s"] = max(0.0, totals["task"] - sum(totals[s] for s in stages))
+        for name in byte_counters:
+            row[name.replace("_bytes", "_mb")] = totals[name] / mb
+        row["peak_rss_mb"] = totals["peak_rss"] / mb
+        rows.append(row)
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+    total = df.drop(columns=["scale_factor", "table"]).sum()
+    total["peak_rss_mb"] = df["peak_rss_mb"].max()
+    df.loc[len(df)] = {"scale_factor": scale_factor, "table": "total", **total}
+    df["tasks"] = df["tasks"].astype(int)
+    return add_rates(df)
+
+
+def add_rates(df):
+    # generation rate of the CSV text and of the written files
+    df["csv_mb_per_s"] = df["csv_mb"] / df["task_s"]
+    df["file_mb_per_s"] = df["file_mb"] / df["task_s"]
+    return df.round(3)
+
+
+def merge_profiles(profiles):
+    # add up the summaries of several runs, table by table
+    df = pd.concat(profiles).drop(columns=["csv_mb_per_s", "file_mb_per_s"])
+    peak = df.groupby(["scale_factor", "table"])["peak_rss_mb"].max()
+    df = df.groupby(["scale_factor", "table"]).sum()
+    df["peak_rss_mb"] = peak
+    df = df.reset_index()
+    # the total last
+    df = pd.concat([df[df["table"] != "total"], df[df["table"] == "total"]])
+    return add_rates(df.reset_index(drop=True))
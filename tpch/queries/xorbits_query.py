@@ -1,3 +1,5 @@
+import os
+import sys
 import argparse
 import json
 import time
@@ -9,13 +11,16 @@ import xorbits.pandas as xd
 
 from utils import append_row
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+from common_utils import decode_dates
+
 
 def load_lineitem(root: str):
     data_path = root + "/lineitem.parquet"
     df = xd.read_parquet(data_path, use_arrow_dtype=True)
-    df["L_SHIPDATE"] = xd.to_datetime(df["L_SHIPDATE"], format="%Y-%m-%d")
-    df["L_RECEIPTDATE"] = xd.to_datetime(df["L_RECEIPTDATE"], format="%Y-%m-%d")
-    df["L_COMMITDATE"] = xd.to_datetime(df["L_COMMITDATE"], format="%Y-%m-%d")
+    df = decode_dates(df, "lineitem", xd.to_datetime)
     return df
 
 
@@ -28,7 +33,7 @@ def load_part(root: str):
 def load_orders(root: str):
     data_path = root + "/orders.parquet"
     df = xd.read_parquet(data_path)
-    df["O_ORDERDATE"] = xd.to_datetime(df["O_ORDERDATE"], format="%Y-%m-%d")
+    df = decode_dates(df, "orders", xd.to_datetime)
     return df
 
 
@@ -0,0 +1,504 @@
+from datetime import date, timedelta
+
+import pyarrow as pa
+
+# The TPC-H schema shared by the generator and the loaders of every engine:
+# column types, keys, date, money and low-cardinality columns and the columns
+# each query reads.
+
+# version of the stored types and of their decoding. Bumping it invalidates
+# the table caches of table_cache.py.
+schema_version = 1
+
+# Arrow column types of every table as written to parquet. They are used to
+# convert the pandas dataframes and to parse dbgen output with pyarrow.csv in
+# streaming mode. Dates are stored as date32.
+arrow_columns = {
+    "customer": [
+        ("C_CUSTKEY", pa.int64()), ("C_NAME", pa.string()),
+        ("C_ADDRESS", pa.string()), ("C_NATIONKEY", pa.int64()),
+        ("C_PHONE", pa.string()), ("C_ACCTBAL", pa.float64()),
+        ("C_MKTSEGMENT", pa.string()), ("C_COMMENT", pa.string()),
+    ],
+    "lineitem": [
+        ("L_ORDERKEY", pa.int64()), ("L_PARTKEY", pa.int64()),
+        ("L_SUPPKEY", pa.int64()), ("L_LINENUMBER", pa.int64()),
+        ("L_QUANTITY", pa.float64()), ("L_EXTENDEDPRICE", pa.float64()),
+        ("L_DISCOUNT", pa.float64()), ("L_TAX", pa.float64()),
+        ("L_RETURNFLAG", pa.string()), ("L_LINESTATUS", pa.string()),
+        ("L_SHIPDATE", pa.date32()), ("L_COMMITDATE", pa.date32()),
+        ("L_RECEIPTDATE", pa.date32()), ("L_SHIPINSTRUCT", pa.string()),
+        ("L_SHIPMODE", pa.string()), ("L_COMMENT", pa.string()),
+    ],
+    "nation": [
+        ("N_NATIONKEY", pa.int64()), ("N_NAME", pa.string()),
+        ("N_REGIONKEY", pa.int64()), ("N_COMMENT", pa.string()),
+    ],
+    "orders": [
+        ("O_ORDERKEY", pa.int64()), ("O_CUSTKEY", pa.int64()),
+        ("O_ORDERSTATUS", pa.string()), ("O_TOTALPRICE", pa.float64()),
+        ("O_ORDERDATE", pa.date32()), ("O_ORDERPRIORITY", pa.string()),
+        ("O_CLERK", pa.string()), ("O_SHIPPRIORITY", pa.int64()),
+        ("O_COMMENT", pa.string()),
+    ],
+    "part": [
+        ("P_PARTKEY", pa.int64()), ("P_NAME", pa.string()),
+        ("P_MFGR", pa.string()), ("P_BRAND", pa.string()),
+        ("P_TYPE", pa.string()), ("P_SIZE", pa.int64()),
+        ("P_CONTAINER", pa.string()), ("P_RETAILPRICE", pa.float64()),
+        ("P_COMMENT", pa.string()),
+    ],
+    "partsupp": [
+        ("PS_PARTKEY", pa.int64()), ("PS_SUPPKEY", pa.int64()),
+        ("PS_AVAILQTY", pa.int64()), ("PS_SUPPLYCOST", pa.float64()),
+        ("PS_COMMENT", pa.string()),
+    ],
+    "region": [
+        ("R_REGIONKEY", pa.int64()), ("R_NAME", pa.string()),
+        ("R_COMMENT", pa.string()),
+    ],
+    "supplier": [
+        ("S_SUPPKEY", pa.int64()), ("S_NAME", pa.string()),
+        ("S_ADDRESS", pa.string()), ("S_NATIONKEY", pa.int64()),
+        ("S_PHONE", pa.string()), ("S_ACCTBAL", pa.float64()),
+        ("S_COMMENT", pa.string()),
+    ],
+}
+
+
+def table_schema(table_name):
+    return pa.schema(arrow_columns[table_name])
+
+
+# rows of every table at SF1. nation and region do not grow with the scale
+# factor.
+table_rows_sf1 = {
+    "customer": 150_000,
+    "lineitem": 6_001_215,
+    "nation": 25,
+    "orders": 1_500_000,
+    "part": 200_000,
+    "partsupp": 800_000,
+    "region": 5,
+    "supplier": 10_000,
+}
+
+
+# columns that identify the rows of every table
+primary_keys = {
+    "customer": ["C_CUSTKEY"],
+    "lineitem": ["L_ORDERKEY", "L_LINENUMBER"],
+    "nation": ["N_NATIONKEY"],
+    "orders": ["O_ORDERKEY"],
+    "part": ["P_PARTKEY"],
+    "partsupp": ["PS_PARTKEY", "PS_SUPPKEY"],
+    "region": ["R_REGIONKEY"],
+    "supplier": ["S_SUPPKEY"],
+}
+
+# (columns, referenced table, referenced columns) of every table
+foreign_keys = {
+    "customer": [(["C_NATIONKEY"], "nation", ["N_NATIONKEY"])],
+    "lineitem": [
+        (["L_ORDERKEY"], "orders", ["O_ORDERKEY"]),
+        (["L_PARTKEY"], "part", ["P_PARTKEY"]),
+        (["L_SUPPKEY"], "supplier", ["S_SUPPKEY"]),
+        (["L_PARTKEY", "L_SUPPKEY"], "partsupp", ["PS_PARTKEY", "PS_SUPPKEY"]),
+    ],
+    "nation": [(["N_REGIONKEY"], "region", ["R_REGIONKEY"])],
+    "orders": [(["O_CUSTKEY"], "customer", ["C_CUSTKEY"])],
+    "part": [],
+    "partsupp": [
+        (["PS_PARTKEY"], "part", ["P_PARTKEY"]),
+        (["PS_SUPPKEY"], "supplier", ["S_SUPPKEY"]),
+    ],
+    "region": [],
+    "supplier": [(["S_NATIONKEY"], "nation", ["N_NATIONKEY"])],
+}
+
+# date32 columns, which the pandas-like loaders turn into datetime64
+date_columns = {
+    table_name: [name for name, type in columns if type == pa.date32()]
+    for table_name, columns in arrow_columns.items()
+}
+
+# money columns of every table. generate_data_pq.py --money can store them
+# as decimal(15,2) or as int64 hundredths instead of float64.
+money_columns = {
+    "customer": ["C_ACCTBAL"],
+    "lineitem": ["L_EXTENDEDPRICE", "L_DISCOUNT", "L_TAX"],
+    "orders": ["O_TOTALPRICE"],
+    "part": ["P_RETAILPRICE"],
+    "partsupp": ["PS_SUPPLYCOST"],
+    "supplier": ["S_ACCTBAL"],
+}
+
+# Low-cardinality string columns that --dictionary stores as arrow
+# dictionaries. The dictionary of a column is its whole TPC-H value domain in
+# sorted order, so every piece carries the same dictionary and readers can
+# concatenate pieces into one categorical that sorts like the strings.
+dictionary_columns = {
+    "lineitem": {
+        "L_RETURNFLAG": ["A", "N", "R"],
+        "L_LINESTATUS": ["F", "O"],
+        "L_SHIPMODE": ["AIR", "FOB", "MAIL", "RAIL", "REG AIR", "SHIP", "TRUCK"],
+        "L_SHIPINSTRUCT": [
+            "COLLECT COD",
+            "DELIVER IN PERSON",
+            "NONE",
+            "TAKE BACK RETURN",
+        ],
+    },
+    "orders": {
+        "O_ORDERSTATUS": ["F", "O", "P"],
+        "O_ORDERPRIORITY": [
+            "1-URGENT",
+            "2-HIGH",
+            "3-MEDIUM",
+            "4-NOT SPECIFIED",
+            "5-LOW",
+        ],
+    },
+    "customer": {
+        "C_MKTSEGMENT": [
+            "AUTOMOBILE",
+            "BUILDING",
+            "FURNITURE",
+            "HOUSEHOLD",
+            "MACHINERY",
+        ],
+    },
+    "part": {
+        "P_BRAND": [f"Brand#{m}{n}" for m in range(1, 6) for n in range(1, 6)],
+        "P_CONTAINER": sorted(
+            f"{size} {kind}"
+            for size in ["SM", "LG", "MED", "JUMBO", "WRAP"]
+            for kind in ["CASE", "BOX", "BAG", "JAR", "PKG", "PACK", "CAN", "DRUM"]
+        ),
+    },
+    "nation": {
+        "N_NAME": [
+            "ALGERIA",
+            "ARGENTINA",
+            "BRAZIL",
+            "CANADA",
+            "CHINA",
+            "EGYPT",
+            "ETHIOPIA",
+            "FRANCE",
+            "GERMANY",
+            "INDIA",
+            "INDONESIA",
+            "IRAN",
+            "IRAQ",
+            "JAPAN",
+            "JORDAN",
+            "KENYA",
+            "MOROCCO",
+            "MOZAMBIQUE",
+            "PERU",
+            "ROMANIA",
+            "RUSSIA",
+            "SAUDI ARABIA",
+            "UNITED KINGDOM",
+            "UNITED STATES",
+            "VIETNAM",
+        ],
+    },
+}
+
+# Columns read by every query, table by table: the columns of the SQL text
+# and the L_ORDERKEY that the dataframe versions of Q1 count.
+query_columns = {
+    1: {
+        "lineitem": [
+            "L_ORDERKEY",
+            "L_QUANTITY",
+            "L_EXTENDEDPRICE",
+            "L_DISCOUNT",
+            "L_TAX",
+            "L_RETURNFLAG",
+            "L_LINESTATUS",
+            "L_SHIPDATE",
+        ],
+    },
+    2: {
+        "nation": ["N_NATIONKEY", "N_NAME", "N_REGIONKEY"],
+        "part": ["P_PARTKEY", "P_MFGR", "P_TYPE", "P_SIZE"],
+        "partsupp": ["PS_PARTKEY", "PS_SUPPKEY", "PS_SUPPLYCOST"],
+        "region": ["R_REGIONKEY", "R_NAME"],
+        "supplier": [
+            "S_SUPPKEY",
+            "S_NAME",
+            "S_ADDRESS",
+            "S_NATIONKEY",
+            "S_PHONE",
+            "S_ACCTBAL",
+            "S_COMMENT",
+        ],
+    },
+    3: {
+        "customer": ["C_CUSTKEY", "C_MKTSEGMENT"],
+        "lineitem": ["L_ORDERKEY", "L_EXTENDEDPRICE", "L_DISCOUNT", "L_SHIPDATE"],
+        "orders": ["O_ORDERKEY", "O_CUSTKEY", "O_ORDERDATE", "O_SHIPPRIORITY"],
+    },
+    4: {
+        "lineitem": ["L_ORDERKEY", "L_COMMITDATE", "L_RECEIPTDATE"],
+        "orders": ["O_ORDERKEY", "O_ORDERDATE", "O_ORDERPRIORITY"],
+    },
+    5: {
+        "customer": ["C_CUSTKEY", "C_NATIONKEY"],
+        "lineitem": ["L_ORDERKEY", "L_SUPPKEY", "L_EXTENDEDPRICE", "L_DISCOUNT"],
+        "nation": ["N_NATIONKEY", "N_NAME", "N_REGIONKEY"],
+        "orders": ["O_ORDERKEY", "O_CUSTKEY", "O_ORDERDATE"],
+        "region": ["R_REGIONKEY", "R_NAME"],
+        "supplier": ["S_SUPPKEY", "S_NATIONKEY"],
+    },
+    6: {
+        "lineitem": ["L_QUANTITY", "L_EXTENDEDPRICE", "L_DISCOUNT", "L_SHIPDATE"],
+    },
+    7: {
+        "customer": ["C_CUSTKEY", "C_NATIONKEY"],
+        "lineitem": [
+            "L_ORDERKEY",
+            "L_SUPPKEY",
+            "L_EXTENDEDPRICE",
+            "L_DISCOUNT",
+            "L_SHIPDATE",
+        ],
+        "nation": ["N_NATIONKEY", "N_NAME"],
+        "orders": ["O_ORDERKEY", "O_CUSTKEY"],
+        "supplier": ["S_SUPPKEY", "S_NATIONKEY"],
+    },
+    8: {
+        "customer": ["C_CUSTKEY", "C_NATIONKEY"],
+        "lineitem": [
+            "L_ORDERKEY",
+            "L_PARTKEY",
+            "L_SUPPKEY",
+            "L_EXTENDEDPRICE",
+            "L_DISCOUNT",
+        ],
+        "nation": ["N_NATIONKEY", "N_NAME", "N_REGIONKEY"],
+        "orders": ["O_ORDERKEY", "O_CUSTKEY", "O_ORDERDATE"],
+        "part": ["P_PARTKEY", "P_TYPE"],
+        "region": ["R_REGIONKEY", "R_NAME"],
+        "supplier": ["S_SUPPKEY", "S_NATIONKEY"],
+    },
+    9: {
+        "lineitem": [
+            "L_ORDERKEY",
+            "L_PARTKEY",
+            "L_SUPPKEY",
+            "L_QUANTITY",
+            "L_EXTENDEDPRICE",
+            "L_DISCOUNT",
+        ],
+        "nation": ["N_NATIONKEY", "N_NAME"],
+        "orders": ["O_ORDERKEY", "O_ORDERDATE"],
+        "part": ["P_PARTKEY", "P_NAME"],
+        "partsupp": ["PS_PARTKEY", "PS_SUPPKEY", "PS_SUPPLYCOST"],
+        "supplier": ["S_SUPPKEY", "S_NATIONKEY"],
+    },
+    10: {
+        "customer": [
+            "C_CUSTKEY",
+            "C_NAME",
+            "C_ADDRESS",
+            "C_NATIONKEY",
+            "C_PHONE",
+            "C_ACCTBAL",
+            "C_COMMENT",
+        ],
+        "lineitem": ["L_ORDERKEY", "L_EXTENDEDPRICE", "L_DISCOUNT", "L_RETURNFLAG"],
+        "nation": ["N_NATIONKEY", "N_NAME"],
+        "orders": ["O_ORDERKEY", "O_CUSTKEY", "O_ORDERDATE"],
+    },
+    11: {
+        "nation": ["N_NATIONKEY", "N_NAME"],
+        "partsupp": ["PS_PARTKEY", "PS_SUPPKEY", "PS_AVAILQTY", "PS_SUPPLYCOST"],
+        "supplier": ["S_SUPPKEY", "S_NATIONKEY"],
+    },
+    12: {
+        "lineitem": [
+            "L_ORDERKEY",
+            "L_SHIPDATE",
+            "L_COMMITDATE",
+            "L_RECEIPTDATE",
+            "L_SHIPMODE",
+        ],
+        "orders": ["O_ORDERKEY", "O_ORDERPRIORITY"],
+    },
+    13: {
+        "customer": ["C_CUSTKEY"],
+        "orders": ["O_ORDERKEY", "O_CUSTKEY", "O_COMMENT"],
+    },
+    14: {
+        "lineitem": ["L_PARTKEY", "L_EXTENDEDPRICE", "L_DISCOUNT", "L_SHIPDATE"],
+        "part": ["P_PARTKEY", "P_TYPE"],
+    },
+    15: {
+        "lineitem": ["L_SUPPKEY", "L_EXTENDEDPRICE", "L_DISCOUNT", "L_SHIPDATE"],
+        "supplier": ["S_SUPPKEY", "S_NAME", "S_ADDRESS", "S_PHONE"],
+    },
+    16: {
+        "part": ["P_PARTKEY", "P_BRAND", "P_TYPE", "P_SIZE"],
+        "partsupp": ["PS_PARTKEY", "PS_SUPPKEY"],
+        "supplier": ["S_SUPPKEY", "S_COMMENT"],
+    },
+    17: {
+        "lineitem": ["L_PARTKEY", "L_QUANTITY", "L_EXTENDEDPRICE"],
+        "part": ["P_PARTKEY", "P_BRAND", "P_CONTAINER"],
+    },
+    18: {
+        "customer": ["C_CUSTKEY", "C_NAME"],
+        "lineitem": ["L_ORDERKEY", "L_QUANTITY"],
+        "orders": ["O_ORDERKEY", "O_CUSTKEY", "O_TOTALPRICE", "O_ORDERDATE"],
+    },
+    19: {
+        "lineitem": [
+            "L_PARTKEY",
+            "L_QUANTITY",
+            "L_EXTENDEDPRICE",
+            "L_DISCOUNT",
+            "L_SHIPINSTRUCT",
+            "L_SHIPMODE",
+        ],
+        "part": ["P_PARTKEY", "P_BRAND", "P_SIZE", "P_CONTAINER"],
+    },
+    20: {
+        "lineitem": ["L_PARTKEY", "L_SUPPKEY", "L_QUANTITY", "L_SHIPDATE"],
+        "nation": ["N_NATIONKEY", "N_NAME"],
+        "part": ["P_PARTKEY", "P_NAME"],
+        "partsupp": ["PS_PARTKEY", "PS_SUPPKEY", "PS_AVAILQTY"],
+        "supplier": ["S_SUPPKEY", "S_NAME", "S_ADDRESS", "S_NATIONKEY"],
+    },
+    21: {
+        "lineitem": ["L_ORDERKEY", "L_SUPPKEY", "L_COMMITDATE", "L_RECEIPTDATE"],
+        "nation": ["N_NATIONKEY", "N_NAME"],
+        "orders": ["O_ORDERKEY", "O_ORDERSTATUS"],
+        "supplier": ["S_SUPPKEY", "S_NAME", "S_NATIONKEY"],
+    },
+    22: {
+        "customer": ["C_CUSTKEY", "C_PHONE", "C_ACCTBAL"],
+        "orders": ["O_CUSTKEY"],
+    },
+}
+
+
+def date_range(column, start, end):
+    # start <= column < end
+    start, end = date.fromisoformat(start), date.fromisoformat(end)
+    return [(column, ">=", start), (column, "<", end)]
+
+
+# Date predicates that queries apply to a table before joining it, as the
+# read_parquet filters of runners with --pushdown. The dates are those of the
+# query implementations.
+query_filters = {
+    1: {"lineitem": [("L_SHIPDATE", "<=", date(1998, 9, 2))]},
+    3: {
+        "lineitem": [("L_SHIPDATE", ">", date(1995, 3, 4))],
+        "orders": [("O_ORDERDATE", "<", date(1995, 3, 4))],
+    },
+    4: {"orders": date_range("O_ORDERDATE", "1993-08-01", "1993-11-01")},
+    5: {"orders": date_range("O_ORDERDATE", "1996-01-01", "1997-01-01")},
+    6: {"lineitem": date_range("L_SHIPDATE", "1996-01-01", "1997-01-01")},
+    7: {"lineitem": date_range("L_SHIPDATE", "1995-01-01", "1997-01-01")},
+    8: {"orders": date_range("O_ORDERDATE", "1995-01-01", "1997-01-01")},
+    10: {"orders": date_range("O_ORDERDATE", "1994-11-01", "1995-02-01")},
+    12: {
+        "lineitem": date_range("L_RECEIPTDATE", "1994-01-01", "1995-01-01")
+        + [
+            ("L_COMMITDATE", "<", date(1995, 1, 1)),
+            ("L_SHIPDATE", "<", date(1995, 1, 1)),
+        ]
+    },
+    14: {"lineitem": date_range("L_SHIPDATE", "1994-03-01", "1994-04-01")},
+    15: {"lineitem": date_range("L_SHIPDATE", "1996-01-01", "1996-04-01")},
+    20: {"lineitem": date_range("L_SHIPDATE", "1996-01-01", "1997-01-01")},
+}
+
+
+def month_range_filters(first, last):
+    # predicates on the year and month partition columns that select the
+    # months from `first` to `last`, (year, month) pairs or None when
+    # unbounded, in disjunctive normal form
+    if first and last and first[0] == last[0]:
+        year, months = first[0], [("month", ">=", first[1]), ("month", "<=", last[1])]
+        return [[("year", "=", year)] + months]
+    ranges = []
+    if first:
+        ranges.append([("year", "=", first[0]), ("month", ">=", first[1])])
+    if not first or not last or last[0] - first[0] > 1:
+        # the whole years in between
+        ranges.append(
+            ([("year", ">", first[0])] if first else [])
+            + ([("year", "<", last[0])] if last else [])
+        )
+    if last:
+        ranges.append([("year", "=", last[0]), ("month", "<=", last[1])])
+    return ranges
+
+
+def partition_filters(filters, partition_key):
+    # `filters` of a table written with --partition_by `partition_key` as
+    # year=YYYY/month=MM/ directories, plus the year and month predicates
+    # implied by their range of `partition_key`. Readers then skip the
+    # directories outside the range without opening their files.
+    first = last = None
+    for column, op, value in filters:
+        if column != partition_key:
+            continue
+        if op in (">", ">="):
+            month = (value.year, value.month)
+            first = max(first or month, month)
+        elif op in ("<", "<="):
+            if op == "<":
+                value -= timedelta(days=1)
+            month = (value.year, value.month)
+            last = min(last or month, month)
+    if first is None and last is None:
+        return filters
+    return [filters + months for months in month_range_filters(first, last)]
+
+
+def query_scan_filters(query, partition_by):
+    # query_filters of a query for a dataset written with these
+    # --partition_by columns, {table: column}
+    return {
+        table_name: partition_filters(filters, partition_by[table_name])
+        if table_name in partition_by
+        else filters
+        for table_name, filters in query_filters.get(query, {}).items()
+    }
+
+
+# columns RF2 reads to delete the refreshed orders and their lineitems
+refresh_columns = {"orders": ["O_ORDERKEY"], "lineitem": ["L_ORDERKEY"]}
+
+
+def selected_columns(queries, refresh=False):
+    # the columns of every table that the queries (and the refresh functions)
+    # read, in table order. Tables they do not read are left out.
+    needed = {}
+    for query in queries:
+        for table_name, columns in query_columns[query].items():
+            needed.setdefault(table_name, set()).update(columns)
+    if refresh:
+        for table_name, columns in refresh_columns.items():
+            needed.setdefault(table_name, set()).update(columns)
+    return {
+        table_name: [name for name, _ in columns if name in needed[table_name]]
+        for table_name, columns in arrow_columns.items()
+        if table_name in needed
+    }
+
+
+def table_weights(columns):
+    # rough relative sizes of the tables loaded with these selected columns,
+    # rows times columns. Tables without selected columns are read whole.
+    return {
+        table_name: rows * len(columns.get(table_name, arrow_columns[table_name]))
+        for table_name, rows in table_rows_sf1.items()
+    }
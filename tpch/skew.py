@@ -0,0 +1,204 @@
+import numpy as np
+import pyarrow as pa
+
+import numpy_dbgen
+
+# Zipf-skewed foreign keys for generate_data_pq.py --skew. dbgen draws the
+# keys uniformly. Here the k-th most popular key is drawn with probability
+# proportional to 1 / k**theta, so a few parts, suppliers or customers get
+# most of the rows. Every draw comes from a hash of the row's primary key,
+# so a row is rewritten the same way whatever piece or batch it is in.
+
+# skewable column -> table
+skew_columns = {
+    "L_PARTKEY": "lineitem",
+    "L_SUPPKEY": "lineitem",
+    "O_CUSTKEY": "orders",
+}
+
+# multiplier that scatters the popularity ranks over the key range, so the
+# hot keys are not all next to each other
+rank_stride = 2654435761
+
+# dbgen never gives orders to every third customer (CUST_MORTALITY)
+customer_mortality = 3
+
+
+def parse_skew(values):
+    # ["L_PARTKEY=1.1", ...] -> {"L_PARTKEY": 1.1, ...}
+    skew = {}
+    for value in values:
+        column, _, theta = value.partition("=")
+        if column not in skew_columns:
+            raise ValueError(f"{column} is not one of {', '.join(skew_columns)}")
+        try:
+            theta = float(theta)
+        except ValueError:
+            raise ValueError(f"{value}: expected COLUMN=THETA") from None
+        if theta < 0:
+            raise ValueError(f"{value}: the Zipf exponent must be >= 0")
+        skew[column] = theta
+    return skew
+
+
+def row_uniforms(keys, salt):
+    # splitmix64 of the row keys, as uniforms in [0, 1)
+    z = keys.astype(np.uint64) + np.uint64(salt * 0x9E3779B97F4A7C15 % (1 << 64))
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def zipf_ranks(uniform, n, theta):
+    # popularity ranks 1..n with P(k) ~ k**-theta, from the inverse of the
+    # continuous approximation of the Zipf distribution function
+    if theta == 1:
+        x = np.exp(uniform * np.log(n + 1))
+    else:
+        a = 1 - theta
+        x = (1 + uniform * ((n + 1) ** a - 1)) ** (1 / a)
+    return np.clip(x.astype(np.int64), 1, n)
+
+
+def _permute(values, multiplier, n):
+    # (values - 1) * multiplier modulo n, plus one
+    product = (values - 1).astype(np.uint64) * np.uint64(multiplier)
+    return (product % np.uint64(n)).astype(np.int64) + 1
+
+
+def rank_to_key(ranks, n):
+    # a bijection of 1..n onto itself
+    return _permute(ranks, rank_stride % n, n)
+
+
+def key_to_rank(keys, n):
+    return _permute(keys, pow(rank_stride % n, -1, n), n)
+
+
+def skewed_parts(orderkey, linenumber, scale_factor, skew):
+    # hot parts and/or hot suppliers of the given lines. (partkey, suppkey)
+    # stays one of the four partsupp rows of the part.
+    parts = numpy_dbgen.table_rows("part", scale_factor)
+    suppliers = numpy_dbgen.table_rows("supplier", scale_factor)
+    keys = orderkey * 8 + linenumber
+    u_part, u_supp = row_uniforms(keys, 1), row_uniforms(keys, 2)
+    if "L_PARTKEY" in skew:
+        partkey = rank_to_key(zipf_ranks(u_part, parts, skew["L_PARTKEY"]), parts)
+        candidates = np.stack(
+            [numpy_dbgen.part_supplier(partkey, i, suppliers) for i in range(4)],
+            axis=1,
+        )
+        if "L_SUPPKEY" in skew:
+            # pick among the part's suppliers by their popularity
+            ranks = key_to_rank(candidates, suppliers)
+            weights = np.cumsum(ranks ** -skew["L_SUPPKEY"], axis=1)
+            draw = u_supp * weights[:, -1]
+            i = np.minimum((weights < draw[:, None]).sum(axis=1), 3)
+        else:
+            i = (u_supp * 4).astype(np.int64)
+        suppkey = candidates[np.arange(len(partkey)), i]
+    else:
+        # every supplier is the first supplier of the parts that equal its
+        # key minus one modulo the number of suppliers
+        ranks = zipf_ranks(u_supp, suppliers, skew["L_SUPPKEY"])
+        suppkey = rank_to_key(ranks, suppliers)
+        k = (u_part * (parts // suppliers)).astype(np.int64)
+        partkey = (suppkey - 2 + k * suppliers) % parts + 1
+    return partkey, suppkey
+
+
+def skew_lineitem(table, scale_factor, skew):
+    # L_EXTENDEDPRICE follows the new part
+    partkey, suppkey = skewed_parts(
+        table["L_ORDERKEY"].to_numpy(),
+        table["L_LINENUMBER"].to_numpy(),
+        scale_factor,
+        skew,
+    )
+    quantity = table["L_QUANTITY"].to_numpy().astype(np.int64)
+    price = numpy_dbgen.retail_price(partkey) * quantity / 100
+    for name, values in [
+        ("L_PARTKEY", partkey),
+        ("L_SUPPKEY", suppkey),
+        ("L_EXTENDEDPRICE", price),
+    ]:
+        i = table.schema.get_field_index(name)
+        values = pa.array(values, table.schema.field(i).type)
+        table = table.set_column(i, name, values)
+    return table
+
+
+def _cents(column):
+    return np.round(column.to_numpy() * 100).astype(np.int64)
+
+
+def skewed_totals(orderkey, scale_factor, skew, lineitem=None):
+    # O_TOTALPRICE of the orders, in cents, summed over their skewed lines.
+    # The lines are taken from `lineitem`, the skewed lineitem rows of the
+    # orders, or are generated again when the orders are consecutive ones
+    # of the table.
+    if lineitem is None:
+        index = numpy_dbgen.order_index(orderkey)
+        first, count = int(index[0]) - 1, len(index)
+        if not np.array_equal(index, np.arange(first + 1, first + count + 1)):
+            raise ValueError("the lines of non-consecutive orders must be given")
+        lines = numpy_dbgen.order_lines(scale_factor, first, count)
+        line_orders = lines["orderkey"][lines["order"]]
+        partkey, _ = skewed_parts(
+            line_orders, lines["L_LINENUMBER"], scale_factor, skew
+        )
+    else:
+        line_orders = lineitem["L_ORDERKEY"].to_numpy()
+        partkey = lineitem["L_PARTKEY"].to_numpy()
+        lines = {
+            "L_QUANTITY": lineitem["L_QUANTITY"].to_numpy().astype(np.int64),
+            "L_DISCOUNT": _cents(lineitem["L_DISCOUNT"]),
+            "L_TAX": _cents(lineitem["L_TAX"]),
+        }
+    lines["L_EXTENDEDPRICE"] = numpy_dbgen.retail_price(partkey) * lines["L_QUANTITY"]
+    keys, line_order = np.unique(line_orders, return_inverse=True)
+    totals = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(totals, line_order, numpy_dbgen.line_totals(lines))
+    return totals[np.searchsorted(keys, orderkey)]
+
+
+def skew_orders(table, scale_factor, skew, lineitem=None):
+    # whale customers, chosen among the customers that dbgen gives orders to,
+    # and O_TOTALPRICE summed over the lines with their new prices
+    orderkey = table["O_ORDERKEY"].to_numpy()
+    columns = {}
+    if "O_CUSTKEY" in skew:
+        customers = numpy_dbgen.table_rows("customer", scale_factor)
+        active = customers - customers // customer_mortality
+        uniform = row_uniforms(orderkey, 3)
+        index = rank_to_key(zipf_ranks(uniform, active, skew["O_CUSTKEY"]), active)
+        index -= 1
+        columns["O_CUSTKEY"] = index + index // (customer_mortality - 1) + 1
+    if any(skew_columns[c] == "lineitem" for c in skew):
+        totals = skewed_totals(orderkey, scale_factor, skew, lineitem)
+        columns["O_TOTALPRICE"] = totals / 100
+    for name, values in columns.items():
+        i = table.schema.get_field_index(name)
+        values = pa.array(values, table.schema.field(i).type)
+        table = table.set_column(i, name, values)
+    return table
+
+
+def skew_table(table, table_name, scale_factor, skew, lineitem=None):
+    # rewrite the skewed keys of a generated (piece of a) table. Skewed
+    # lineitem keys change the prices of the lines, so they rewrite the
+    # order totals too; `lineitem` gives the skewed lines of orders that are
+    # not consecutive ones of the table, like the orders of a refresh set.
+    skewed = {skew_columns[c] for c in skew}
+    if table_name == "lineitem" and skewed & {"lineitem"}:
+        return skew_lineitem(table, scale_factor, skew)
+    if table_name == "orders" and skewed:
+        return skew_orders(table, scale_factor, skew, lineitem)
+    return table
+
+
+def skew_batches(batches, table_name, scale_factor, skew):
+    for batch in batches:
+        table = pa.Table.from_batches([batch])
+        yield from skew_table(table, table_name, scale_factor, skew).to_batches()
@@ -1,3 +1,5 @@
+import os
+import sys
 import argparse
 import time
 from typing import List, Optional, Set, Union
@@ -6,6 +8,11 @@ import pandas as pd
 import pyspark.pandas as ps
 from pyspark.sql import SparkSession
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+from common_utils import decode_money
+
 total_time = 0
 queries: Optional[Union[Set[str], List[str]]] = None
 spark: SparkSession = None
@@ -31,7 +38,7 @@ def load_data(data_folder: str, table_name: str) -> ps.DataFrame:
     df = spark.read.parquet(data_folder + "/" + table_name).cache()
     print(f"Table {table_name} in folder {data_folder} has {df.count()} rows.")
     df = ps.DataFrame(df)
-    return df
+    return decode_money(df, table_name)
 
 
 @time_collector
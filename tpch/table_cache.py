@@ -0,0 +1,91 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+import pyarrow as pa
+
+from common_utils import arrow_dataset
+from schema import date_columns, schema_version
+
+# Decoded tables of a dataset, as uncompressed arrow IPC files in
+# <dataset>/_cache/<key>/. The key is the checksum of the dataset's manifest
+# and the schema version, so regenerating the dataset or changing the stored
+# types starts a new cache. Dates are stored as timestamps and every table is
+# one record batch with 64-bit string offsets: memory-mapping a file and
+# turning it into a pandas dataframe copies nothing, and processes reading the
+# same table share its pages in the page cache. modin and xorbits copy the
+# mapped table into their object stores. The first run reading a table writes
+# its file.
+
+cache_dir = "_cache"
+
+# cache key of every dataset read by this process
+dataset_keys = {}
+
+
+def dataset_checksum(root):
+    h = hashlib.sha256()
+    manifest = os.path.join(root, "_manifest.json")
+    if os.path.exists(manifest):
+        with open(manifest, "rb") as f:
+            h.update(f.read())
+        return h.hexdigest()[:16]
+    # datasets without a manifest are known by the sizes and times of their
+    # files
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("_"))
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            rel = os.path.relpath(path, root)
+            h.update(f"{rel},{stat.st_size},{stat.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:16]
+
+
+def cache_key(root):
+    if root not in dataset_keys:
+        dataset_keys[root] = f"{dataset_checksum(root)}-v{schema_version}"
+    return dataset_keys[root]
+
+
+def decoded_table(data_path, table_name):
+    # the whole table with dates as timestamps and large strings, in one chunk
+    table = arrow_dataset(data_path, table_name, "parquet").to_table()
+    fields = []
+    for field in table.schema:
+        if field.name in date_columns[table_name]:
+            field = field.with_type(pa.timestamp("s"))
+        elif pa.types.is_string(field.type):
+            field = field.with_type(pa.large_string())
+        fields.append(field)
+    table = table.cast(pa.schema(fields))
+    return table.unify_dictionaries().combine_chunks()
+
+
+def write_cache(path, table):
+    key_dir = os.path.dirname(path)
+    base = os.path.dirname(key_dir)
+    # caches of other keys are stale. Processes still mapping their files
+    # keep reading them after they are removed.
+    if os.path.isdir(base):
+        for name in os.listdir(base):
+            if name != os.path.basename(key_dir):
+                shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+    os.makedirs(key_dir, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def cached_table(data_path, table_name, columns=None):
+    # the decoded table of the dataset file or directory `data_path`,
+    # memory-mapped, writing its cache file first if there is none
+    root = os.path.dirname(data_path.rstrip("/"))
+    path = os.path.join(root, cache_dir, cache_key(root), f"{table_name}.arrow")
+    if not os.path.exists(path):
+        write_cache(path, decoded_table(data_path, table_name))
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.select(columns) if columns is not None else table
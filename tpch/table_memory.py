@@ -0,0 +1,108 @@
+import collections
+
+# Tables loaded by a query runner and kept in memory for the next queries.
+# Without a budget every table stays loaded. With one, storing a table that
+# does not fit evicts tables until it does: first those that no remaining
+# query reads, then those whose next use is furthest away, the least recently
+# used first among equals. The tables of the running query are never evicted,
+# so the resident tables exceed the budget only when a single query needs
+# more. Tables changed by the refresh functions are pinned, as reading them
+# again would undo the refresh.
+
+budget_bytes = None
+# table name -> dataframe, the least recently used first
+tables = collections.OrderedDict()
+table_bytes = {}
+pinned = set()
+# the tables of the running query and of every query after it, in order
+upcoming = []
+peak_bytes = 0
+
+
+def set_budget(nbytes):
+    global budget_bytes
+    budget_bytes = nbytes
+
+
+def set_upcoming(table_sets):
+    upcoming[:] = [set(names) for names in table_sets]
+
+
+def resident_bytes():
+    return sum(table_bytes.values())
+
+
+def get_table(table_name):
+    # the stored table, or None
+    if table_name not in tables:
+        return None
+    tables.move_to_end(table_name)
+    return tables[table_name]
+
+
+def next_use(table_name):
+    for i, names in enumerate(upcoming):
+        if table_name in names:
+            return i
+    return len(upcoming)
+
+
+def evict(nbytes):
+    # drop tables until nbytes more fit in the budget
+    running = upcoming[0] if upcoming else set()
+    while resident_bytes() + nbytes > budget_bytes:
+        candidates = [
+            name for name in tables if name not in pinned and name not in running
+        ]
+        if not candidates:
+            return
+        # max() keeps the first, least recently used, of equal next uses
+        victim = max(candidates, key=next_use)
+        del tables[victim]
+        del table_bytes[victim]
+
+
+def put_table(table_name, df, sizeof, pin=False):
+    # store a table. sizeof(df) gives its bytes, only computed with a budget.
+    global peak_bytes
+    tables.pop(table_name, None)
+    table_bytes.pop(table_name, None)
+    nbytes = 0
+    if budget_bytes is not None:
+        nbytes = int(sizeof(df))
+        evict(nbytes)
+    tables[table_name] = df
+    table_bytes[table_name] = nbytes
+    if pin:
+        pinned.add(table_name)
+    peak_bytes = max(peak_bytes, resident_bytes())
+
+
+def frame_nbytes(df, sample_rows=1000):
+    # bytes of a pandas or modin dataframe. memory_usage(deep=True) measures
+    # every python string of the object columns on every insert, so those
+    # are sized from their first rows instead.
+    nbytes = df.memory_usage(index=False).sum()
+    objects = [c for c in df.columns if df[c].dtype == object]
+    if objects and len(df):
+        head = df[objects].head(sample_rows)
+        deep = head.memory_usage(deep=True, index=False).sum()
+        deep -= head.memory_usage(index=False).sum()
+        nbytes += deep * len(df) / len(head)
+    return nbytes
+
+
+def query_order(queries, query_tables, table_weights):
+    # the queries reordered so that consecutive queries share as much table
+    # data as they can: after each query comes the one sharing the largest
+    # weight of tables with it, the first in the given order among equals
+    remaining = list(queries)
+    order = [remaining.pop(0)] if remaining else []
+    while remaining:
+        previous = set(query_tables[order[-1]])
+        shared = [
+            sum(table_weights[name] for name in previous & set(query_tables[q]))
+            for q in remaining
+        ]
+        order.append(remaining.pop(shared.index(max(shared))))
+    return order
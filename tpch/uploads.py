@@ -0,0 +1,73 @@
+import hashlib
+import io
+
+import pyarrow.fs as pafs
+
+from profiling import stage
+
+# Uploads of the files written to an object store. Writers stream every file
+# into an output stream of pyarrow's S3 filesystem, which sends it as a
+# multipart upload with the parts uploading in the background while the
+# writer goes on. The checksum and size of a file are taken from the bytes
+# as they are written, so the file is never read back. The bytes written
+# and not yet confirmed uploaded are bounded by the worker's budget: a
+# writer that reaches it waits for its pending parts before writing more.
+
+default_budget_bytes = 1024 * 1024 * 1024
+
+budget_bytes = default_budget_bytes
+# files uploaded by UploadStream and not yet recorded, path -> size and checksum
+written = {}
+
+
+def is_remote(path):
+    return "://" in path
+
+
+def set_budget(nbytes):
+    # the budget of this worker process
+    global budget_bytes
+    budget_bytes = nbytes
+
+
+class UploadStream(io.RawIOBase):
+    # file object writing to an object store, for the format writers
+    def __init__(self, path):
+        fs, fpath = pafs.FileSystem.from_uri(path)
+        self.path = path
+        self.stream = fs.open_output_stream(fpath)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.in_flight = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        n = memoryview(data).nbytes
+        self.stream.write(data)
+        self.digest.update(data)
+        self.size += n
+        self.in_flight += n
+        if self.in_flight > budget_bytes:
+            # flush() returns once the pending parts are uploaded
+            with stage("upload_wait"):
+                self.stream.flush()
+            self.in_flight = 0
+        return n
+
+    def close(self):
+        if not self.closed:
+            # closing completes the upload
+            with stage("upload_wait"):
+                self.stream.close()
+            written[self.path] = {
+                "bytes": self.size,
+                "checksum": "sha256:" + self.digest.hexdigest(),
+            }
+        super().close()
+
+
+def take_files(paths):
+    # the size and checksum of the given files that were uploaded
+    return {path: written.pop(path) for path in paths if path in written}
@@ -1,4 +1,7 @@
+import os
+import sys
 import argparse
+import glob
 import json
 import time
 import traceback
@@ -9,33 +12,58 @@ import vaex
 
 from utils import append_row
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+from schema import date_columns, money_columns
+from common_utils import MONEY_SCALE
+
+
+def decode_money(df, table_name: str):
+    # --money decimal or int datasets store the money columns exactly, the
+    # queries work on float64
+    for column in money_columns.get(table_name, []):
+        data_type = df[column].data_type()
+        if data_type.is_integer:
+            df[column] = df[column] / MONEY_SCALE
+        elif not data_type.is_float:
+            df[column] = df[column].astype("float64")
+    return df
+
+
+def open_files(data_path: str):
+    # vaex.open globs non-recursively, so the year=/month= directories of
+    # tables written with --partition_by are listed here
+    return vaex.open_many(sorted(glob.glob(data_path, recursive=True)))
+
+
 def load_lineitem(root: str):
-    data_path = root + "/lineitem.parquet/*.parquet"
-    df = vaex.open(data_path)
+    data_path = root + "/lineitem.parquet/**/*.parquet"
+    df = open_files(data_path)
 
-    df["L_SHIPDATE"] = df.L_SHIPDATE.astype('datetime64[ns]')
-    df["L_RECEIPTDATE"] = df.L_RECEIPTDATE.astype('datetime64[ns]')
-    df["L_COMMITDATE"] = df.L_COMMITDATE.astype('datetime64[ns]')
-    return df
+    for column in date_columns["lineitem"]:
+        df[column] = df[column].astype("datetime64[ns]")
+    return decode_money(df, "lineitem")
 
 
 def load_part(root: str):
     data_path = root + "/part.parquet/*.parquet"
     df = vaex.open(data_path)
-    return df
+    return decode_money(df, "part")
 
 
 def load_orders(root: str):
-    data_path = root + "/orders.parquet/*.parquet"
-    df = vaex.open(data_path)
-    df["O_ORDERDATE"] = df.O_ORDERDATE.astype('datetime64[ns]')
-    return df
+    data_path = root + "/orders.parquet/**/*.parquet"
+    df = open_files(data_path)
+    for column in date_columns["orders"]:
+        df[column] = df[column].astype("datetime64[ns]")
+    return decode_money(df, "orders")
 
 
 def load_customer(root: str):
     data_path = root + "/customer.parquet/*.parquet"
     df = vaex.open(data_path)
-    return df
+    return decode_money(df, "customer")
 
 
 def load_nation(root: str):
@@ -51,15 +79,15 @@ def load_region(root: str):
 
 
 def load_supplier(root: str):
-    data_path = root + "/supplier.parquet"
+    data_path = root + "/supplier.parquet/*.parquet"
     df = vaex.open(data_path)
-    return df
+    return decode_money(df, "supplier")
 
 
 def load_partsupp(root: str):
     data_path = root + "/partsupp.parquet/*.parquet"
     df = vaex.open(data_path)
-    return df
+    return decode_money(df, "partsupp")
 
 
 def q01(root: str):